@@ -2792,6 +2792,17 @@ CREATE TABLE "raincell_data" (
 );
 INSERT INTO gpkg_contents (table_name, data_type) VALUES ('raincell_data', 'aspatial');
 
+CREATE TABLE "grid_raster_alignment" (
+    "fid" INTEGER PRIMARY KEY NOT NULL,
+    "geotransform" TEXT, -- GDAL geotransform of the raster pixels lattice
+    "width" INTEGER,
+    "height" INTEGER,
+    "crs" TEXT,
+    "grid_hash" TEXT, -- hash of the grid layout the pixels were calculated for
+    "pixels" BLOB -- flat raster pixel indexes (int64) of grid cells centroids, -1 outside the raster
+);
+INSERT INTO gpkg_contents (table_name, data_type) VALUES ('grid_raster_alignment', 'aspatial');
+
 CREATE TABLE "buildings_areas" (
     "fid" INTEGER NOT NULL PRIMARY KEY,
     "adjustment_factor" REAL
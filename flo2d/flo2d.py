@@ -59,7 +59,6 @@ from .flo2d_tools.grid_info_tool import GridInfoTool
 from .flo2d_tools.grid_tools import (
     add_col_and_row_fields,
     assign_col_row_indexes_to_grid,
-    cellIDNumpyArray,
     dirID,
     grid_has_empty_elev,
     number_of_elements,
@@ -69,7 +68,12 @@ from .flo2d_tools.schematic_tools import (
     delete_redundant_levee_directions_np,
     generate_schematic_levees,
 )
-from .geopackage_utils import GeoPackageUtils, connection_required, database_disconnect
+from .geopackage_utils import (
+    GeoPackageUtils,
+    ImportSession,
+    connection_required,
+    database_disconnect,
+)
 from .gui.dlg_components import ComponentsDialog
 from .gui.dlg_cont_toler_jj import ContToler_JJ
 from .gui.dlg_evap_editor import EvapEditorDialog
@@ -129,6 +133,7 @@ class Flo2D(object):
         self.lyrs.group = None
         self.gutils = None
         self.f2g = None
+        self.import_session = None
         self.prep_sql = None
         self.f2d_widget = None
         self.f2d_plot_dock = None
@@ -947,68 +952,80 @@ class Flo2D(object):
         if calls[0] == "export_cont_toler":
             self.files_used = "CONT.DAT\n"
 
-        for call in calls:
-            if call == "export_bridge_xsec":
-                dat = "BRIDGE_XSEC.DAT"
-            elif call == "export_bridge_coeff_data":
-                dat = "BRIDGE_COEFF_DATA.DAT"
-            elif call == "import_hystruc_bridge_xs":
-                dat = "BRIDGE_XSEC.DAT"
-            else:
-                dat = call.split("_")[-1].upper() + ".DAT"
-            if call.startswith("import"):
-                if self.f2g.parser.dat_files[dat] is None:
-                    if dat == "MULT.DAT":
-                        if self.f2g.parser.dat_files["SIMPLE_MULT.DAT"] is None:
+        prefetch = calls[0].startswith("import")
+        if prefetch:
+            # Numeric DAT files are parsed in worker processes while the GeoPackage is written here.
+            self.f2g.prefetch_dat(calls)
+        try:
+            for call in calls:
+                if call == "export_bridge_xsec":
+                    dat = "BRIDGE_XSEC.DAT"
+                elif call == "export_bridge_coeff_data":
+                    dat = "BRIDGE_COEFF_DATA.DAT"
+                elif call == "import_hystruc_bridge_xs":
+                    dat = "BRIDGE_XSEC.DAT"
+                else:
+                    dat = call.split("_")[-1].upper() + ".DAT"
+                if call.startswith("import"):
+                    if self.f2g.parser.dat_files[dat] is None:
+                        if dat == "MULT.DAT":
+                            if self.f2g.parser.dat_files["SIMPLE_MULT.DAT"] is None:
+                                self.uc.log_info('Files required for "{0}" not found. Action skipped!'.format(call))
+                                self.files_not_used += dat + "\n"
+                                continue
+                            else:
+                                self.files_used += "SIMPLE_MULT.DAT\n"
+                                pass
+                        else:
                             self.uc.log_info('Files required for "{0}" not found. Action skipped!'.format(call))
-                            self.files_not_used += dat + "\n"
+                            if dat not in ["WSURF.DAT", "WSTIME.DAT"]:
+                                self.files_not_used += dat + "\n"
                             continue
-                        else:
-                            self.files_used += "SIMPLE_MULT.DAT\n"
-                            pass
                     else:
-                        self.uc.log_info('Files required for "{0}" not found. Action skipped!'.format(call))
-                        if dat not in ["WSURF.DAT", "WSTIME.DAT"]:
+                        if dat == "MULT.DAT":
+                            self.files_used += dat + " and/or SIMPLE_MULT.DAT" + "\n"
+                            pass
+                        elif os.path.getsize(os.path.join(last_dir, dat)) > 0:
+                            self.files_used += dat + "\n"
+                            if dat == "CHAN.DAT":
+                                self.files_used += "CHANBANK.DAT" + "\n"
+                            pass
+                        else:
                             self.files_not_used += dat + "\n"
-                        continue
-                else:
-                    if dat == "MULT.DAT":
-                        self.files_used += dat + " and/or SIMPLE_MULT.DAT" + "\n"
-                        pass
-                    elif os.path.getsize(os.path.join(last_dir, dat)) > 0:
-                        self.files_used += dat + "\n"
-                        if dat == "CHAN.DAT":
-                            self.files_used += "CHANBANK.DAT" + "\n"
-                        pass
-                    else:
-                        self.files_not_used += dat + "\n"
-                        continue
+                            continue
 
-            try:
-                start_time = time.time()
-
-                method = getattr(self.f2g, call)
-
-                if method(*args):
-                    if call.startswith("export"):
-                        self.files_used += dat + "\n"
-                        if dat == "CHAN.DAT":
-                            self.files_used += "CHANBANK.DAT" + "\n"
-                        if dat == "SWMMFLO.DAT":
-                            self.files_used += "SWMM.INP" + "\n"
-                        if dat == "TOPO.DAT":
-                            self.files_used += "MANNINGS_N.DAT" + "\n"
-                        if dat == "MULT.DAT":
-                            self.files_used += "SIMPLE_MULT.DAT" + "\n"
-                        pass
+                try:
+                    start_time = time.time()
+
+                    method = getattr(self.f2g, call)
+                    if self.import_session is not None:
+                        self.import_session.checkpoint(call)
+
+                    if method(*args):
+                        if call.startswith("export"):
+                            self.files_used += dat + "\n"
+                            if dat == "CHAN.DAT":
+                                self.files_used += "CHANBANK.DAT" + "\n"
+                            if dat == "SWMMFLO.DAT":
+                                self.files_used += "SWMM.INP" + "\n"
+                            if dat == "TOPO.DAT":
+                                self.files_used += "MANNINGS_N.DAT" + "\n"
+                            if dat == "MULT.DAT":
+                                self.files_used += "SIMPLE_MULT.DAT" + "\n"
+                            pass
 
-                self.uc.log_info('{0:.3f} seconds => "{1}"'.format(time.time() - start_time, call))
+                    self.uc.log_info('{0:.3f} seconds => "{1}"'.format(time.time() - start_time, call))
 
-            except Exception as e:
-                if debug is True:
-                    self.uc.log_info(traceback.format_exc())
-                else:
-                    raise
+                except Exception as e:
+                    if self.import_session is not None:
+                        self.import_session.rollback_to_checkpoint()
+                    if debug is True:
+                        self.uc.log_info(traceback.format_exc())
+                    else:
+                        raise
+        finally:
+            if prefetch:
+                self.f2g.parser.close_prefetch()
 
     @connection_required
     def import_gds(self):
@@ -1276,15 +1293,17 @@ class Flo2D(object):
                         "xsec_n_data",
                     ]
 
-                    for table in tables:
-                        self.gutils.clear_tables(table)
+                    # All tables are cleared and imported in a single transaction.
+                    with ImportSession(self.gutils, self, self.f2g, self.f2g.gutils) as self.import_session:
+                        for table in tables:
+                            self.gutils.clear_tables(table)
 
-                    self.call_IO_methods(import_calls, True)  # The strings list 'export_calls', contains the names of
-                    # the methods in the class Flo2dGeoPackage to import (read) the
-                    # FLO-2D .DAT files
+                        self.call_IO_methods(import_calls, True)  # The strings list 'export_calls', contains the names of
+                        # the methods in the class Flo2dGeoPackage to import (read) the
+                        # FLO-2D .DAT files
 
-                    # save CRS to table cont
-                    self.gutils.set_cont_par("PROJ", self.crs.toProj4())
+                        # save CRS to table cont
+                        self.gutils.set_cont_par("PROJ", self.crs.toProj4())
 
                     # load layers and tables
                     self.load_layers()
@@ -1339,6 +1358,7 @@ class Flo2D(object):
                     QApplication.restoreOverrideCursor()
                     self.uc.show_error("ERROR 050521.0349: importing .DAT files!.\n", e)
                 finally:
+                    self.import_session = None
                     QApplication.restoreOverrideCursor()
                     if self.files_used != "" or self.files_not_used != "":
                         self.uc.show_info(
@@ -2467,9 +2487,7 @@ class Flo2D(object):
                 self.gutils.con.execute(qryIndexDrop)
                 self.gutils.con.commit()
 
-                leveesToDelete = delete_redundant_levee_directions_np(
-                    self.gutils, cellIDNumpyArray
-                )  # pass grid layer if it exists
+                leveesToDelete = delete_redundant_levee_directions_np(self.gutils)
                 # leveesToDelete = delete_levee_directions_duplicates(self.gutils, levees, grid_lyr)
                 if len(leveesToDelete) > 0:
                     k = 0
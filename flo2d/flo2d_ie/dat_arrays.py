@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from ..flo2d_tools.lidar_binning import spawn_process_context
+
+# Module is imported by the worker processes, so it must not depend on QGIS.
+
+
+def numeric_blocks(path, usecols=None, blocksize=100000):
+    """
+    Generator of 2D float arrays read from DAT file with numeric columns in blocks of 'blocksize' lines.
+    Non-numeric columns (e.g. line tags) have to be skipped with 'usecols'.
+    """
+    with open(path, "r") as f:
+        lines = (line for line in f if not line.isspace())
+        while True:
+            block = list(islice(lines, blocksize))
+            if not block:
+                break
+            if usecols is None:
+                columns = len(block[0].split())
+                try:
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("error")
+                        values = np.fromstring("".join(block), sep=" ")
+                    if values.size == len(block) * columns:
+                        yield values.reshape(-1, columns)
+                        continue
+                except (ValueError, DeprecationWarning):
+                    pass
+            yield np.loadtxt(block, dtype=float, usecols=usecols, ndmin=2)
+
+
+def read_numeric_dat(path, usecols=None, blocksize=100000):
+    """
+    Process pool task reading the whole numeric DAT file into a single 2D float array.
+    """
+    blocks = list(numeric_blocks(path, usecols, blocksize))
+    if not blocks:
+        return np.empty((0, len(usecols) if usecols else 0), dtype=float)
+    return np.concatenate(blocks)
+
+
+def dat_process_pool(max_workers):
+    """
+    Return process pool for 'read_numeric_dat' tasks.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=spawn_process_context())
@@ -9,6 +9,8 @@
 # of the License, or (at your option) any later version
 import os
 from collections import OrderedDict, defaultdict
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
 from itertools import chain, repeat, zip_longest
 from operator import attrgetter
 from typing import Any
@@ -19,6 +21,7 @@ from qgis.PyQt.QtCore import QSettings
 from qgis.PyQt.QtWidgets import QMessageBox
 
 from ..utils import Msge
+from .dat_arrays import dat_process_pool, numeric_blocks, read_numeric_dat
 
 try:
     import h5py
@@ -59,6 +62,8 @@ class ParseHDF5:
         self.hdf5_filepath = None
         self.read_mode = "r"
         self.write_mode = "w"
+        self.chunksize = 100000
+        self.compression = None
 
     @property
     def control_group(self):
@@ -125,6 +130,17 @@ class ParseHDF5:
             group.create_dataset(dataset_name, [])
         return group
 
+    @property
+    def grid_dtypes(self):
+        dtypes = {
+            "GRIDCODE": np.int64,
+            "MANNING": np.float64,
+            "X": np.float64,
+            "Y": np.float64,
+            "Z": np.float64,
+        }
+        return dtypes
+
     @property
     def neighbors_group(self):
         group_name = "Neighbors"
@@ -152,13 +168,59 @@ class ParseHDF5:
     def write_group_datasets(hdf5_file, group):
         hdf5_group = hdf5_file.create_group(group.name)
         for dataset in sorted(group.datasets.values(), key=attrgetter("name")):
-            hdf5_group.create_dataset(dataset.name, data=dataset.data)
+            if isinstance(dataset.data, np.ndarray) and dataset.data.size > 0:
+                # Large NumPy arrays are written as single chunked datasets.
+                hdf5_group.create_dataset(dataset.name, data=dataset.data, chunks=True)
+            else:
+                hdf5_group.create_dataset(dataset.name, data=dataset.data)
 
     def write_groups(self, *groups):
         with h5py.File(self.hdf5_filepath, self.write_mode) as f:
             for group in groups:
                 self.write_group_datasets(f, group)
 
+    def create_slab_datasets(self, hdf5_file, group_name, size, dtypes):
+        """
+        Create group of preallocated, typed and chunked 1D datasets.
+        """
+        hdf5_group = hdf5_file.require_group(group_name)
+        chunks = (max(1, min(self.chunksize, size)),)
+        datasets = {}
+        for dataset_name, dtype in sorted(dtypes.items()):
+            datasets[dataset_name] = hdf5_group.create_dataset(
+                dataset_name, shape=(size,), dtype=dtype, chunks=chunks, compression=self.compression
+            )
+        return datasets
+
+    def write_slabs(self, group_name, size, dtypes, slabs):
+        """
+        Write group of 1D datasets from iterable of slabs (dictionaries of dataset names and arrays).
+        Only one slab is kept in memory at a time.
+        """
+        with h5py.File(self.hdf5_filepath, self.write_mode) as f:
+            datasets = self.create_slab_datasets(f, group_name, size, dtypes)
+            start = 0
+            for slab in slabs:
+                end = start
+                for dataset_name, data in slab.items():
+                    end = start + len(data)
+                    datasets[dataset_name][start:end] = data
+                start = end
+        return start
+
+    def read_slabs(self, group_name, dataset_names, slab_size=None):
+        """
+        Generator of slabs (dictionaries of dataset names and arrays) read from group datasets.
+        """
+        slab_size = slab_size or self.chunksize
+        with h5py.File(self.hdf5_filepath, self.read_mode) as f:
+            hdf5_group = f[group_name]
+            datasets = [hdf5_group[dataset_name] for dataset_name in dataset_names]
+            size = min(dataset.shape[0] for dataset in datasets)
+            for start in range(0, size, slab_size):
+                end = min(start + slab_size, size)
+                yield {dataset.name.rsplit("/", 1)[-1]: dataset[start:end] for dataset in datasets}
+
     def write(self, dataset):
         with h5py.File(self.hdf5_filepath, self.write_mode) as f:
             group = dataset.group
@@ -207,29 +269,42 @@ class ParseHDF5:
             return 0
         if not os.path.getsize(self.hdf5_filepath) > 0:
             return 0
-        x_dataset = self.read("X", "Grid")
-        x_data = x_dataset.data
-        first_x = x_data[0]
-        dx_coords = (abs(first_x - x) for x in x_data)
-        try:
-            size = min(dx for dx in dx_coords if dx > 0)
-        except ValueError:
-            y_dataset = self.read("Y", "Grid")
-            y_data = y_dataset.data
-            first_y = y_data[0]
-            dy_coords = (abs(first_y - y) for y in y_data)
-            size = min(dy for dy in dy_coords if dy > 0)
-        cell_size += size
+        x_dataset = self.read("X", "Grid", slice(0, self.chunksize))
+        y_dataset = self.read("Y", "Grid", slice(0, self.chunksize))
+        cell_size += grid_spacing(x_dataset.data, y_dataset.data)
         return cell_size
 
 
+def grid_spacing(xs, ys):
+    """
+    Return the smallest non-zero spacing of cells centroids coordinates (cell size of a regular grid).
+    """
+    spacings = []
+    for coords in (xs, ys):
+        steps = np.diff(np.unique(np.round(np.asarray(coords, dtype=float), 4)))
+        if steps.size:
+            spacings.append(steps.min())
+    return float(min(spacings)) if spacings else 0
+
+
 class ParseDAT(object):
     """
     Parser object for handling FLO-2D "DAT" files.
     """
 
+    # Numeric DAT files which can be read into arrays by the worker processes, with their numeric columns.
+    NUMERIC_DAT = {
+        "MANNINGS_N.DAT": None,
+        "TOPO.DAT": None,
+        "FPFROUDE.DAT": (1, 2),
+        "TOLSPATIAL.DAT": None,
+    }
+
     def __init__(self):
         self.project_dir = None
+        self.prefetched = {}
+        self.prefetch_min_bytes = 1024 * 1024
+        self.executor = None
         self.dat_files = {
             "CONT.DAT": None,
             "TOLER.DAT": None,
@@ -293,32 +368,6 @@ class ParseDAT(object):
             else:
                 pass
 
-    def _calculate_cellsize(self):
-        fplain = self.dat_files["FPLAIN.DAT"]
-        cadpts = self.dat_files["CADPTS.DAT"]
-        neighbour = None
-        side = 0
-
-        with open(fplain) as fpl:
-            for n in fpl.readline().split()[1:5]:
-                if n != "0":
-                    neighbour = int(n)
-                    break
-                else:
-                    pass
-                side += 1
-
-        with open(cadpts) as cad:
-            x1, y1 = cad.readline().split()[1:]
-            for dummy in range(neighbour - 2):
-                cad.readline()
-            x2, y2 = cad.readline().split()[1:]
-
-        dtx = abs(float(x1) - float(x2))
-        dty = abs(float(y1) - float(y2))
-        cell_size = dty if side % 2 == 0 else dtx
-        return cell_size
-
     def calculate_cellsize(self):
         cell_size = 0
         topo = self.dat_files["TOPO.DAT"]
@@ -328,19 +377,9 @@ class ParseDAT(object):
             return 0
         if not os.path.getsize(topo) > 0:
             return 0
-        with open(topo) as top:
-            first_coord = top.readline().split()[:2]
-            first_x = float(first_coord[0])
-            first_y = float(first_coord[1])
-            top.seek(0)
-            dx_coords = (abs(first_x - float(row.split()[0])) for row in top)
-            try:
-                size = min(dx for dx in dx_coords if dx > 0)
-            except ValueError:
-                top.seek(0)
-                dy_coords = (abs(first_y - float(row.split()[1])) for row in top)
-                size = min(dy for dy in dy_coords if dy > 0)
-            cell_size += size
+        for block in self.numeric_blocks(topo):
+            cell_size += grid_spacing(block[:, 0], block[:, 1])
+            break
         return cell_size
 
     @staticmethod
@@ -359,6 +398,59 @@ class ParseDAT(object):
                 if row:
                     yield row
 
+    @staticmethod
+    def numeric_blocks(file1, usecols=None, blocksize=100000):
+        return numeric_blocks(file1, usecols, blocksize)
+
+    def prefetch_numeric(self, *dat_names, max_workers=None):
+        """
+        Start reading given numeric DAT files into arrays in a pool of worker processes,
+        so they are parsed while the GeoPackage is written by the import loop.
+        Missing files and files smaller than 'prefetch_min_bytes' are left to be read on demand.
+        """
+        paths = OrderedDict()
+        for name in dat_names:
+            path = self.dat_files.get(name)
+            if name in self.NUMERIC_DAT and name not in self.prefetched and path and os.path.isfile(path):
+                if os.path.getsize(path) >= self.prefetch_min_bytes:
+                    paths[name] = path
+        if not paths:
+            return
+        workers = min(max_workers or os.cpu_count() or 1, len(paths))
+        try:
+            self.executor = dat_process_pool(workers)
+            for name, path in paths.items():
+                self.prefetched[name] = self.executor.submit(read_numeric_dat, path, self.NUMERIC_DAT[name])
+        except (OSError, RuntimeError):
+            self.close_prefetch()
+
+    def close_prefetch(self):
+        for future in self.prefetched.values():
+            future.cancel()
+        self.prefetched.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def numeric_arrays(self, dat_name, blocksize=100000):
+        """
+        Generator of 2D float arrays of the numeric DAT file in blocks of 'blocksize' rows.
+        Prefetched arrays are taken from the worker process, other files are read in place.
+        """
+        future = self.prefetched.pop(dat_name, None)
+        values = None
+        if future is not None:
+            try:
+                values = future.result()
+            except (BrokenProcessPool, CancelledError):
+                # Worker processes couldn't be started (or were stopped), so the file is read in place.
+                values = None
+        if values is None:
+            yield from self.numeric_blocks(self.dat_files[dat_name], self.NUMERIC_DAT[dat_name], blocksize)
+            return
+        for start in range(0, values.shape[0], blocksize):
+            yield values[start : start + blocksize]
+
     @staticmethod
     def fix_row_size(row, fix_size, default=None, index=None):
         loops = fix_size - len(row)
@@ -404,6 +496,16 @@ class ParseDAT(object):
         results = self.double_parser(mannings_n, topo)
         return results
 
+    def parse_mannings_n_topo_arrays(self, blocksize=100000):
+        """
+        Generator of (fid, n_value, x, y, elevation) arrays read from MANNINGS_N.DAT and TOPO.DAT in blocks.
+        """
+        mannings_n = self.numeric_arrays("MANNINGS_N.DAT", blocksize)
+        topo = self.numeric_arrays("TOPO.DAT", blocksize)
+        for man, top in zip(mannings_n, topo):
+            rows = min(man.shape[0], top.shape[0])
+            yield man[:rows, 0].astype(np.int64), man[:rows, 1], top[:rows, 0], top[:rows, 1], top[:rows, 2]
+
     def parse_inflow(self):
         inflow = self.dat_files["INFLOW.DAT"]
         par = self.single_parser(inflow)
@@ -863,6 +965,13 @@ class ParseDAT(object):
         data = [row[1:] for row in par]
         return data
 
+    def parse_fpfroude_arrays(self):
+        """
+        Return (fid, froudefp) arrays read from FPFROUDE.DAT.
+        """
+        values = np.concatenate([np.empty((0, 2))] + list(self.numeric_arrays("FPFROUDE.DAT")))
+        return values[:, 0].astype(np.int64), values[:, 1]
+
     def parse_gutter(self):
         gutter = self.dat_files["GUTTER.DAT"]
         par = self.single_parser(gutter)
@@ -918,6 +1027,13 @@ class ParseDAT(object):
         data = [row for row in par]
         return data
 
+    def parse_tolspatial_arrays(self):
+        """
+        Return (fid, tol) arrays read from TOLSPATIAL.DAT.
+        """
+        values = np.concatenate([np.empty((0, 2))] + list(self.numeric_arrays("TOLSPATIAL.DAT")))
+        return values[:, 0].astype(np.int64), values[:, 1]
+
     def parse_wsurf(self):
         wsurf = self.dat_files["WSURF.DAT"]
         par = self.single_parser(wsurf)
@@ -19,7 +19,8 @@ from qgis.core import NULL, QgsApplication
 from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtWidgets import QApplication
 
-from ..flo2d_tools.grid_tools import grid_compas_neighbors
+from ..flo2d_tools.grid_index import cached_grid_index
+from ..flo2d_tools.grid_tools import grid_neighbors_matrix
 from ..geopackage_utils import GeoPackageUtils
 from ..gui.bc_editor_widget import BCEditorWidget
 from ..layers import Layers
@@ -27,6 +28,17 @@ from ..utils import BC_BORDER, float_or_zero, get_BC_Border
 from .flo2d_parser import ParseDAT, ParseHDF5
 
 
+def format_columns(line_format, *columns):
+    """
+    Format whole block of column arrays with a single %-style operation (one line per row).
+    """
+    rows_count = len(columns[0])
+    if rows_count == 0:
+        return ""
+    values = np.column_stack(columns).ravel().tolist()
+    return (line_format * rows_count) % tuple(values)
+
+
 class Flo2dGeoPackage(GeoPackageUtils):
     """
     Class for proper import and export FLO-2D data.
@@ -35,6 +47,13 @@ class Flo2dGeoPackage(GeoPackageUtils):
     FORMAT_DAT = "DAT"
     FORMAT_HDF5 = "HDF5"
 
+    # Numeric DAT files read by the import methods.
+    IMPORT_NUMERIC_DAT = {
+        "import_mannings_n_topo": ["MANNINGS_N.DAT", "TOPO.DAT"],
+        "import_fpfroude": ["FPFROUDE.DAT"],
+        "import_tolspatial": ["TOLSPATIAL.DAT"],
+    }
+
     def __init__(self, con, iface, parsed_format=FORMAT_DAT):
         super(Flo2dGeoPackage, self).__init__(con, iface)
         self.parsed_format = parsed_format
@@ -43,6 +62,7 @@ class Flo2dGeoPackage(GeoPackageUtils):
         self.buffer = None
         self.shrink = None
         self.chunksize = float("inf")
+        self.grid_chunksize = 100000
         self.gutils = GeoPackageUtils(con, iface)
         self.lyrs = Layers(iface)
         self.export_messages = ""
@@ -70,6 +90,26 @@ class Flo2dGeoPackage(GeoPackageUtils):
         self.shrink = self.cell_size * 0.95
         return True
 
+    def prefetch_dat(self, calls):
+        """
+        Start parsing numeric DAT files of given import calls in worker processes.
+        Parsed arrays are written by the import methods, so the calling loop stays the only GeoPackage writer.
+        """
+        if self.parsed_format != self.FORMAT_DAT:
+            return
+        dat_names = [name for call in calls for name in self.IMPORT_NUMERIC_DAT.get(call, [])]
+        self.parser.prefetch_numeric(*dat_names)
+
+    def grid_centroids_arrays(self, gids):
+        """
+        Return x and y arrays of centroids of given grid cells.
+        """
+        grid_idx = cached_grid_index(self.gutils)
+        pos = grid_idx.positions(gids)
+        if (pos < 0).any():
+            raise ValueError("Cells {0} are outside of the grid.".format(np.asarray(gids)[pos < 0].tolist()))
+        return grid_idx.x[pos], grid_idx.y[pos]
+
     def import_cont_toler(self):
         if self.parsed_format == self.FORMAT_DAT:
             return self.import_cont_toler_dat()
@@ -123,26 +163,14 @@ class Flo2dGeoPackage(GeoPackageUtils):
         try:
             sql = ["""INSERT INTO grid (fid, n_value, elevation, geom) VALUES""", 4]
 
-            self.clear_tables("grid")
-            data = self.parser.parse_mannings_n_topo()
-
-            c = 0
-            man = slice(0, 2)
-            coords = slice(2, 4)
-            elev = slice(4, None)
-            for row in data:
-                if c < self.chunksize:
-                    geom = " ".join(row[coords])
-                    g = self.build_square(geom, self.cell_size)
-                    sql += [tuple(row[man] + row[elev] + [g])]
-                    c += 1
-                else:
+            data = self.parser.parse_mannings_n_topo_arrays(self.grid_chunksize)
+
+            with self.bulk_load("grid"):
+                self.clear_tables("grid")
+                for fid, man, x, y, elev in data:
+                    squares = self.build_squares_xy(x, y, self.cell_size)
+                    sql += zip(fid.tolist(), man.tolist(), elev.tolist(), squares)
                     self.batch_execute(sql)
-                    c = 0
-            if len(sql) > 2:
-                self.batch_execute(sql)
-            else:
-                pass
 
         except Exception as e:
             QApplication.restoreOverrideCursor()
@@ -152,33 +180,13 @@ class Flo2dGeoPackage(GeoPackageUtils):
         try:
             sql = ["""INSERT INTO grid (fid, n_value, elevation, geom) VALUES""", 4]
 
-            self.clear_tables("grid")
-            grid_group = self.parser.read_groups("Grid")[0]
-
-            c = 0
-            grid_code_list = grid_group.datasets["GRIDCODE"].data
-            manning_list = grid_group.datasets["MANNING"].data
-            elevation_list = grid_group.datasets["Z"].data
-            x_list = grid_group.datasets["X"].data
-            y_list = grid_group.datasets["Y"].data
-            for grid_code, manning, z, x, y in zip(grid_code_list, manning_list, elevation_list, x_list, y_list):
-                if c < self.chunksize:
-                    g = self.build_square_xy(x, y, self.cell_size)
-                    row_value = (
-                        str(grid_code),
-                        str(manning),
-                        str(z),
-                        g,
-                    )
-                    sql.append(row_value)
-                    c += 1
-                else:
+            datasets = ["GRIDCODE", "MANNING", "Z", "X", "Y"]
+            with self.bulk_load("grid"):
+                self.clear_tables("grid")
+                for slab in self.parser.read_slabs("Grid", datasets, self.grid_chunksize):
+                    squares = self.build_squares_xy(slab["X"], slab["Y"], self.cell_size)
+                    sql += zip(slab["GRIDCODE"].tolist(), slab["MANNING"].tolist(), slab["Z"].tolist(), squares)
                     self.batch_execute(sql)
-                    c = 0
-            if len(sql) > 2:
-                self.batch_execute(sql)
-            else:
-                pass
 
         except Exception as e:
             QApplication.restoreOverrideCursor()
@@ -1470,14 +1478,11 @@ class Flo2dGeoPackage(GeoPackageUtils):
         cells_sql = ["""INSERT INTO fpfroude_cells (area_fid, grid_fid) VALUES""", 2]
 
         self.clear_tables("fpfroude", "fpfroude_cells")
-        data = self.parser.parse_fpfroude()
-        gids = (x[0] for x in data)
-        cells = self.grid_centroids(gids)
-        for i, row in enumerate(data, 1):
-            gid, froudefp = row
-            geom = self.build_square(cells[gid], self.shrink)
-            fpfroude_sql += [(geom, froudefp)]
-            cells_sql += [(i, gid)]
+        gids, froudefp = self.parser.parse_fpfroude_arrays()
+        xs, ys = self.grid_centroids_arrays(gids)
+        squares = self.build_squares_xy(xs, ys, self.shrink)
+        fpfroude_sql += zip(squares, froudefp.tolist())
+        cells_sql += enumerate(gids.tolist(), 1)
 
         self.batch_execute(fpfroude_sql, cells_sql)
 
@@ -1620,14 +1625,11 @@ class Flo2dGeoPackage(GeoPackageUtils):
         cells_sql = ["""INSERT INTO tolspatial_cells (area_fid, grid_fid) VALUES""", 2]
 
         self.clear_tables("tolspatial", "tolspatial_cells")
-        data = self.parser.parse_tolspatial()
-        gids = (x[0] for x in data)
-        cells = self.grid_centroids(gids)
-        for i, row in enumerate(data, 1):
-            gid, tol = row
-            geom = self.build_square(cells[gid], self.shrink)
-            tolspatial_sql += [(geom, tol)]
-            cells_sql += [(i, gid)]
+        gids, tol = self.parser.parse_tolspatial_arrays()
+        xs, ys = self.grid_centroids_arrays(gids)
+        squares = self.build_squares_xy(xs, ys, self.shrink)
+        tolspatial_sql += zip(squares, tol.tolist())
+        cells_sql += enumerate(gids.tolist(), 1)
 
         self.batch_execute(tolspatial_sql, cells_sql)
 
@@ -1794,27 +1796,19 @@ class Flo2dGeoPackage(GeoPackageUtils):
 
     def export_mannings_n_topo_hdf5(self):
         try:
-            sql = (
-                """SELECT fid, n_value, elevation, ST_AsText(ST_Centroid(GeomFromGPB(geom))) FROM grid ORDER BY fid;"""
+            fid, man, elev, x, y, nulls = self.grid_export_arrays()
+            chunksize = self.grid_chunksize
+            slabs = (
+                {
+                    "GRIDCODE": fid[start : start + chunksize],
+                    "MANNING": man[start : start + chunksize],
+                    "Z": elev[start : start + chunksize],
+                    "X": x[start : start + chunksize],
+                    "Y": y[start : start + chunksize],
+                }
+                for start in range(0, fid.shape[0], chunksize)
             )
-            records = self.execute(sql)
-            nulls = 0
-            grid_group = self.parser.grid_group
-            for row in records:
-                fid, man, elev, geom = row
-                if man is None or elev is None:
-                    nulls += 1
-                    if man is None:
-                        man = 0.04
-                    if elev is None:
-                        elev = -9999
-                x, y = [float(coord) for coord in geom.strip("POINT()").split()]
-                grid_group.datasets["GRIDCODE"].data.append(fid)
-                grid_group.datasets["MANNING"].data.append(man)
-                grid_group.datasets["Z"].data.append(elev)
-                grid_group.datasets["X"].data.append(x)
-                grid_group.datasets["Y"].data.append(y)
-            self.parser.write_groups(grid_group)
+            self.parser.write_slabs("Grid", fid.shape[0], self.parser.grid_dtypes, slabs)
             if nulls > 0:
                 QApplication.restoreOverrideCursor()
                 self.uc.show_warn(
@@ -1833,36 +1827,35 @@ class Flo2dGeoPackage(GeoPackageUtils):
             QApplication.setOverrideCursor(Qt.WaitCursor)
             return False
 
+    def grid_export_arrays(self):
+        """
+        Return grid fids, n_values, elevations and centroids coordinates as arrays taken from the grid index.
+        NULL n_values and elevations are replaced with default values, number of such cells is returned as well.
+        """
+        index = cached_grid_index(self.gutils)
+        man = index.n_value.copy()
+        elev = index.elevation.copy()
+        null_man = np.isnan(man)
+        null_elev = np.isnan(elev)
+        nulls = int(np.count_nonzero(null_man | null_elev))
+        man[null_man] = 0.04
+        elev[null_elev] = -9999
+        return index.fid, man, elev, index.x, index.y, nulls
+
     def export_mannings_n_topo_dat(self, outdir):
         try:
-            sql = (
-                """SELECT fid, n_value, elevation, ST_AsText(ST_Centroid(GeomFromGPB(geom))) FROM grid ORDER BY fid;"""
-            )
-            records = self.execute(sql)
+            fid, man, elev, x, y, nulls = self.grid_export_arrays()
             mannings = os.path.join(outdir, "MANNINGS_N.DAT")
             topo = os.path.join(outdir, "TOPO.DAT")
 
-            mline = "{0: >10} {1: >10}\n"
-            tline = "{0: >15} {1: >15} {2: >10}\n"
-            nulls = 0
-            with open(mannings, "w") as m, open(topo, "w") as t:
-                for row in records:
-                    fid, man, elev, geom = row
-                    if man == None or elev == None:
-                        nulls += 1
-                        if man == None:
-                            man = 0.04
-                        if elev == None:
-                            elev = -9999
-                    x, y = geom.strip("POINT()").split()
-                    m.write(mline.format(fid, "{0:.3f}".format(man)))
-                    t.write(
-                        tline.format(
-                            "{0:.4f}".format(float(x)),
-                            "{0:.4f}".format(float(y)),
-                            "{0:.4f}".format(elev),
-                        )
-                    )
+            mline = "%10d %10.3f\n"
+            tline = "%15.4f %15.4f %10.4f\n"
+            chunksize = self.grid_chunksize
+            with open(mannings, "w", buffering=1 << 20) as m, open(topo, "w", buffering=1 << 20) as t:
+                for start in range(0, fid.shape[0], chunksize):
+                    end = start + chunksize
+                    m.write(format_columns(mline, fid[start:end], man[start:end]))
+                    t.write(format_columns(tline, x[start:end], y[start:end], elev[start:end]))
 
             if nulls > 0:
                 QApplication.restoreOverrideCursor()
@@ -1891,10 +1884,10 @@ class Flo2dGeoPackage(GeoPackageUtils):
     def export_neighbours_hdf5(self):
         try:
             neighbors_group = self.parser.neighbors_group
-            for row in grid_compas_neighbors(self.gutils):
-                directions = ["N", "E", "S", "W", "NE", "SE", "SW", "NW"]
-                for direction, neighbor_gid in zip(directions, row):
-                    neighbors_group.datasets[direction].data.append(neighbor_gid)
+            neighbors = grid_neighbors_matrix(self.gutils)
+            directions = ["N", "E", "S", "W", "NE", "SE", "SW", "NW"]
+            for i, direction in enumerate(directions):
+                neighbors_group.datasets[direction].data = np.ascontiguousarray(neighbors[:, i])
             self.parser.write_groups(neighbors_group)
             return True
         except Exception as e:
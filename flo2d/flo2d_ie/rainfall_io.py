@@ -52,35 +52,80 @@ class ASCProcessor(object):
             yield raster_values
 
 
+def rainfall_frames(rows, cells_number):
+    """
+    Generator of rainfall frames (arrays of per cell values) from rows of (iraindum,) ordered by time interval and cell.
+    Rows are fetched one frame at a time. NULL values are written as 0.
+    """
+    while True:
+        frame_rows = rows.fetchmany(cells_number)
+        if not frame_rows:
+            break
+        frame = np.array([row[0] for row in frame_rows], dtype=np.float64)
+        frame[np.isnan(frame)] = 0.0
+        yield frame
+
+
 class HDFProcessor(object):
-    def __init__(self, hdf_path):
+    def __init__(self, hdf_path, compression="gzip", chunk_cells=65536):
         self.hdf_path = hdf_path
+        self.compression = compression
+        self.chunk_cells = chunk_cells
 
     def export_rainfall_to_binary_hdf5(self, header, data):
+        """
+        Writing whole rainfall matrix given as list of per cell time series.
+        """
+        data = np.array(data, dtype=np.float64).reshape(len(data), -1) if len(data) else np.empty((0, 0))
+        return self.export_rainfall_frames(header, data.shape[0], data.T)
+
+    def export_rainfall_frames(self, header, cells_number, frames):
+        """
+        Streaming rainfall frames (one array of values per time interval, ordered by cells) into 'IRAINDUM' dataset.
+        Dataset is chunked by frame and compressed, and its time axis is resized with every appended frame,
+        so only single frame is kept in memory. Returns number of written frames.
+        """
         with h5py.File(self.hdf_path, "w") as hdf_file:
             rainintime, irinters, timestamp = header
-            hdf_file.attrs["hdf5_version"] = np.array([h5py.version.hdf5_version], dtype=np.string_)
-            hdf_file.attrs["plugin"] = np.array(["FLO-2D"], dtype=np.string_)
+            hdf_file.attrs["hdf5_version"] = np.array([h5py.version.hdf5_version], dtype=np.bytes_)
+            hdf_file.attrs["plugin"] = np.array(["FLO-2D"], dtype=np.bytes_)
             grp = hdf_file.create_group("raincell")
-            tstamp = np.array([timestamp], dtype=np.string_)
+            tstamp = np.array([timestamp], dtype=np.bytes_)
             datasets = [
                 (
                     "RAININTIME",
-                    np.int(rainintime),
+                    int(rainintime),
                     "Time interval in minutes of the realtime rainfall data.",
                 ),
-                ("IRINTERS", np.int(irinters), "Number of intervals in the dataset."),
+                ("IRINTERS", int(irinters), "Number of intervals in the dataset."),
                 (
                     "TIMESTAMP",
                     tstamp,
                     "Timestamp indicates the start and end time of the storm.",
                 ),
-                (
-                    "IRAINDUM",
-                    np.array(data),
-                    "Cumulative rainfall in inches or mm over the time interval.",
-                ),
             ]
             for name, value, description in datasets:
                 dts = grp.create_dataset(name, data=value)
-                dts.attrs["description"] = np.array([description], dtype=np.string_)
+                dts.attrs["description"] = np.array([description], dtype=np.bytes_)
+
+            description = "Cumulative rainfall in inches or mm over the time interval."
+            if cells_number == 0:
+                # Chunked dataset can't have zero-length fixed dimension, so there is just an empty one.
+                iraindum = grp.create_dataset("IRAINDUM", shape=(0, 0, 1), dtype=np.float64)
+                iraindum.attrs["description"] = np.array([description], dtype=np.bytes_)
+                return 0
+            iraindum = grp.create_dataset(
+                "IRAINDUM",
+                shape=(cells_number, 0, 1),
+                maxshape=(cells_number, None, 1),
+                dtype=np.float64,
+                chunks=(min(cells_number, self.chunk_cells), 1, 1),
+                compression=self.compression,
+            )
+            iraindum.attrs["description"] = np.array([description], dtype=np.bytes_)
+            frames_number = 0
+            for frame in frames:
+                iraindum.resize(frames_number + 1, axis=1)
+                iraindum[:, frames_number, 0] = frame
+                frames_number += 1
+        return frames_number
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+import numpy as np
+
+
+class Conflicts(object):
+    """
+    Finding grid cells shared by pairs of model components.
+
+    Every component source is a (table, column, condition) triple giving grid cells of the component.
+    Sources are read once and merged into a cell -> components multimap held as (cells, sources) matrix of counts,
+    so all registered pairs are evaluated in a single pass with vectorized column operations.
+    """
+
+    def __init__(self, gutils):
+        self.gutils = gutils
+        self.sources = {}
+        self.pairs = []
+
+    def source_cells(self, table, column, condition=None):
+        """
+        Return grid cells of the component source as int64 array (one item per table row).
+        """
+        key = (table, column, condition)
+        try:
+            return self.sources[key]
+        except KeyError:
+            pass
+        qry = """SELECT {0} FROM {1} WHERE {0} IS NOT NULL""".format(column, table)
+        if condition is not None:
+            qry += " AND ({0})".format(condition)
+        cells = []
+        for (cell,) in self.gutils.execute(qry):
+            try:
+                cells.append(int(cell))
+            except (TypeError, ValueError):
+                continue
+        cells = np.array(cells, dtype=np.int64)
+        self.sources[key] = cells
+        return cells
+
+    def add_pair(self, source1, source2, data=None):
+        """
+        Register pair of sources to evaluate. Sources are (table, column) or (table, column, condition) tuples.
+        Pair of the same source is a conflict of 2 or more component rows in the same cell.
+        """
+        source1 = tuple(source1) + (None,) * (3 - len(source1))
+        source2 = tuple(source2) + (None,) * (3 - len(source2))
+        self.pairs.append((source1, source2, data))
+
+    def multimap(self):
+        """
+        Return (cells, counts, source keys) where 'counts' is (len(cells), len(source keys)) matrix
+        of number of source rows in every cell.
+        """
+        keys = []
+        for source1, source2, data in self.pairs:
+            for source in (source1, source2):
+                if source not in keys:
+                    keys.append(source)
+        columns = [self.source_cells(*key) for key in keys]
+        if columns:
+            all_cells = np.concatenate(columns)
+        else:
+            all_cells = np.zeros(0, dtype=np.int64)
+        cells, inverse = np.unique(all_cells, return_inverse=True)
+        source_idx = np.repeat(np.arange(len(keys)), [c.shape[0] for c in columns])
+        flat = inverse.ravel() * len(keys) + source_idx
+        counts = np.bincount(flat, minlength=cells.shape[0] * len(keys)).reshape(cells.shape[0], len(keys))
+        return cells, counts, keys
+
+    def evaluate(self):
+        """
+        Generator of (data, conflict cells) for all registered pairs, in order of registration.
+        Conflict cells are sorted ascending.
+        """
+        cells, counts, keys = self.multimap()
+        positions = {key: i for i, key in enumerate(keys)}
+        for source1, source2, data in self.pairs:
+            column1 = counts[:, positions[source1]]
+            if source1 == source2:
+                conflicts = column1 > 1
+            else:
+                conflicts = (column1 > 0) & (counts[:, positions[source2]] > 0)
+            yield data, cells[conflicts]
+
+    def clear(self):
+        self.sources.clear()
+        del self.pairs[:]
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from ..misc.gpb import gpb_envelopes
+
+_grid_indexes = {}
+_grid_changes = {}
+
+COMPASS_DIRECTIONS = ("N", "E", "S", "W", "NE", "SE", "SW", "NW")
+COMPASS_OFFSETS = {
+    "N": (0, 1),
+    "E": (1, 0),
+    "S": (0, -1),
+    "W": (-1, 0),
+    "NE": (1, 1),
+    "SE": (1, -1),
+    "SW": (-1, -1),
+    "NW": (-1, 1),
+}
+
+
+class GridIndex(object):
+    """
+    In-memory model of the 'grid' table kept as contiguous NumPy arrays.
+
+    Cells are located on the regular lattice defined by the lower left centroid (x_origin, y_origin) and the cell size.
+    Lattice indexes 'col_idx' and 'row_idx' are counted from 0 at the lower left cell, so the 'col' and 'row' values
+    are the same as in the 'grid' table (starting from 2).
+    """
+
+    def __init__(self, fid, x, y, elevation, n_value, cell_size):
+        self.fid = np.asarray(fid, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.elevation = np.asarray(elevation, dtype=np.float64)
+        self.n_value = np.asarray(n_value, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.count = self.fid.shape[0]
+        self.x_origin = self.x.min() if self.count else 0.0
+        self.y_origin = self.y.min() if self.count else 0.0
+        fcol = (self.x - self.x_origin) / self.cell_size
+        frow = (self.y - self.y_origin) / self.cell_size
+        self.col_idx = np.rint(fcol).astype(np.int64)
+        self.row_idx = np.rint(frow).astype(np.int64)
+        self.col = self.col_idx + 2
+        self.row = self.row_idx + 2
+        self.ncols = int(self.col_idx.max()) + 1 if self.count else 0
+        self.nrows = int(self.row_idx.max()) + 1 if self.count else 0
+        self.fid_raster = np.zeros((self.nrows, self.ncols), dtype=np.int64)
+        self.fid_raster[self.row_idx, self.col_idx] = self.fid
+        aligned = np.allclose(fcol, self.col_idx, atol=1e-3) and np.allclose(frow, self.row_idx, atol=1e-3)
+        self.regular = bool(aligned and np.count_nonzero(self.fid_raster) == self.count)
+        self.contiguous = bool(self.count and self.fid[0] == 1 and self.fid[-1] == self.count)
+        self._fingerprint = None
+
+    @classmethod
+    def from_gpkg(cls, gutils, chunksize=100000):
+        """
+        Reading 'grid' table into the new index. Centroids are taken from the GPB envelopes of the cells.
+        """
+        cell_size = gutils.get_cont_par("CELLSIZE")
+        fids, elevations, n_values, envelopes = [], [], [], []
+        cursor = gutils.con.cursor()
+        cursor.execute("""SELECT fid, elevation, n_value, geom FROM grid ORDER BY fid;""")
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            fid, elev, n_value, geom = zip(*rows)
+            fids.append(np.array(fid, dtype=np.int64))
+            elevations.append(np.array(elev, dtype=np.float64))
+            n_values.append(np.array(n_value, dtype=np.float64))
+            envelopes.append(gpb_envelopes(geom))
+        if not fids:
+            return cls([], [], [], [], [], float(cell_size) if cell_size else 1.0)
+        fid = np.concatenate(fids)
+        envelope = np.concatenate(envelopes)
+        x = (envelope[:, 0] + envelope[:, 1]) * 0.5
+        y = (envelope[:, 2] + envelope[:, 3]) * 0.5
+        missing = np.isnan(x)
+        if missing.any():
+            qry = """SELECT ST_X(ST_Centroid(GeomFromGPB(geom))), ST_Y(ST_Centroid(GeomFromGPB(geom))) FROM grid WHERE fid = ?;"""
+            for i in np.nonzero(missing)[0]:
+                x[i], y[i] = gutils.execute(qry, (int(fid[i]),)).fetchone()
+        if not cell_size:
+            cell_size = envelope[0, 1] - envelope[0, 0]
+        return cls(fid, x, y, np.concatenate(elevations), np.concatenate(n_values), float(cell_size))
+
+    def fingerprint(self):
+        """
+        Return hash of the cells layout (fids, lattice indexes, origin and cell size).
+        It is computed once, as the shared index is rebuilt whenever the 'grid' table changes.
+        """
+        if self._fingerprint is None:
+            sha = hashlib.sha1()
+            sha.update(np.array([self.x_origin, self.y_origin, self.cell_size], dtype=np.float64).tobytes())
+            for array in (self.fid, self.col_idx, self.row_idx):
+                sha.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+            self._fingerprint = sha.hexdigest()
+        return self._fingerprint
+
+    def positions(self, fids):
+        """
+        Return positions of given fids in the index arrays (-1 for fids missing in the grid).
+        """
+        fids = np.asarray(fids, dtype=np.int64)
+        if self.contiguous:
+            pos = fids - 1
+            pos[(fids < 1) | (fids > self.count)] = -1
+            return pos
+        pos = np.searchsorted(self.fid, fids)
+        pos = np.minimum(pos, self.count - 1)
+        pos[self.fid[pos] != fids] = -1
+        return pos
+
+    def lattice_indexes(self, xs, ys):
+        """
+        Return lattice col and row indexes of cells containing points.
+        """
+        col_idx = np.floor((np.asarray(xs, dtype=np.float64) - self.x_origin) / self.cell_size + 0.5).astype(np.int64)
+        row_idx = np.floor((np.asarray(ys, dtype=np.float64) - self.y_origin) / self.cell_size + 0.5).astype(np.int64)
+        return col_idx, row_idx
+
+    def fids_at_indexes(self, col_idx, row_idx):
+        """
+        Return fids of cells on lattice indexes (0 for indexes outside the grid).
+        """
+        col_idx = np.asarray(col_idx, dtype=np.int64)
+        row_idx = np.asarray(row_idx, dtype=np.int64)
+        inside = (col_idx >= 0) & (col_idx < self.ncols) & (row_idx >= 0) & (row_idx < self.nrows)
+        fids = np.zeros(col_idx.shape, dtype=np.int64)
+        fids[inside] = self.fid_raster[row_idx[inside], col_idx[inside]]
+        return fids
+
+    def fids_at(self, xs, ys):
+        """
+        Return fids of cells containing points (0 for points outside the grid).
+        """
+        col_idx, row_idx = self.lattice_indexes(xs, ys)
+        return self.fids_at_indexes(col_idx, row_idx)
+
+    def fid_at(self, x, y):
+        """
+        Return fid of cell containing point (x, y) or None.
+        """
+        fid = int(self.fids_at([x], [y])[0])
+        return fid if fid > 0 else None
+
+    def neighbors(self, directions=COMPASS_DIRECTIONS):
+        """
+        Return (N, len(directions)) int32 matrix of neighbouring cells fids (0 where there is no neighbour).
+        Rows follow the order of the index arrays (ascending fid).
+        Irregular grids fall back to matching of the shifted centroids coordinates.
+        """
+        if not self.regular:
+            return self.centroid_neighbors(directions)
+        matrix = np.zeros((self.count, len(directions)), dtype=np.int32)
+        for i, direction in enumerate(directions):
+            dcol, drow = COMPASS_OFFSETS[direction]
+            matrix[:, i] = self.fids_at_indexes(self.col_idx + dcol, self.row_idx + drow)
+        return matrix
+
+    def centroid_neighbors(self, directions=COMPASS_DIRECTIONS, decimals=6):
+        """
+        Return neighbours matrix like 'neighbors' but found by centroids shifted by the cell size.
+        Cells sharing the same centroid are resolved to the one with the highest fid.
+        """
+        centroids = {}
+        for fid, x, y in zip(self.fid.tolist(), self.x.round(decimals).tolist(), self.y.round(decimals).tolist()):
+            centroids[(x, y)] = fid
+        matrix = np.zeros((self.count, len(directions)), dtype=np.int32)
+        for i, direction in enumerate(directions):
+            dcol, drow = COMPASS_OFFSETS[direction]
+            xs = (self.x + dcol * self.cell_size).round(decimals).tolist()
+            ys = (self.y + drow * self.cell_size).round(decimals).tolist()
+            matrix[:, i] = [centroids.get(point, 0) for point in zip(xs, ys)]
+        return matrix
+
+    def raster(self, values, nodata=np.nan):
+        """
+        Return dense (nrows, ncols) array of given per cell values with row 0 at the bottom of the grid.
+        """
+        values = np.asarray(values)
+        dtype = np.result_type(values.dtype, np.min_scalar_type(nodata))
+        raster = np.full((self.nrows, self.ncols), nodata, dtype=dtype)
+        raster[self.row_idx, self.col_idx] = values
+        return raster
+
+
+class GridChanges(object):
+    """
+    Counter of the 'grid' table changes done through one connection.
+    It is bumped from temporary triggers and lives on the Python side, so rolled back changes still count.
+    """
+
+    def __init__(self, con):
+        self.con = con
+        self.counter = 0
+
+    def bump(self):
+        self.counter += 1
+
+
+def grid_changes(gutils):
+    """
+    Return GridChanges counter of the GeoPackage connection, registering its function and triggers on the first call.
+    """
+    con = base_connection(gutils.con)
+    try:
+        changes = _grid_changes[id(con)]
+        if changes.con is con:
+            return changes
+    except KeyError:
+        pass
+    changes = GridChanges(con)
+    con.create_function("flo2d_grid_changed", 0, changes.bump)
+    in_transaction = con.in_transaction
+    trigger_qry = """
+    CREATE TEMP TRIGGER IF NOT EXISTS "grid_changed_{0}"
+        AFTER {1} ON main."grid"
+        BEGIN
+            SELECT flo2d_grid_changed();
+        END;
+    """
+    for event in ["insert", "update", "delete"]:
+        con.execute(trigger_qry.format(event, event.upper()))
+    if not in_transaction:
+        con.commit()
+    _grid_changes[id(con)] = changes
+    return changes
+
+
+def grid_signature(gutils):
+    """
+    Return signature of the current 'grid' table state.
+    The change counter is bumped on every change of the 'grid' table done through this connection (also the rolled
+    back ones), while 'data_version' changes whenever other connections (e.g. QGIS layers) commit into the GeoPackage.
+    """
+    counter = grid_changes(gutils).counter
+    data_version = gutils.con.execute("""PRAGMA data_version;""").fetchone()[0]
+    return counter, data_version, gutils.get_cont_par("CELLSIZE")
+
+
+def base_connection(con):
+    """
+    Return sqlite3 connection behind the connection proxies (e.g. SessionConnection of the import session).
+    """
+    return getattr(con, "con", con)
+
+
+def connection_closed(con):
+    try:
+        con.total_changes
+        return False
+    except sqlite3.ProgrammingError:
+        return True
+
+
+def cached_grid_index(gutils):
+    """
+    Return GridIndex shared by all tools working with the same GeoPackage connection.
+    The index is rebuilt only when the 'grid' table was changed since the last call.
+    Cache entries hold their connections, so ids of the live connections can't be reused,
+    and entries of closed connections are dropped.
+    """
+    for key, (cached_con, cached_signature, index) in list(_grid_indexes.items()):
+        if connection_closed(cached_con):
+            del _grid_indexes[key]
+    for key, changes in list(_grid_changes.items()):
+        if connection_closed(changes.con):
+            del _grid_changes[key]
+    con = base_connection(gutils.con)
+    signature = grid_signature(gutils)
+    try:
+        cached_con, cached_signature, index = _grid_indexes[id(con)]
+        if cached_con is con and cached_signature == signature:
+            return index
+    except KeyError:
+        pass
+    index = GridIndex.from_gpkg(gutils)
+    _grid_indexes[id(con)] = (con, signature, index)
+    return index
+
+
+def invalidate_grid_index(con=None):
+    """
+    Drop cached grid index of the given GeoPackage connection (or all of them).
+    """
+    if con is None:
+        _grid_indexes.clear()
+    else:
+        _grid_indexes.pop(id(base_connection(con)), None)
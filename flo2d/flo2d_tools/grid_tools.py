@@ -7,13 +7,12 @@
 # modify it under the terms of the GNU General Public License
 # as published by the Free Software Foundation; either version 2
 # of the License, or (at your option) any later version
-import datetime
 import math
 import os
 import sys
 import uuid
-from collections import defaultdict
-from operator import itemgetter
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from subprocess import PIPE, STDOUT, Popen
 
 import numpy as np
@@ -29,13 +28,12 @@ from qgis.core import (
     QgsMarkerSymbol,
     QgsPointXY,
     QgsProject,
-    QgsRaster,
-    QgsRasterLayer,
     QgsRectangle,
     QgsRendererCategory,
     QgsRendererRange,
     QgsSpatialIndex,
     QgsSymbol,
+    QgsVectorLayerFeatureSource,
 )
 from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtGui import QColor
@@ -44,14 +42,9 @@ from scipy.stats._discrete_distns import geom
 
 from ..errors import Flo2dError, GeometryValidityErrors
 from ..gui.ui_utils import center_canvas, zoom_show_n_cells
-from ..utils import get_file_path, get_grid_index, grid_index, is_number, set_grid_index
-
-cellIDNumpyArray = None
-xvalsNumpyArray = None
-yvalsNumpyArray = None
-
-cellElevNumpyArray = None
-
+from ..misc.gpb import point_gpb
+from ..utils import get_file_path, get_grid_index, grid_index, set_grid_index
+from .grid_index import COMPASS_DIRECTIONS, COMPASS_OFFSETS, GridIndex, cached_grid_index
 
 # GRID classes
 class TINInterpolator(object):
@@ -499,15 +492,14 @@ def intersection_spatial_index(vlayer, request=None, clip=False):
     """
     allfeatures = {}
     index = QgsSpatialIndex()
-    all_feature_id = vlayer.allFeatureIds()
-    if len(all_feature_id) == 0:
-        return allfeatures, index
-    max_fid = max(all_feature_id) + 1
+    divided = []
+    max_fid = None
 
     if request is not None:
         extent_geom = QgsGeometry.fromRect(request.filterRect())
 
     for feat in vlayer.getFeatures() if request is None else vlayer.getFeatures(request):
+        max_fid = feat.id() if max_fid is None else max(max_fid, feat.id())
         geom = feat.geometry()
         if not geom.isGeosValid():
             geom = geom.buffer(0.0, 5)
@@ -533,14 +525,17 @@ def intersection_spatial_index(vlayer, request=None, clip=False):
             else:
                 feat_copy.setGeometry(g)
             if new_fid is True:
-                fid = max_fid
-                feat_copy.setId(fid)
-                max_fid += 1
+                divided.append((feat_copy, engine))
             else:
-                fid = feat.id()
+                allfeatures[feat.id()] = (feat_copy, engine)
+                index.insertFeature(feat_copy)
+
+    # Divided geometries get ids above the fetched ones, so 'vlayer' may be a layer or a feature source.
+    if divided:
+        for fid, (feat_copy, engine) in enumerate(divided, max_fid + 1):
+            feat_copy.setId(fid)
             allfeatures[fid] = (feat_copy, engine)
             index.insertFeature(feat_copy)
-
     return allfeatures, index
 
 
@@ -626,9 +621,70 @@ def divide_geom(geom, threshold=1000):
     return new_geoms
 
 
-def build_grid(boundary, cell_size, upper_left_coords=None):
+def polygon_rings(geom):
+    """
+    Function for extracting all rings (exteriors and holes) of the polygon geometry as (N, 2) NumPy arrays.
+    """
+    polygons = geom.asMultiPolygon() if geom.isMultipart() else [geom.asPolygon()]
+    rings = [np.array([(pnt.x(), pnt.y()) for pnt in ring], dtype=float) for poly in polygons for ring in poly]
+    return [ring for ring in rings if ring.shape[0] > 2]
+
+
+def scanline_cells(rings, x0, y0, cell_size, cols, rows):
+    """
+    Vectorized even-odd scanline test of the regular grid cell centers against polygon rings.
+    Cell centers are (x0 + col * cell_size, y0 - row * cell_size) for col in range(cols) and row in range(rows).
+    Returns arrays of col and row indexes of the cells inside the polygon sorted by col and then by row.
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if not rings:
+        return empty, empty
+    x1 = np.concatenate([ring[:-1, 0] for ring in rings])
+    y1 = np.concatenate([ring[:-1, 1] for ring in rings])
+    x2 = np.concatenate([ring[1:, 0] for ring in rings])
+    y2 = np.concatenate([ring[1:, 1] for ring in rings])
+    ylo = np.minimum(y1, y2)
+    yhi = np.maximum(y1, y2)
+    # Scanline "row" crosses the edge when ylo <= y0 - row * cell_size < yhi.
+    first_row = np.floor((y0 - yhi) / cell_size).astype(np.int64) + 1
+    last_row = np.floor((y0 - ylo) / cell_size).astype(np.int64)
+    first_row = np.maximum(first_row, 0)
+    last_row = np.minimum(last_row, rows - 1)
+    counts = np.maximum(last_row - first_row + 1, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return empty, empty
+    edge_idx = np.repeat(np.arange(counts.shape[0]), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    cross_row = first_row[edge_idx] + offsets
+    cross_y = y0 - cross_row * cell_size
+    ex1, ey1, ex2, ey2 = x1[edge_idx], y1[edge_idx], x2[edge_idx], y2[edge_idx]
+    cross_x = ex1 + (cross_y - ey1) * (ex2 - ex1) / (ey2 - ey1)
+    order = np.lexsort((cross_x, cross_row))
+    cross_row = cross_row[order]
+    cross_x = cross_x[order]
+    # Every row has even number of crossings - consecutive pairs are spans inside polygon.
+    span_row = cross_row[0::2]
+    span_start = np.ceil((cross_x[0::2] - x0) / cell_size).astype(np.int64)
+    span_end = np.ceil((cross_x[1::2] - x0) / cell_size).astype(np.int64)
+    span_start = np.clip(span_start, 0, cols)
+    span_end = np.clip(span_end, 0, cols)
+    span_len = np.maximum(span_end - span_start, 0)
+    cells_total = int(span_len.sum())
+    cell_row = np.repeat(span_row, span_len)
+    cell_col = np.repeat(span_start, span_len) + (
+        np.arange(cells_total) - np.repeat(np.cumsum(span_len) - span_len, span_len)
+    )
+    # Spans of overlapping parts may repeat the same cell.
+    cells = np.unique(np.column_stack((cell_col, cell_row)), axis=0)
+    return cells[:, 0], cells[:, 1]
+
+
+def build_grid_arrays(boundary, cell_size, upper_left_coords=None):
     """
-    Generator which creates grid with given cell size and inside given boundary layer.
+    Function which creates grid with given cell size and inside given boundary layer.
+    Returns arrays of cells centroids coordinates, col/row indexes (col from the left, row from the top)
+    and the number of rows spanned by the boundary extent.
     """
     half_size = cell_size * 0.5
     biter = boundary.getFeatures()
@@ -639,40 +695,38 @@ def build_grid(boundary, cell_size, upper_left_coords=None):
     xmax = bbox.xMaximum()
     ymax = bbox.yMaximum()
     ymin = bbox.yMinimum()
-    #     xmin = math.floor(bbox.xMinimum())
-    #     xmax = math.ceil(bbox.xMaximum())
-    #     ymax = math.ceil(bbox.yMaximum())
-    #     ymin = math.floor(bbox.yMinimum())
     if upper_left_coords:
         xmin, ymax = upper_left_coords
     cols = int(math.ceil(abs(xmax - xmin) / cell_size))
     rows = int(math.ceil(abs(ymax - ymin) / cell_size))
-    x = xmin + half_size
-    y = ymax - half_size
-    geos_geom_engine = QgsGeometry.createGeometryEngine(geom.constGet())
-    geos_geom_engine.prepareGeometry()
-    for col in range(cols):
-        y_tmp = y
-        for row in range(rows):
-            pnt = QgsGeometry.fromPointXY(QgsPointXY(x, y_tmp))
-            if geos_geom_engine.intersects(pnt.constGet()):
-                poly = (
-                    x - half_size,
-                    y_tmp - half_size,
-                    x + half_size,
-                    y_tmp - half_size,
-                    x + half_size,
-                    y_tmp + half_size,
-                    x - half_size,
-                    y_tmp + half_size,
-                    x - half_size,
-                    y_tmp - half_size,
-                )
-                yield poly
-            else:
-                pass
-            y_tmp -= cell_size
-        x += cell_size
+    x0 = xmin + half_size
+    y0 = ymax - half_size
+    col_idx, row_idx = scanline_cells(polygon_rings(geom), x0, y0, cell_size, cols, rows)
+    xs = x0 + col_idx * cell_size
+    ys = y0 - row_idx * cell_size
+    return xs, ys, col_idx, row_idx, rows
+
+
+def build_grid(boundary, cell_size, upper_left_coords=None):
+    """
+    Generator which creates grid with given cell size and inside given boundary layer.
+    """
+    half_size = cell_size * 0.5
+    xs, ys, col_idx, row_idx, rows = build_grid_arrays(boundary, cell_size, upper_left_coords)
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        poly = (
+            x - half_size,
+            y - half_size,
+            x + half_size,
+            y - half_size,
+            x + half_size,
+            y + half_size,
+            x - half_size,
+            y + half_size,
+            x - half_size,
+            y - half_size,
+        )
+        yield poly
 
 
 def build_grid_and_tableColRow(boundary, cell_size):
@@ -680,46 +734,21 @@ def build_grid_and_tableColRow(boundary, cell_size):
     Generator which creates grid with given cell size and inside given boundary layer.
     """
     half_size = cell_size * 0.5
-    biter = boundary.getFeatures()
-    feature = next(biter)
-    geom = feature.geometry()
-    bbox = geom.boundingBox()
-    xmin = bbox.xMinimum()
-    xmax = bbox.xMaximum()
-    ymax = bbox.yMaximum()
-    ymin = bbox.yMinimum()
-    #     xmin = math.floor(bbox.xMinimum())
-    #     xmax = math.ceil(bbox.xMaximum())
-    #     ymax = math.ceil(bbox.yMaximum())
-    #     ymin = math.floor(bbox.yMinimum())
-    cols = int(math.ceil(abs(xmax - xmin) / cell_size))
-    rows = int(math.ceil(abs(ymax - ymin) / cell_size))
-    x = xmin + half_size
-    y = ymax - half_size
-    geos_geom_engine = QgsGeometry.createGeometryEngine(geom.constGet())
-    geos_geom_engine.prepareGeometry()
-    for col in range(cols):
-        y_tmp = y
-        for row in range(rows):
-            pnt = QgsGeometry.fromPointXY(QgsPointXY(x, y_tmp))
-            if geos_geom_engine.intersects(pnt.constGet()):
-                poly = (
-                    x - half_size,
-                    y_tmp - half_size,
-                    x + half_size,
-                    y_tmp - half_size,
-                    x + half_size,
-                    y_tmp + half_size,
-                    x - half_size,
-                    y_tmp + half_size,
-                    x - half_size,
-                    y_tmp - half_size,
-                )
-                yield (poly, col + 2, abs(row - rows) + 1)
-            else:
-                pass
-            y_tmp -= cell_size
-        x += cell_size
+    xs, ys, col_idx, row_idx, rows = build_grid_arrays(boundary, cell_size)
+    for x, y, col, row in zip(xs.tolist(), ys.tolist(), col_idx.tolist(), row_idx.tolist()):
+        poly = (
+            x - half_size,
+            y - half_size,
+            x + half_size,
+            y - half_size,
+            x + half_size,
+            y + half_size,
+            x - half_size,
+            y + half_size,
+            x - half_size,
+            y - half_size,
+        )
+        yield (poly, col + 2, abs(row - rows) + 1)
 
 
 def assign_col_row_indexes_to_grid(grid, gutils):
@@ -1114,25 +1143,46 @@ def calculate_gutter_variable_from_lines(grid, lines):
                 pass
 
 
+def layer_centroids(vlayer, request=None):
+    """
+    Function for getting (fids, xs, ys) arrays of centroids of the layer features.
+    """
+    features = vlayer.getFeatures() if request is None else vlayer.getFeatures(request)
+    fids, xs, ys = [], [], []
+    for feat in features:
+        center = feat.geometry().centroid().asPoint()
+        fids.append(feat.id())
+        xs.append(center.x())
+        ys.append(center.y())
+    return np.array(fids, dtype=np.int64), np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64)
+
+
+def sampled_values(values, fids):
+    """
+    Function for converting array of sampled raster values into (value, fid) rows (None for NODATA).
+    """
+    values = np.round(values, 4)
+    return [(None if val != val else val, fid) for val, fid in zip(values.tolist(), fids.tolist())]
+
+
 def raster2grid(grid, out_raster, request=None):
     """
     Generator for probing raster data within 'grid' features.
+    Raster is sampled at all cell centroids at once (see GDALRasterLayer.sample).
     """
-    probe_raster = QgsRasterLayer(out_raster)
-    if not probe_raster.isValid():
+    from ..misc.gdal_utils import GDALRasterLayer
+
+    try:
+        probe_raster = GDALRasterLayer(out_raster)
+    except RuntimeError:
+        return
+    if probe_raster.ds is None:
         return
 
-    features = grid.getFeatures() if request is None else grid.getFeatures(request)
-    for feat in features:
-        center = feat.geometry().centroid().asPoint()
-        ident = probe_raster.dataProvider().identify(center, QgsRaster.IdentifyFormatValue)
-        # ident is the value of the query provided by the identify method of the dataProvider.
-        if ident.isValid():
-            if is_number(ident.results()[1]):
-                val = round(ident.results()[1], 4)
-            else:
-                val = None
-            yield val, feat.id()
+    fids, xs, ys = layer_centroids(grid, request)
+    values = probe_raster.sample(xs, ys)
+    for row in sampled_values(values, fids):
+        yield row
 
 
 def rasters2centroids(vlayer, request, *raster_paths):
@@ -1145,36 +1195,27 @@ def rasters2centroids(vlayer, request, *raster_paths):
         request:
         *raster_pathts: list of ASCII files (with path).
 
+    Centroids are converted into pixel indexes once for every distinct raster georeference
+    (e.g. all frames of the realtime rainfall catalogue), then values are gathered from raster blocks.
     """
-    features = vlayer.getFeatures() if request is None else vlayer.getFeatures(request)
-    centroids = []
-    for feat in features:
-        fid = feat.id()
-        center_point = feat.geometry().centroid().asPoint()
-        centroids.append((fid, center_point))
+    from ..misc.gdal_utils import GDALRasterLayer
 
-    # 'centroids' has the coordinates (x,y) of the centroids of all features of vlayer (ususlly the grid layer)
+    # 'fids, xs, ys' has the coordinates (x,y) of the centroids of all features of vlayer (ususlly the grid layer)
+    fids, xs, ys = layer_centroids(vlayer, request)
+    pixels = {}
     for pth in raster_paths:
-        raster_values = []
-        rlayer = QgsRasterLayer(
-            pth
-        )  # rlayer is an instance of the layer constructed from file pth (from list raster_paths).
-        # Loads (or assigns a raster style), populates its bands, calculates its extend,
-        # determines if the layers is gray, paletted, or multiband, assign sensible
-        # defaults for the red, green, blue and gray bands.
-        if not rlayer.isValid():
+        try:
+            rlayer = GDALRasterLayer(pth)
+        except RuntimeError:
             continue
-        raster_provider = rlayer.dataProvider()
-        for fid, point in centroids:
-            ident = raster_provider.identify(point, QgsRaster.IdentifyFormatValue)
-            # ident is the value of the query provided by the identify method of the dataProvider.
-            if ident.isValid():
-                if is_number(ident.results()[1]):
-                    val = round(ident.results()[1], 4)
-                else:
-                    val = None
-                raster_values.append((val, fid))
-        yield raster_values
+        if rlayer.ds is None:
+            continue
+        georeference = (rlayer.ds.GetGeoTransform(), rlayer.width, rlayer.height)
+        if georeference not in pixels:
+            pixels[georeference] = rlayer.index(xs, ys)
+        rows, cols = pixels[georeference]
+        values = rlayer.sample_pixels(rows, cols)
+        yield sampled_values(values, fids)
 
 
 # Tools which use GeoPackageUtils instance
@@ -1185,16 +1226,30 @@ def square_grid(gutils, boundary, upper_left_coords=None):
     cellsize = float(gutils.get_cont_par("CELLSIZE"))
     update_cellsize = "UPDATE user_model_boundary SET cell_size = ?;"
     gutils.execute(update_cellsize, (cellsize,))
-    gutils.clear_tables("grid")
-
-    polygons = ((gutils.build_square_from_polygon(poly),) for poly in build_grid(boundary, cellsize, upper_left_coords))
-    sql = ["""INSERT INTO grid (geom) VALUES""", 1]
-    for g_tuple in polygons:
-        sql.append(g_tuple)
-    if len(sql) > 2:
-        gutils.batch_execute(sql)
-    else:
-        pass
+
+    xs, ys, col_idx, row_idx, dummy = build_grid_arrays(boundary, cellsize, upper_left_coords)
+    with gutils.bulk_load("grid"):
+        gutils.clear_tables("grid")
+        if xs.shape[0] == 0:
+            return
+        polygons = gutils.build_squares_xy(xs, ys, cellsize)
+        if "col" in gutils.table_info("grid", only_columns=True):
+            # Same indexing as in 'assign_col_row_indexes_to_grid' (counted from the lower left corner of the grid).
+            grid_cols = (col_idx - col_idx.min() + 2).tolist()
+            grid_rows = (row_idx.max() - row_idx + 2).tolist()
+            sql = ["""INSERT INTO grid (geom, col, row) VALUES""", 3]
+            values = zip(polygons, grid_cols, grid_rows)
+        else:
+            sql = ["""INSERT INTO grid (geom) VALUES""", 1]
+            values = ((g,) for g in polygons)
+        for i, g_tuple in enumerate(values, 1):
+            sql.append(g_tuple)
+            if i % 100000 == 0:
+                gutils.batch_execute(sql)
+        if len(sql) > 2:
+            gutils.batch_execute(sql)
+        else:
+            pass
 
 
 def square_grid_with_col_and_row_fields(gutils, boundary, upper_left_coords=None):
@@ -1226,18 +1281,10 @@ def square_grid_with_col_and_row_fields(gutils, boundary, upper_left_coords=None
         gutils.clear_tables("grid")
 
         sql = ["""INSERT INTO grid (geom, col, row) VALUES""", 3]
-        polygonsClRw = (
-            (gutils.build_square_from_polygon2(polyColRow),)
-            for polyColRow in build_grid_and_tableColRow(boundary, cellsize)
-        )
-        for g_tuple in polygonsClRw:
-            sql.append(
-                (
-                    g_tuple[0][0],
-                    g_tuple[0][1],
-                    g_tuple[0][2],
-                )
-            )
+        xs, ys, col_idx, row_idx, rows = build_grid_arrays(boundary, cellsize)
+        polygons = gutils.build_squares_xy(xs, ys, cellsize)
+        for g_tuple in zip(polygons, (col_idx + 2).tolist(), (rows - row_idx + 1).tolist()):
+            sql.append(g_tuple)
         if len(sql) > 2:
             gutils.batch_execute(sql)
         else:
@@ -1316,113 +1363,116 @@ def evaluate_roughness(gutils, grid, roughness, column_name, method, reset=False
         return False
 
 
-def gridRegionGenerator(gutils, grid, gridSpan=100, regionPadding=50, showProgress=True):
-    # yields rectangular selection regions in the grid
-    # useful for subdividing large geoprocessing tasks over smaller, discrete regions of the grid
-
-    # gridCount = grid.featureCount()
+def grid_region_requests(gutils, grid, gridSpan=100, regionPadding=50):
+    """
+    Return list of rectangular selection requests subdividing the grid into regions of about gridSpan x gridSpan cells.
+    """
     cellsize = float(gutils.get_cont_par("CELLSIZE"))
 
-    # process 100x100 cell regions typically
-    gridDimPerAnalysisRegion = gridSpan
-    # gridsPerAnalysisRegion = gridDimPerAnalysisRegion ** 2
-
     # determine extent of grid
     gridExt = grid.extent()
     ySpan = gridExt.yMaximum() - gridExt.yMinimum()
     xSpan = gridExt.xMaximum() - gridExt.xMinimum()
 
     # determine # of processing rows/columns based upon analysis regions
-    colCount = math.ceil(xSpan / (gridDimPerAnalysisRegion * cellsize))
-    rowCount = math.ceil(ySpan / (gridDimPerAnalysisRegion * cellsize))
+    colCount = math.ceil(xSpan / (gridSpan * cellsize))
+    rowCount = math.ceil(ySpan / (gridSpan * cellsize))
 
-    # segment the grid ext to create analysis regions
-    regionCount = rowCount * colCount
-    regionCounter = 0  # exit criteria
+    # regionPadding - amount, in ft probably, to pad region extents to prevent boundary effects
+    requests = []
+    for row in range(rowCount):
+        yMin = gridExt.yMinimum() + ySpan / rowCount * row - regionPadding / 2.0
+        yMax = gridExt.yMinimum() + ySpan / rowCount * (row + 1) + regionPadding / 2.0
+        for col in range(colCount):
+            xMin = gridExt.xMinimum() + xSpan / colCount * col - regionPadding / 2.0
+            xMax = gridExt.xMinimum() + xSpan / colCount * (col + 1) + regionPadding / 2.0
 
-    # regionPadding = 50 # amount, in ft probably, to pad region extents to prevent boundary effects
+            queryRect = QgsRectangle(xMin, yMin, xMax, yMax)  # xmin, ymin, xmax, ymax
+            requests.append(QgsFeatureRequest(queryRect))
+    return requests
 
-    if showProgress == True:
-        progDialog = QProgressDialog("Processing Progress (by area - timing will be uneven)", "Cancel", 0, 100)
-        progDialog.setModal(True)
-        progDialog.setValue(0)
-        progDialog.show()
-        QApplication.processEvents()
-
-    while regionCounter < regionCount:
-        for row in range(rowCount):
-            yMin = gridExt.yMinimum() + ySpan / rowCount * row - regionPadding / 2.0
-            yMax = gridExt.yMinimum() + ySpan / rowCount * (row + 1) + regionPadding / 2.0
-            for col in range(colCount):
-                xMin = gridExt.xMinimum() + xSpan / colCount * col - regionPadding / 2.0
-                xMax = gridExt.xMinimum() + xSpan / colCount * (col + 1) + regionPadding / 2.0
-
-                queryRect = QgsRectangle(xMin, yMin, xMax, yMax)  # xmin, ymin, xmax, ymax
-
-                request = QgsFeatureRequest(queryRect)
-                regionCounter += 1  # increment regionCounter up
-                if showProgress == True:
-                    if progDialog.wasCanceled() == True:
-                        break
-                    progDialog.setValue(regionCounter / regionCount * 100.0)
-                    QApplication.processEvents()
-                print("Processing region: %s of %s" % (regionCounter, regionCount))
-                yield request
-            if showProgress == True:
-                if progDialog.wasCanceled() == True:
-                    break
-        if showProgress == True:
-            progDialog.close()
 
+def region_progress_dialog():
+    progDialog = QProgressDialog("Processing Progress (by area - timing will be uneven)", "Cancel", 0, 100)
+    progDialog.setModal(True)
+    progDialog.setValue(0)
+    progDialog.show()
+    QApplication.processEvents()
+    return progDialog
 
-def geos2geosGenerator(gutils, grid, inputFC, *valueColumnNames, extraFC=None):
-    # extraFC is a second feature class for the case in which 2 feature classes are to be intersected that are not
-    # the grid; land-use intersection with soils, for instance
 
-    # gridCount = grid.featureCount()
-    cellsize = float(gutils.get_cont_par("CELLSIZE"))
+def gridRegionGenerator(gutils, grid, gridSpan=100, regionPadding=50, showProgress=True):
+    # yields rectangular selection regions in the grid
+    # useful for subdividing large geoprocessing tasks over smaller, discrete regions of the grid
+    requests = grid_region_requests(gutils, grid, gridSpan, regionPadding)
+    regionCount = len(requests)
 
-    # process 100x100 cell regions
-    gridDimPerAnalysisRegion = 100
-    # gridsPerAnalysisRegion = gridDimPerAnalysisRegion ** 2
+    if showProgress == True:
+        progDialog = region_progress_dialog()
 
-    # determine extent of grid
-    gridExt = grid.extent()
-    ySpan = gridExt.yMaximum() - gridExt.yMinimum()
-    xSpan = gridExt.xMaximum() - gridExt.xMinimum()
+    for regionCounter, request in enumerate(requests, 1):
+        if showProgress == True:
+            if progDialog.wasCanceled() == True:
+                break
+            progDialog.setValue(regionCounter / regionCount * 100.0)
+            QApplication.processEvents()
+        print("Processing region: %s of %s" % (regionCounter, regionCount))
+        yield request
 
-    # determine # of processing rows/columns based upon analysis regions
-    colCount = math.ceil(xSpan / (gridDimPerAnalysisRegion * cellsize))
-    rowCount = math.ceil(ySpan / (gridDimPerAnalysisRegion * cellsize))
+    if showProgress == True:
+        progDialog.close()
 
-    # segment the grid ext to create analysis regions
-    regionCount = rowCount * colCount
-    regionCounter = 0  # exit criteria
 
-    regionPadding = 50  # amount, in ft probably, to pad region extents to prevent boundary effects
+def parallelRegionGenerator(
+    gutils, grid, regionTask, layers=(), gridSpan=100, regionPadding=50, showProgress=True, maxWorkers=None
+):
+    """
+    Generator running regionTask(request, *sources) for the grid regions in the pool of worker threads.
+    Sources are feature sources of 'layers' taken in the calling thread for every region, so workers never touch
+    layers or the GeoPackage connection. Results are yielded as (request, result) pairs in order of regions,
+    with at most 2 x maxWorkers regions submitted ahead of the consumer. Progress and cancelling work like
+    in gridRegionGenerator.
+    Workers read the layers through their own OGR connections, so the caller must not write to the GeoPackage
+    before the generator is exhausted or closed. When it finishes, no region task is running any more.
+    """
+    requests = grid_region_requests(gutils, grid, gridSpan, regionPadding)
+    regionCount = len(requests)
+    maxWorkers = maxWorkers or os.cpu_count() or 1
 
-    while regionCounter < regionCount:
-        for row in range(rowCount):
-            yMin = gridExt.yMinimum() + ySpan / rowCount * row - regionPadding / 2.0
-            yMax = gridExt.yMinimum() + ySpan / rowCount * (row + 1) + regionPadding / 2.0
-            for col in range(colCount):
-                xMin = gridExt.xMinimum() + xSpan / colCount * col - regionPadding / 2.0
-                xMax = gridExt.xMinimum() + xSpan / colCount * (col + 1) + regionPadding / 2.0
+    if showProgress == True:
+        progDialog = region_progress_dialog()
 
-                queryRect = QgsRectangle(xMin, yMin, xMax, yMax)  # xmin, ymin, xmax, ymax
+    pending = deque()
+    nextRegion = 0
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        try:
+            for regionCounter in range(1, regionCount + 1):
+                # keep limited number of regions in flight, so finished results waiting for the writer stay small
+                while nextRegion < regionCount and len(pending) < 2 * maxWorkers:
+                    request = requests[nextRegion]
+                    sources = [QgsVectorLayerFeatureSource(lyr) for lyr in layers]
+                    pending.append((request, executor.submit(regionTask, request, *sources)))
+                    nextRegion += 1
+
+                request, future = pending.popleft()
+                while not wait([future], timeout=0.1).done:
+                    if showProgress == True:
+                        QApplication.processEvents()
+                        if progDialog.wasCanceled() == True:
+                            return
+                result = future.result()
 
-                request = QgsFeatureRequest(queryRect)
-                yieldVal = None
-                if extraFC is None:
-                    yieldVal = poly2poly_geos(grid, inputFC, request, *valueColumnNames)  # this returns 2 values
-                else:
-                    yieldVal = poly2poly_geos(inputFC, extraFC, request, *valueColumnNames)  # this returns 2 values
-                regionCounter += 1  # increment regionCounter up
-                yield (
-                    yieldVal[0],
-                    yieldVal[1],
-                    (regionCount - 1) / regionCount,
-                )  # yield the intersection list and % complete
+                if showProgress == True:
+                    if progDialog.wasCanceled() == True:
+                        return
+                    progDialog.setValue(regionCounter / regionCount * 100.0)
+                    QApplication.processEvents()
+                yield request, result
+        finally:
+            for request, future in pending:
+                future.cancel()
+            if showProgress == True:
+                progDialog.close()
 
 
 def update_roughness(gutils, grid, roughness, column_name, reset=False):
@@ -1430,8 +1480,6 @@ def update_roughness(gutils, grid, roughness, column_name, reset=False):
     Updating roughness values inside 'grid' table.
     """
     try:
-        #     startTime = time.time()
-
         globalnValue = gutils.get_cont_par("MANNING")
         if reset is True:
             gutils.execute("UPDATE grid SET n_value=?;", (globalnValue,))
@@ -1439,34 +1487,28 @@ def update_roughness(gutils, grid, roughness, column_name, reset=False):
             pass
         qry = "UPDATE grid SET n_value=? WHERE fid=?;"
 
-        gridCount = 0
-        for request in gridRegionGenerator(gutils, grid, gridSpan=100, regionPadding=50, showProgress=True):
+        def region_manning(request, grid_source, roughness_source):
             writeVals = []
-            manning_values = poly2poly_geos(grid, roughness, request, column_name)  # this returns 2 values
-            # if extraFC is None:
-            #        yieldVal = poly2poly_geos(grid, inputFC, request, *valueColumnNames) # this returns 2 values
-
+            manning_values = poly2poly_geos(grid_source, roughness_source, request, column_name)
             for gid, values in manning_values:
-                gridCount += 1
-                #                 if gridCount % 1000 == 0:
-                #                     print ("Processing %s" % gridCount)
                 if values:
                     manning = sum(ma * float(subarea) for ma, subarea in values)
                     manning = manning + (1.0 - sum(float(subarea) for ma, subarea in values)) * float(globalnValue)
                     manning = "{0:.4}".format(manning)
                     writeVals.append((manning, gid))
-
-            if len(writeVals) > 0:
-                gutils.con.executemany(qry, writeVals)
-                #                 print ("committing to db")
-                gutils.con.commit()
+            return writeVals
+
+        # Values are written once all regions are read, so the commit never runs alongside the workers' reads.
+        allVals = []
+        for request, writeVals in parallelRegionGenerator(
+            gutils, grid, region_manning, (grid, roughness), gridSpan=100, regionPadding=50, showProgress=True
+        ):
+            allVals += writeVals
+        if len(allVals) > 0:
+            gutils.con.executemany(qry, allVals)
+            gutils.con.commit()
 
         return True
-    #     endTime = time.time()
-    # #     print ("total write Time: %s min" % ((endTime - startTime)/60.0))
-    #
-    #     QApplication.restoreOverrideCursor()
-    #     debugMsg("{0:.3f} seconds sampling Manning's values".format(endTime - startTime))
 
     except:
         QApplication.restoreOverrideCursor()
@@ -1532,12 +1574,9 @@ def evaluate_arfwrf(gutils, grid, areas):
         ]
         gutils.execute(del_cells)
 
-        for row, was_null in calculate_arfwrf(grid, areas):
-            # "row" is a tuple like  (u'Point (368257 1185586)', 1075L, 1L, 0.06, 0.0, 1.0, 0.0, 0.0, 0.14, 0.32, 0.0, 0.0)
-            point_wkt = row[0]  # Fist element of tuple "row" is a POINT (centroid of cell?)
-            point_gpb = gutils.wkt_to_gpb(point_wkt)
-            new_row = (point_gpb,) + row[1:]
-            qry_cells.append(new_row)
+        for row, was_null in calculate_arfwrf(grid, areas, cached_grid_index(gutils)):
+            # "row" is a tuple like  (<GPB cell centroid>, 1075, 1, 0.06, 0.0, 1.0, 0.0, 0.0, 0.14, 0.32, 0.0, 0.0)
+            qry_cells.append(row)
 
             if was_null:
                 nulls += 1
@@ -1568,54 +1607,48 @@ def evaluate_arfwrf(gutils, grid, areas):
         return False
 
 
-def grid_compas_neighbors(gutils):
+def grid_neighbors_matrix(gutils):
     """
-    Generator which calculates grid cells neighbors.
+    Function which calculates (N, 8) matrix of grid cells neighbors in N, E, S, W, NE, SE, SW, NW order.
+    Neighbors are found with integer col/row arithmetic on the grid index, or by matching centroid coordinates
+    when the grid is not regular.
     """
-    cell_size = float(gutils.get_cont_par("CELLSIZE"))
-
-    def n(x, y):
-        return x, y + cell_size
-
-    def e(x, y):
-        return x + cell_size, y
-
-    def s(x, y):
-        return x, y - cell_size
-
-    def w(x, y):
-        return x - cell_size, y
+    return cached_grid_index(gutils).neighbors()
 
-    def ne(x, y):
-        return x + cell_size, y + cell_size
 
-    def se(x, y):
-        return x + cell_size, y - cell_size
-
-    def sw(x, y):
-        return x - cell_size, y - cell_size
+def grid_compas_neighbors(gutils):
+    """
+    Generator which calculates grid cells neighbors.
+    """
+    for neighbors in grid_neighbors_matrix(gutils):
+        yield neighbors.tolist()
 
-    def nw(x, y):
-        return x - cell_size, y + cell_size
 
-    grid_centroids_map = {QgsPointXY(*point): fid for fid, point in gutils.grid_centroids_all()}
-    compas_functions = [n, e, s, w, ne, se, sw, nw]
-    for point, fid in sorted(grid_centroids_map.items(), key=itemgetter(1)):
-        neighbors = []
-        centroid_x, centroid_y = point.x(), point.y()
-        for compas_fn in compas_functions:
-            neighbor_point = QgsPointXY(*compas_fn(centroid_x, centroid_y))
-            try:
-                neighbour_fid = grid_centroids_map[neighbor_point]
-            except KeyError:
-                neighbour_fid = 0
-            neighbors.append(neighbour_fid)
-        yield neighbors
+def grid_layer_index(grid):
+    """
+    Function which builds GridIndex from grid layer features (used when there is no GeoPackage connection).
+    """
+    fids, xs, ys = [], [], []
+    cell_size = None
+    request = QgsFeatureRequest().setNoAttributes()
+    for feat in grid.getFeatures(request):
+        bbox = feat.geometry().boundingBox()
+        fids.append(feat.id())
+        xs.append(bbox.center().x())
+        ys.append(bbox.center().y())
+        if cell_size is None:
+            cell_size = bbox.width()
+    zeros = np.zeros(len(fids))
+    return GridIndex(fids, xs, ys, zeros, zeros, cell_size or 1.0)
 
 
-def calculate_arfwrf(grid, areas):
+def calculate_arfwrf(grid, areas, grid_idx=None, max_workers=4):
     """
     Generator which calculates ARF and WRF values based on polygons representing blocked areas.
+    Candidate cells of every blocked area are taken by col/row range of the area bounding box (or by centroids
+    of cells overlapping the bounding box on irregular grids),
+    and the prepared geometry intersections of blocked areas are evaluated in a pool of threads.
+    Rows are yielded in order of grid and area fids. First value of every row is GPB point of the cell centroid.
     """
     try:
         sides = (
@@ -1684,51 +1717,84 @@ def calculate_arfwrf(grid, areas):
                 )
             ),
         )
-        was_null = False
-        allfeatures, index = spatial_index(areas)
-        features = grid.getFeatures()
-        first = next(features)
-        grid_area = first.geometry().area()
-        grid_side = math.sqrt(grid_area)
+        if grid_idx is None:
+            grid_idx = grid_layer_index(grid)
+        grid_side = grid_idx.cell_size
+        grid_area = grid_side * grid_side
         octagon_side = grid_side / 2.414
         half_square = grid_side * 0.5
         half_octagon = octagon_side * 0.5
         empty_wrf = (0,) * 8
         full_wrf = (1,) * 8
-        features.rewind()
-        for feat in features:
-            geom = feat.geometry()
-            fids = index.intersects(geom.boundingBox())
-            for fid in fids:
-                f = allfeatures[fid]
-                fgeom = f.geometry()
-                if f["calc_arf"] == NULL or f["calc_wrf"] == NULL:
-                    was_null = True
-                farf = int(1 if f["calc_arf"] == NULL else f["calc_arf"])
-                fwrf = int(1 if f["calc_wrf"] == NULL else f["calc_wrf"])
-                inter = fgeom.intersects(geom)
-                if inter is True:
-                    areas_intersection = fgeom.intersection(geom)
-                    arf = round(areas_intersection.area() / grid_area, 2) if farf == 1 else 0
-                    centroid = geom.centroid()
-                    centroid_wkt = centroid.asWkt()
-                    if arf >= 0.9:
-                        yield (centroid_wkt, feat.id(), f.id(), 1) + (full_wrf if fwrf == 1 else empty_wrf), was_null
-                        continue
-                    else:
-                        pass
-                    grid_center = centroid.asPoint()
-                    wrf_s = (f(grid_center.x(), grid_center.y(), half_square, half_octagon) for f in sides)
-                    wrf_geoms = (
-                        QgsGeometry.fromPolylineXY([QgsPointXY(x1, y1), QgsPointXY(x2, y2)]) for x1, y1, x2, y2 in wrf_s
-                    )
-                    if fwrf == 1:
-                        wrf = (round(line.intersection(fgeom).length() / octagon_side, 2) for line in wrf_geoms)
-                    else:
-                        wrf = empty_wrf
-                    yield (centroid_wkt, feat.id(), f.id(), arf) + tuple(wrf), was_null
+
+        x_order = np.argsort(grid_idx.x, kind="stable")
+        sorted_x = grid_idx.x[x_order]
+
+        def irregular_candidate_cells(bbox):
+            start = np.searchsorted(sorted_x, bbox.xMinimum() - half_square, side="left")
+            end = np.searchsorted(sorted_x, bbox.xMaximum() + half_square, side="right")
+            positions = x_order[start:end]
+            ys = grid_idx.y[positions]
+            positions = positions[(ys >= bbox.yMinimum() - half_square) & (ys <= bbox.yMaximum() + half_square)]
+            return zip(grid_idx.fid[positions].tolist(), grid_idx.x[positions].tolist(), grid_idx.y[positions].tolist())
+
+        def candidate_cells(bbox):
+            if not grid_idx.regular:
+                return irregular_candidate_cells(bbox)
+            col_min = max(int(math.ceil((bbox.xMinimum() - grid_idx.x_origin) / grid_side - 0.5)), 0)
+            col_max = min(int(math.floor((bbox.xMaximum() - grid_idx.x_origin) / grid_side + 0.5)), grid_idx.ncols - 1)
+            row_min = max(int(math.ceil((bbox.yMinimum() - grid_idx.y_origin) / grid_side - 0.5)), 0)
+            row_max = min(int(math.floor((bbox.yMaximum() - grid_idx.y_origin) / grid_side + 0.5)), grid_idx.nrows - 1)
+            if col_min > col_max or row_min > row_max:
+                return []
+            fids = grid_idx.fid_raster[row_min : row_max + 1, col_min : col_max + 1].ravel()
+            fids = fids[fids > 0]
+            positions = grid_idx.positions(fids)
+            return zip(fids.tolist(), grid_idx.x[positions].tolist(), grid_idx.y[positions].tolist())
+
+        def area_rows(f):
+            rows = []
+            fgeom = f.geometry()
+            was_null = f["calc_arf"] == NULL or f["calc_wrf"] == NULL
+            farf = int(1 if f["calc_arf"] == NULL else f["calc_arf"])
+            fwrf = int(1 if f["calc_wrf"] == NULL else f["calc_wrf"])
+            engine = QgsGeometry.createGeometryEngine(fgeom.constGet())
+            engine.prepareGeometry()
+            for gid, x, y in candidate_cells(fgeom.boundingBox()):
+                cell = QgsGeometry.fromRect(
+                    QgsRectangle(x - half_square, y - half_square, x + half_square, y + half_square)
+                )
+                if not engine.intersects(cell.constGet()):
+                    continue
+                if farf == 1:
+                    areas_intersection = engine.intersection(cell.constGet())
+                    inter_area = areas_intersection.area() if areas_intersection is not None else 0
+                    arf = round(inter_area / grid_area, 2)
                 else:
-                    pass
+                    arf = 0
+                if arf >= 0.9:
+                    rows.append(((gid, f.id(), 1) + (full_wrf if fwrf == 1 else empty_wrf), x, y, was_null))
+                    continue
+                if fwrf == 1:
+                    wrf = []
+                    for side in sides:
+                        x1, y1, x2, y2 = side(x, y, half_square, half_octagon)
+                        line = QgsGeometry.fromPolylineXY([QgsPointXY(x1, y1), QgsPointXY(x2, y2)])
+                        wrf_intersection = engine.intersection(line.constGet())
+                        length = wrf_intersection.length() if wrf_intersection is not None else 0
+                        wrf.append(round(length / octagon_side, 2))
+                    wrf = tuple(wrf)
+                else:
+                    wrf = empty_wrf
+                rows.append(((gid, f.id(), arf) + wrf, x, y, was_null))
+            return rows
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(area_rows, areas.getFeatures()))
+        all_rows = [row for rows in results for row in rows]
+        all_rows.sort(key=lambda r: (r[0][0], r[0][1]))
+        for row, x, y, was_null in all_rows:
+            yield (point_gpb(x, y),) + row, was_null
 
     except:
         show_error(
@@ -1867,10 +1933,6 @@ def fid_from_grid_np(gutils, table_name, table_fids=None, grid_center=False, swi
     Optionally, users can specify a list of table_fids to be checked.
     """
     grid_elems = []
-    if cellIDNumpyArray is None:
-        cellIDNumpyArray, xvalsNumpyArray, yvalsNumpyArray = buildCellIDNPArray(gutils)
-    if cellElevNumpyArray is None:
-        cellElevNumpyArray = buildCellElevNPArray(gutils, cellIDNumpyArray)
 
     # iterate over features
 
@@ -1884,8 +1946,6 @@ def divide_line_grid_np(gutils, line):
     #  [17, [[18.25, 12.25], [25.25, 13.2]]],
     # ]
     lineSegments = []
-    if cellIDNumpyArray is None:
-        cellIDNumpyArray, xvalsNumpyArray, yvalsNumpyArray = buildCellIDNPArray(gutils)
 
     return lineSegments
 
@@ -1980,59 +2040,19 @@ def highlight_selected_xsection_b(layer, xs_id):
 
 def buildCellIDNPArray(gutils):
     # construct numpy arrays of key grid parameters such as cellid and elevation
-    starttime = datetime.datetime.now()
-    incTime = datetime.datetime.now()
-
-    centroids = gutils.grid_centroids_all()
-    print("Centroids pull time: %s sec" % (datetime.datetime.now() - incTime).total_seconds())
-    incTime = datetime.datetime.now()
-    # list in format [gid, [x, y]]
-    xVals = sorted(list(set([item[1][0] for item in centroids])))
-    yVals = sorted(list(set([item[1][1] for item in centroids])))
-
-    centroids = sorted(centroids, key=lambda student: student[0])
-
-    centroids = [(item[1][0], item[1][1], item[0]) for item in centroids]  # flatten list
-
-    centroids = np.array(centroids, dtype=float)
-
-    # yVals = yVals.sort(reverse=True) # place in reverse order per raster orientation
-    xVals = np.array(xVals, dtype=float)
-    yVals = np.array(yVals, dtype=float)
-
-    centroidsXInd = np.searchsorted(xVals, centroids[:, 0], side="right") - 1
-    centroidsYInd = np.searchsorted(yVals, centroids[:, 1], side="right")
-
-    centroidsYInd = yVals.shape[0] - centroidsYInd  # for reverse ordering
-    yVals = np.flip(yVals)  # reverse order
-
-    cellIDs = np.zeros((yVals.shape[0], xVals.shape[0]), dtype=int)
-    # populate cellIDs array
-    cellIDs[centroidsYInd, centroidsXInd] = centroids[:, 2]
-    # for n in range(centroids.shape[0]):
-    #    cellIDs[centroidsYInd[n], centroidsXInd[n]] = n + 1
-
-    del centroidsXInd, centroidsYInd, centroids
-    print("Array creation time: %s sec" % (datetime.datetime.now() - incTime).total_seconds())
-    print("Total CellID time: %s sec" % (datetime.datetime.now() - starttime).total_seconds())
+    # the arrays are taken from the shared grid index, so they are rebuilt only after the grid was changed
+    index = cached_grid_index(gutils)
+    cellIDs = np.flipud(index.fid_raster).copy()  # row 0 at the top per raster orientation
+    xVals = index.x_origin + np.arange(index.ncols, dtype=float) * index.cell_size
+    yVals = np.flip(index.y_origin + np.arange(index.nrows, dtype=float) * index.cell_size)  # reverse order
     return cellIDs, xVals, yVals
 
 
 def buildCellElevNPArray(gutils, cellIDArray):
-    starttime = datetime.datetime.now()
-    qry_elevs = """SELECT elevation FROM grid ORDER BY fid"""
-    elevs = gutils.execute(qry_elevs).fetchall()
-    print("Elevs pull time: %s sec" % (datetime.datetime.now() - starttime).total_seconds())
-    incTime = datetime.datetime.now()
-
-    elevs = np.array(elevs, dtype=float)
-    elevs = elevs[:, 0]
+    index = cached_grid_index(gutils)
     elevArray = np.zeros(cellIDArray.shape, dtype=float)
-
-    elevArray[cellIDArray != 0] = elevs[cellIDArray[cellIDArray != 0] - 1]
-    print("Elevs Array assignment time: %s sec" % (datetime.datetime.now() - incTime).total_seconds())
-    incTime = datetime.datetime.now()
-    print("Total Elev Array Gen time: %s sec" % (datetime.datetime.now() - starttime).total_seconds())
+    mask = cellIDArray != 0
+    elevArray[mask] = index.elevation[index.positions(cellIDArray[mask])]
     return elevArray
 
 
@@ -2075,7 +2095,6 @@ def adjacent_grid_elevations_np(cell, cellNPArray, elevNPArray):
 
 
 def adjacent_grid_elevations(gutils, grid_lyr, cell, cell_size):
-    sel_elev_qry = """SELECT elevation FROM grid WHERE fid = ?;"""
     if grid_lyr is not None:
         if cell != "":
             cell = int(cell)
@@ -2085,164 +2104,119 @@ def adjacent_grid_elevations(gutils, grid_lyr, cell, cell_size):
                 currentCell = next(grid_lyr.getFeatures(QgsFeatureRequest(cell)))
                 xx, yy = currentCell.geometry().centroid().asPoint()
 
+                # N, NE, E, SE, S, SW, W and NW cells:
+                xs = xx + np.array([0, 1, 1, 1, 0, -1, -1, -1]) * cell_size
+                ys = yy + np.array([1, 1, 0, -1, -1, -1, 0, 1]) * cell_size
+                grids, grid_elevs = gutils.grid_on_points(xs, ys, with_elevation=True)
                 elevs = []
-                # North cell:
-                y = yy + cell_size
-                x = xx
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    N_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    N_elev = -999
-                elevs.append(N_elev)
-
-                # NorthEast cell
-                y = yy + cell_size
-                x = xx + cell_size
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    NE_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    NE_elev = -999
-                elevs.append(NE_elev)
-
-                # East cell:
-                x = xx + cell_size
-                y = yy
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    E_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    E_elev = -999
-                elevs.append(E_elev)
-
-                # SouthEast cell:
-                y = yy - cell_size
-                x = xx + cell_size
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    SE_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    SE_elev = -999
-                elevs.append(SE_elev)
-
-                # South cell:
-                y = yy - cell_size
-                x = xx
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    S_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    S_elev = -999
-                elevs.append(S_elev)
-
-                # SouthWest cell:
-                y = yy - cell_size
-                x = xx - cell_size
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    SW_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    SW_elev = -999
-                elevs.append(SW_elev)
-
-                # West cell:
-                y = yy
-                x = xx - cell_size
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    W_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    W_elev = -999
-                elevs.append(W_elev)
-
-                # NorthWest cell:
-                y = yy + cell_size
-                x = xx - cell_size
-                grid = gutils.grid_on_point(x, y)
-                if grid is not None:
-                    NW_elev = gutils.execute(sel_elev_qry, (grid,)).fetchone()[0]
-                else:
-                    NW_elev = -999
-                elevs.append(NW_elev)
+                for grid, elev in zip(grids.tolist(), grid_elevs.tolist()):
+                    if grid == 0:
+                        elev = -999
+                    elif np.isnan(elev):
+                        elev = None
+                    elevs.append(elev)
 
                 return elevs
 
 
-def adjacent_average_elevation(gutils, grid_lyr, xx, yy, cell_size):
-    # sel_elev_qry = "SELECT elevation FROM grid WHERE fid = ?;"
-    if grid_lyr is not None:
-        elevs = []
-
-        # North cell:
-        y = yy + cell_size
-        x = xx
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
-
-        # NorthEast cell
-        y = yy + cell_size
-        x = xx + cell_size
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
-
-        # East cell:
-        x = xx + cell_size
-        y = yy
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
-
-        # SouthEast cell:
-        y = yy - cell_size
-        x = xx + cell_size
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
-
-        # South cell:
-        y = yy - cell_size
-        x = xx
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
-
-        # SouthWest cell:
-        y = yy - cell_size
-        x = xx - cell_size
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
-
-        # West cell:
-        y = yy
-        x = xx - cell_size
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
+def fill_nodata_raster(values, valid, fillable, max_distance=0):
+    """
+    Function which fills holes of the dense raster by inverse distance weighting of 8 adjacent cells.
+    Holes are filled inwards ring by ring, so every ring is interpolated from the previous ones.
+    'max_distance' limits number of rings (in cells, 0 for no limit). Returns (filled values, mask of filled cells).
+    """
+    nrows, ncols = values.shape
+    pcols = ncols + 2
+    offsets = np.array([dr * pcols + dc for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc], dtype=np.int64)
+    weights = np.array([1.0 / math.hypot(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc])
+    padded_values = np.pad(np.where(valid, values, 0.0).astype(np.float64), 1).ravel()
+    padded_valid = np.pad(valid, 1).ravel()
+    padded_todo = np.pad(fillable & ~valid, 1).ravel()
+
+    todo = np.flatnonzero(padded_todo)
+    frontier = todo[padded_valid[todo[:, None] + offsets].any(axis=1)]
+    rings = 0
+    while frontier.size and (max_distance <= 0 or rings < max_distance):
+        neighbours = frontier[:, None] + offsets
+        neighbour_weights = padded_valid[neighbours] * weights
+        padded_values[frontier] = (padded_values[neighbours] * neighbour_weights).sum(axis=1) / neighbour_weights.sum(
+            axis=1
+        )
+        padded_valid[frontier] = True
+        padded_todo[frontier] = False
+        neighbours = neighbours.ravel()
+        frontier = np.unique(neighbours[padded_todo[neighbours]])
+        rings += 1
+
+    filled = padded_valid.reshape(nrows + 2, pcols)[1:-1, 1:-1] & ~valid
+    return padded_values.reshape(nrows + 2, pcols)[1:-1, 1:-1], filled
+
+
+def fill_nodata_cells(grid_idx, values, valid, cells_on_points, max_distance=0):
+    """
+    Function which fills holes like 'fill_nodata_raster', but on cells of the irregular grid given by index arrays.
+    Adjacent cells are found under the centroids shifted by the cell size with 'cells_on_points(xs, ys)' function.
+    Returns (filled values, mask of filled cells) in order of the index arrays.
+    """
+    count = grid_idx.count
+    cs = grid_idx.cell_size
+    neighbours = np.full((count, len(COMPASS_DIRECTIONS)), count, dtype=np.int64)
+    weights = np.zeros(len(COMPASS_DIRECTIONS))
+    for i, direction in enumerate(COMPASS_DIRECTIONS):
+        dcol, drow = COMPASS_OFFSETS[direction]
+        weights[i] = 1.0 / math.hypot(dcol, drow)
+        fids = np.asarray(cells_on_points(grid_idx.x + dcol * cs, grid_idx.y + drow * cs), dtype=np.int64)
+        pos = grid_idx.positions(fids)
+        found = (pos >= 0) & (fids != grid_idx.fid)
+        neighbours[found, i] = pos[found]
+    # Extra cell at the end stands for missing neighbours.
+    padded_values = np.append(np.where(valid, values, 0.0).astype(np.float64), 0.0)
+    padded_valid = np.append(valid, False)
+    todo = np.flatnonzero(~valid)
+    rings = 0
+    while todo.size and (max_distance <= 0 or rings < max_distance):
+        frontier = todo[padded_valid[neighbours[todo]].any(axis=1)]
+        if not frontier.size:
+            break
+        frontier_neighbours = neighbours[frontier]
+        neighbour_weights = padded_valid[frontier_neighbours] * weights
+        weighted = (padded_values[frontier_neighbours] * neighbour_weights).sum(axis=1)
+        padded_values[frontier] = weighted / neighbour_weights.sum(axis=1)
+        padded_valid[frontier] = True
+        todo = todo[~padded_valid[todo]]
+        rings += 1
+    return padded_values[:count], padded_valid[:count] & ~valid
+
+
+def fill_grid_nodata(gutils, nodata=-9999, max_distance=0):
+    """
+    Function which fills grid cells with 'nodata' elevation from elevations of adjacent cells.
+    Cells of the regular grid are filled on its dense col/row raster, cells of the irregular one with spatial lookups
+    of the adjacent cells. Filled elevations are written back in one batch.
+    Returns (fids of filled cells, fids of cells still without elevation).
+    """
+    grid_idx = cached_grid_index(gutils)
+    if grid_idx.regular:
+        elevation = grid_idx.raster(grid_idx.elevation, np.nan)
+        fillable = grid_idx.fid_raster > 0
+        valid = fillable & ~np.isnan(elevation) & (elevation != nodata)
+        filled_elevation, filled = fill_nodata_raster(elevation, valid, fillable, max_distance)
+        valid_cells = valid[grid_idx.row_idx, grid_idx.col_idx]
+        filled_cells = filled[grid_idx.row_idx, grid_idx.col_idx]
+        cell_elevation = filled_elevation[grid_idx.row_idx, grid_idx.col_idx]
+    else:
+        valid_cells = ~np.isnan(grid_idx.elevation) & (grid_idx.elevation != nodata)
+        cell_elevation, filled_cells = fill_nodata_cells(
+            grid_idx, grid_idx.elevation, valid_cells, gutils.grid_on_points, max_distance
+        )
 
-        # NorthWest cell:
-        y = yy + cell_size
-        x = xx - cell_size
-        e = gutils.grid_elevation_on_point(x, y)
-        # if e is not None and e != -9999:
-        elevs.append(e)
-
-        # Return average elevation of adjacent cells:
-        n = 0
-        avrg = 0
-        for elev in elevs:
-            if elev is not None and elev != -9999:
-                avrg += elev
-                n += 1
-        if n > 0:
-            avrg = avrg / n
-        else:
-            avrg = -9999
+    filled_fids = grid_idx.fid[filled_cells]
+    filled_values = np.round(cell_elevation[filled_cells], 4)
+    qry = "UPDATE grid SET elevation = ? WHERE fid = ?;"
+    gutils.execute_many(qry, zip(filled_values.tolist(), filled_fids.tolist()))
 
-        return avrg
+    empty_cells = ~valid_cells & ~filled_cells
+    return filled_fids, grid_idx.fid[empty_cells]
 
 
 def three_adjacent_grid_elevations(gutils, grid_lyr, cell, direction, cell_size):
@@ -24,11 +24,12 @@ from qgis.PyQt.QtCore import QVariant
 from qgis.PyQt.QtWidgets import QApplication
 from qgis.utils import iface
 
+from ..errors import Flo2dError
 from ..user_communication import UserCommunication
 from .grid_tools import (
     centroids2poly_geos,
-    gridRegionGenerator,
     intersection_spatial_index,
+    parallelRegionGenerator,
     poly2poly_geos_from_features,
 )
 
@@ -118,11 +119,164 @@ class InfiltrationCalculator(object):
         self.cd_fld = cd_fld
         self.imp_fld = imp_fld
 
+    def green_ampt_region(self, request, grid, soil, land):
+        """
+        Calculating Green-Ampt parameters of grid cells in the region (grid, soil and land are feature sources).
+        """
+        region_params = {}
+        green_ampt = GreenAmpt()
+        # calculate extent of concerned grid element
+        grid_elems = grid.getFeatures(request)
+        grid_elem_extent = QgsRectangle()
+        grid_elem_extent.setMinimal()
+        for grid_elem in grid_elems:
+            grid_elem_extent.combineExtentWith(grid_elem.geometry().boundingBox())
+
+        grid_elem_extent.grow(grid_elem_extent.width() / 20.0)
+        soil_and_land_request = QgsFeatureRequest()
+        soil_and_land_request.setFilterRect(grid_elem_extent)
+
+        soil_features, soil_index = intersection_spatial_index(soil, soil_and_land_request, clip=True)
+        land_features, land_index = intersection_spatial_index(land, soil_and_land_request, clip=True)
+
+        land_soil_features = {}
+        land_soil_index = QgsSpatialIndex()
+        land_soil_fields = QgsFields()
+        land_soil_fields.append(QgsField("rtimp", QVariant.Double))
+        land_soil_fields.append(QgsField("dtheta", QVariant.Double))
+        land_soil_fields.append(QgsField("psif", QVariant.Double))
+        land_soil_fields.append(QgsField("saturation", QVariant.String))
+
+        land_soil_fid = 0
+
+        for land_feat, engine in land_features.values():
+            land_rtimp = land_feat[self.rtimpl_fld]
+            land_saturation = land_feat[self.saturation_fld]
+            land_geom = land_feat.geometry()
+
+            soil_fids = soil_index.intersects(land_geom.boundingBox())
+            for soil_fid in soil_fids:
+                soil_feat, soil_engine = soil_features[soil_fid]
+                soil_rtimp = soil_feat[self.rtimps_fld]
+                soil_dtheta = soil_feat[self.soil_dtheta_fld]
+                soil_psif = soil_feat[self.soil_psif_fld]
+
+                land_soil_geom = land_geom.intersection(soil_feat.geometry())
+
+                if land_soil_geom.isEmpty():
+                    continue
+
+                land_soil_feat = QgsFeature(land_soil_fields, land_soil_fid)
+
+                land_soil_feat.setGeometry(land_soil_geom)
+                land_soil_feat["rtimp"] = max(land_rtimp, soil_rtimp)
+                land_soil_feat["dtheta"] = soil_dtheta
+                land_soil_feat["psif"] = soil_psif
+                land_soil_feat["saturation"] = land_saturation
+                land_soil_features[land_soil_fid] = (
+                    land_soil_feat,
+                    QgsGeometry.createGeometryEngine(land_soil_geom.constGet()),
+                )
+                land_soil_index.insertFeature(land_soil_feat)
+                land_soil_fid = land_soil_fid + 1
+
+        soil_values = poly2poly_geos_from_features(
+            grid,
+            soil_features,
+            soil_index,
+            request,
+            self.xksat_fld,
+            self.soil_depth_fld,
+        )
+
+        for gid, values in soil_values:
+            try:
+                xksat_parts = [(row[0], row[-1]) for row in values]
+                avg_soil_depth = sum(row[1] * row[-1] for row in values)
+                avg_xksat = green_ampt.calculate_xksat_weighted(xksat_parts)
+
+                soil_params = {
+                    "soilParts": len(values),
+                    "soilhydc": avg_xksat,
+                    "hydc": avg_xksat,
+                    "soil_depth": avg_soil_depth,
+                }
+                if not self.log_area_average:
+                    soil_params["soils"] = green_ampt.calculate_psif(avg_xksat)
+                region_params[gid] = soil_params
+            except Exception as e:
+                raise Flo2dError(
+                    "ERROR 1401181951.2035: Green-Ampt infiltration failed"
+                    + "\nwhile intersecting soil layer with grid {}".format(gid)
+                ) from e
+
+        land_values = poly2poly_geos_from_features(
+            grid,
+            land_features,
+            land_index,
+            request,
+            self.saturation_fld,
+            self.vc_fld,
+            self.ia_fld,
+        )
+
+        for gid, values in land_values:
+            try:
+                land_params = region_params[gid]
+                avg_xksat = land_params["hydc"]
+
+                vc_parts = [(row[1], row[-1]) for row in values]
+                ia_parts = [(row[2], row[-1]) for row in values]
+
+                if not self.log_area_average:
+                    dtheta = sum([green_ampt.calculate_dtheta(avg_xksat, row[0]) * row[-1] for row in values])
+                    land_params["dtheta"] = dtheta
+
+                if self.vc_check is True:
+                    # perform vc adjustment
+                    xksatc = green_ampt.calculate_xksatc(avg_xksat, vc_parts)
+                else:
+                    # don't perform vc adjustment
+                    xksatc = avg_xksat
+
+                iabstr = green_ampt.calculate_iabstr(ia_parts)
+
+                land_params["hydc"] = xksatc
+                land_params["abstrinf"] = iabstr
+                land_params["luParts"] = len(values)
+
+            except ValueError as e:
+                raise ValueError("Calculation of land use variables failed for grid cell with fid: {}".format(gid))
+
+        land_soil_values = poly2poly_geos_from_features(
+            grid,
+            land_soil_features,
+            land_soil_index,
+            request,
+            "rtimp",
+            "dtheta",
+            "psif",
+            "saturation",
+        )
+        for gid, values in land_soil_values:
+            land_params = region_params[gid]
+            rtimp_parts, dtheta_parts, psif_parts = [], [], []
+            for rtimp, dtheta, psif, saturation, area in values:
+                rtimp_parts.append((rtimp * 0.01, area))
+                if saturation not in {"wet", "saturated"}:
+                    dtheta_parts.append((dtheta, area))
+                psif_parts.append((psif, area))
+            land_params["rtimpf"] = green_ampt.calculate_rtimp_n(rtimp_parts)
+            if self.log_area_average:
+                land_params["dtheta"] = green_ampt.calculate_dtheta_weighted(dtheta_parts)
+                land_params["soils"] = green_ampt.calculate_psif_weighted(psif_parts)
+
+        return region_params
+
     def green_ampt_infiltration(self):
         writeDiagnosticCSV = True  # flag to determine if a csv file should be written with computational values
         try:
             grid_params = {}
-            green_ampt = GreenAmpt()
 
             grid_element_count = self.grid_lyr.featureCount()
             if grid_element_count < 0:
@@ -130,171 +284,21 @@ class InfiltrationCalculator(object):
             else:
                 grid_span = int(max(sqrt(grid_element_count) / 10, 10))
 
-            for request in gridRegionGenerator(
+            regions = parallelRegionGenerator(
                 self.gutils,
                 self.grid_lyr,
+                self.green_ampt_region,
+                (self.grid_lyr, self.soil_lyr, self.land_lyr),
                 gridSpan=grid_span,
                 regionPadding=5,
                 showProgress=True,
-            ):
-                # calculate extent of concerned grid element
-                grid_elems = self.grid_lyr.getFeatures(request)
-                grid_elem_extent = QgsRectangle()
-                grid_elem_extent.setMinimal()
-                for grid_elem in grid_elems:
-                    grid_elem_extent.combineExtentWith(grid_elem.geometry().boundingBox())
-
-                grid_elem_extent.grow(grid_elem_extent.width() / 20.0)
-                soil_and_land_request = QgsFeatureRequest()
-                soil_and_land_request.setFilterRect(grid_elem_extent)
-
-                soil_features, soil_index = intersection_spatial_index(self.soil_lyr, soil_and_land_request, clip=True)
-                land_features, land_index = intersection_spatial_index(self.land_lyr, soil_and_land_request, clip=True)
-
-                land_soil_features = {}
-                land_soil_index = QgsSpatialIndex()
-                land_soil_fields = QgsFields()
-                land_soil_fields.append(QgsField("rtimp", QVariant.Double))
-                land_soil_fields.append(QgsField("dtheta", QVariant.Double))
-                land_soil_fields.append(QgsField("psif", QVariant.Double))
-                land_soil_fields.append(QgsField("saturation", QVariant.String))
-
-                land_soil_fid = 0
-
-                for land_feat, engine in land_features.values():
-                    land_rtimp = land_feat[self.rtimpl_fld]
-                    land_saturation = land_feat[self.saturation_fld]
-                    land_geom = land_feat.geometry()
-
-                    soil_fids = soil_index.intersects(land_geom.boundingBox())
-                    for soil_fid in soil_fids:
-                        soil_feat, soil_engine = soil_features[soil_fid]
-                        soil_rtimp = soil_feat[self.rtimps_fld]
-                        soil_dtheta = soil_feat[self.soil_dtheta_fld]
-                        soil_psif = soil_feat[self.soil_psif_fld]
-
-                        land_soil_geom = land_geom.intersection(soil_feat.geometry())
-
-                        if land_soil_geom.isEmpty():
-                            continue
-
-                        land_soil_feat = QgsFeature(land_soil_fields, land_soil_fid)
-
-                        land_soil_feat.setGeometry(land_soil_geom)
-                        land_soil_feat["rtimp"] = max(land_rtimp, soil_rtimp)
-                        land_soil_feat["dtheta"] = soil_dtheta
-                        land_soil_feat["psif"] = soil_psif
-                        land_soil_feat["saturation"] = land_saturation
-                        land_soil_features[land_soil_fid] = (
-                            land_soil_feat,
-                            QgsGeometry.createGeometryEngine(land_soil_geom.constGet()),
-                        )
-                        land_soil_index.insertFeature(land_soil_feat)
-                        land_soil_fid = land_soil_fid + 1
-
-                try:
-                    soil_values = poly2poly_geos_from_features(
-                        self.grid_lyr,
-                        soil_features,
-                        soil_index,
-                        request,
-                        self.xksat_fld,
-                        self.soil_depth_fld,
-                    )
-                except Exception as e:
-                    self.uc.show_error(
-                        "ERROR 051218.2035: Green-Ampt infiltration failed\nwhile intersecting soil layer with grid."
-                        + "\n__________________________________________________",
-                        e,
-                    )
-                    return grid_params
-
-                for gid, values in soil_values:
-                    try:
-                        xksat_parts = [(row[0], row[-1]) for row in values]
-                        avg_soil_depth = sum(row[1] * row[-1] for row in values)
-                        avg_xksat = green_ampt.calculate_xksat_weighted(xksat_parts)
-
-                        soil_params = {
-                            "soilParts": len(values),
-                            "soilhydc": avg_xksat,
-                            "hydc": avg_xksat,
-                            "soil_depth": avg_soil_depth,
-                        }
-                        if not self.log_area_average:
-                            soil_params["soils"] = green_ampt.calculate_psif(avg_xksat)
-                        grid_params[gid] = soil_params
-                    except Exception as e:
-                        self.uc.show_error(
-                            "ERROR 1401181951.2035: Green-Ampt infiltration failed"
-                            + "\nwhile intersecting soil layer with grid {}".format(gid)
-                            + "\n__________________________________________________",
-                            e,
-                        )
-                        return grid_params
-
-                land_values = poly2poly_geos_from_features(
-                    self.grid_lyr,
-                    land_features,
-                    land_index,
-                    request,
-                    self.saturation_fld,
-                    self.vc_fld,
-                    self.ia_fld,
-                )
-
-                for gid, values in land_values:
-                    try:
-                        land_params = grid_params[gid]
-                        avg_xksat = land_params["hydc"]
-
-                        vc_parts = [(row[1], row[-1]) for row in values]
-                        ia_parts = [(row[2], row[-1]) for row in values]
-
-                        if not self.log_area_average:
-                            dtheta = sum([green_ampt.calculate_dtheta(avg_xksat, row[0]) * row[-1] for row in values])
-                            land_params["dtheta"] = dtheta
-
-                        if self.vc_check is True:
-                            # perform vc adjustment
-                            xksatc = green_ampt.calculate_xksatc(avg_xksat, vc_parts)
-                        else:
-                            # don't perform vc adjustment
-                            xksatc = avg_xksat
-
-                        iabstr = green_ampt.calculate_iabstr(ia_parts)
-
-                        land_params["hydc"] = xksatc
-                        land_params["abstrinf"] = iabstr
-                        land_params["luParts"] = len(values)
-
-                    except ValueError as e:
-                        raise ValueError(
-                            "Calculation of land use variables failed for grid cell with fid: {}".format(gid)
-                        )
-
-                land_soil_values = poly2poly_geos_from_features(
-                    self.grid_lyr,
-                    land_soil_features,
-                    land_soil_index,
-                    request,
-                    "rtimp",
-                    "dtheta",
-                    "psif",
-                    "saturation",
-                )
-                for gid, values in land_soil_values:
-                    land_params = grid_params[gid]
-                    rtimp_parts, dtheta_parts, psif_parts = [], [], []
-                    for rtimp, dtheta, psif, saturation, area in values:
-                        rtimp_parts.append((rtimp * 0.01, area))
-                        if saturation not in {"wet", "saturated"}:
-                            dtheta_parts.append((dtheta, area))
-                        psif_parts.append((psif, area))
-                    land_params["rtimpf"] = green_ampt.calculate_rtimp_n(rtimp_parts)
-                    if self.log_area_average:
-                        land_params["dtheta"] = green_ampt.calculate_dtheta_weighted(dtheta_parts)
-                        land_params["soils"] = green_ampt.calculate_psif_weighted(psif_parts)
+            )
+            try:
+                for request, region_params in regions:
+                    grid_params.update(region_params)
+            except Flo2dError as e:
+                self.uc.show_error(str(e) + "\n__________________________________________________", e.__cause__)
+                return grid_params
 
             if writeDiagnosticCSV is True:
                 # write a diagnostic CSV file with all fo the information for the calculations in it
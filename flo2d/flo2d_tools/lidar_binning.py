@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+import multiprocessing
+import os
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+LIDAR_BLOCKSIZE = 32 * 1024 * 1024
+LIDAR_TASK_BYTES = 128 * 1024 * 1024
+
+# Positions of X, Y and Z values for the supported number of columns in LIDAR files.
+LIDAR_XYZ_COLUMNS = {
+    3: (0, 1, 2),
+    4: (0, 1, 2),
+    5: (1, 2, 3),
+}
+
+
+def lidar_file_format(path, max_header_lines=100):
+    """
+    Return (delimiter, number of columns) detected from the first numeric line of the LIDAR file.
+    Delimiter is b"," for comma separated files and None for values separated by whitespace.
+    Number of columns is None for empty files or unsupported layouts.
+    """
+    first_line = None
+    with open(path, "rb") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            if first_line is None:
+                first_line = line
+            try:
+                [float(v) for v in line.replace(b",", b" ").split()]
+                break
+            except ValueError:
+                if i >= max_header_lines:
+                    line = first_line
+                    break
+        else:
+            if first_line is None:
+                return None, None
+            line = first_line
+    delimiter = b"," if b"," in line else None
+    columns = len(line.split(delimiter))
+    if columns not in LIDAR_XYZ_COLUMNS:
+        columns = None
+    return delimiter, columns
+
+
+def _parse_lines(lines, delimiter, columns):
+    """
+    Slow path for blocks with empty or malformed lines.
+    Returns (values, index of first invalid line or None).
+    """
+    rows = []
+    first_invalid = None
+    for i, line in enumerate(lines):
+        values = line.split(delimiter)
+        if not values or (len(values) == 1 and not values[0].strip()):
+            continue
+        try:
+            if len(values) != columns:
+                raise ValueError
+            rows.append([float(v) for v in values])
+        except ValueError:
+            if first_invalid is None:
+                first_invalid = i
+    return np.array(rows, dtype=np.float64).reshape(-1, columns), first_invalid
+
+
+def parse_lidar_block(block, delimiter, columns):
+    """
+    Parse block of complete LIDAR lines into (N, columns) float array.
+    Returns (values, index of the first invalid line within block or None).
+    """
+    if delimiter is not None:
+        text = block.replace(delimiter, b" ")
+    else:
+        text = block
+    n_lines = block.count(b"\n") + (0 if block.endswith(b"\n") else 1)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            values = np.fromstring(text, dtype=np.float64, sep=" ")
+        if values.size == n_lines * columns:
+            return values.reshape(-1, columns), None
+    except (ValueError, DeprecationWarning):
+        pass
+    return _parse_lines(block.splitlines(), delimiter, columns)
+
+
+def lidar_blocks(path, delimiter, columns, blocksize=LIDAR_BLOCKSIZE, start=0, end=None):
+    """
+    Generator of (xyz, line_number_of_first_invalid_line, bytes_read) tuples read from LIDAR file in blocks.
+    Every block holds at most 'blocksize' bytes of complete lines, so memory usage doesn't depend on the file size.
+    Optional 'start' and 'end' byte offsets limit reading to the lines starting within that range.
+    """
+    xyz_columns = list(LIDAR_XYZ_COLUMNS[columns])
+    end = os.path.getsize(path) if end is None else end
+    line_number = 0
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+        position = f.tell()
+        tail = b""
+        while position < end:
+            chunk = f.read(min(blocksize, end - position))
+            if not chunk:
+                break
+            position += len(chunk)
+            block = tail + chunk
+            cut = block.rfind(b"\n") + 1
+            if position >= end:
+                if not block.endswith(b"\n"):
+                    block += f.readline()
+                tail = b""
+            elif cut == 0:
+                tail = block
+                continue
+            else:
+                block, tail = block[:cut], block[cut:]
+            values, invalid = parse_lidar_block(block, delimiter, columns)
+            first_invalid = None if invalid is None else line_number + invalid + 1
+            line_number += block.count(b"\n")
+            yield values[:, xyz_columns], first_invalid, len(chunk)
+        if tail:
+            values, invalid = parse_lidar_block(tail, delimiter, columns)
+            first_invalid = None if invalid is None else line_number + invalid + 1
+            yield values[:, xyz_columns], first_invalid, 0
+
+
+class LidarBins(object):
+    """
+    Per cell aggregates (sum, count, min and max) of LIDAR points elevations.
+    Aggregates are kept in dense arrays covering the lattice of the GridIndex, so binning is fully vectorized.
+    Instances built for the same lattice can be merged together.
+    """
+
+    def __init__(self, ncols, nrows, x_origin, y_origin, cell_size, fid_raster=None):
+        self.ncols = ncols
+        self.nrows = nrows
+        self.x_origin = x_origin
+        self.y_origin = y_origin
+        self.cell_size = cell_size
+        self.fid_raster = fid_raster
+        size = ncols * nrows
+        self.sum = np.zeros(size, dtype=np.float64)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.min = np.full(size, np.inf, dtype=np.float64)
+        self.max = np.full(size, -np.inf, dtype=np.float64)
+        self.inside = 0
+        self.outside = 0
+
+    @classmethod
+    def from_grid_index(cls, index):
+        return cls(index.ncols, index.nrows, index.x_origin, index.y_origin, index.cell_size, index.fid_raster)
+
+    def add(self, xs, ys, zs):
+        """
+        Accumulate points into the bins. Points outside the grid are only counted.
+        """
+        col_idx = np.floor((xs - self.x_origin) / self.cell_size + 0.5).astype(np.int64)
+        row_idx = np.floor((ys - self.y_origin) / self.cell_size + 0.5).astype(np.int64)
+        inside = (col_idx >= 0) & (col_idx < self.ncols) & (row_idx >= 0) & (row_idx < self.nrows)
+        if self.fid_raster is not None:
+            inside[inside] = self.fid_raster[row_idx[inside], col_idx[inside]] > 0
+        flat = row_idx[inside] * self.ncols + col_idx[inside]
+        zs = zs[inside]
+        size = self.sum.shape[0]
+        self.sum += np.bincount(flat, weights=zs, minlength=size)
+        self.count += np.bincount(flat, minlength=size)
+        np.minimum.at(self.min, flat, zs)
+        np.maximum.at(self.max, flat, zs)
+        n_inside = flat.shape[0]
+        self.inside += n_inside
+        self.outside += xs.shape[0] - n_inside
+
+    def add_file(self, path, blocksize=LIDAR_BLOCKSIZE, start=0, end=None, progress=None):
+        """
+        Stream LIDAR file (or its byte range) into the bins.
+        Returns line number of the first invalid line (or None). Invalid lines are skipped.
+        Optional 'progress' callable gets number of bytes read after each block. Returning True from it cancels reading.
+        """
+        delimiter, columns = lidar_file_format(path)
+        if columns is None:
+            return 1 if os.path.getsize(path) > 0 else None
+        first_invalid = None
+        for xyz, invalid, nbytes in lidar_blocks(path, delimiter, columns, blocksize, start, end):
+            self.add(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+            if first_invalid is None:
+                first_invalid = invalid
+            if progress is not None and progress(nbytes):
+                break
+        return first_invalid
+
+    def merge(self, other):
+        """
+        Merge aggregates of other bins built for the same lattice.
+        """
+        self.sum += other.sum
+        self.count += other.count
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        self.inside += other.inside
+        self.outside += other.outside
+
+    def partial(self):
+        """
+        Return compact aggregates of non-empty bins, suitable for sending between processes.
+        """
+        filled = np.flatnonzero(self.count)
+        return (
+            filled,
+            self.sum[filled],
+            self.count[filled],
+            self.min[filled],
+            self.max[filled],
+            self.inside,
+            self.outside,
+        )
+
+    def merge_partial(self, partial):
+        """
+        Merge aggregates returned by 'partial' method of other bins built for the same lattice.
+        """
+        filled, sums, counts, mins, maxs, inside, outside = partial
+        self.sum[filled] += sums
+        self.count[filled] += counts
+        self.min[filled] = np.minimum(self.min[filled], mins)
+        self.max[filled] = np.maximum(self.max[filled], maxs)
+        self.inside += inside
+        self.outside += outside
+
+    def lattice(self):
+        return self.ncols, self.nrows, self.x_origin, self.y_origin, self.cell_size, self.fid_raster
+
+    def mean(self, nodata=np.nan):
+        """
+        Return dense (nrows, ncols) raster of mean elevations (nodata for empty bins).
+        """
+        mean = np.full(self.sum.shape, nodata, dtype=np.float64)
+        filled = self.count > 0
+        mean[filled] = self.sum[filled] / self.count[filled]
+        return mean.reshape(self.nrows, self.ncols)
+
+    def cell_values(self, index, statistic="mean"):
+        """
+        Return (values, counts) arrays of chosen statistic for cells of GridIndex (NaN for cells without points).
+        """
+        flat = index.row_idx * self.ncols + index.col_idx
+        counts = self.count[flat]
+        if statistic == "mean":
+            values = self.mean().ravel()[flat]
+        else:
+            values = getattr(self, statistic)[flat].astype(np.float64)
+            values[counts == 0] = np.nan
+        return values, counts
+
+
+def lidar_tasks(lidar_files, task_bytes=LIDAR_TASK_BYTES):
+    """
+    Split LIDAR files into (path, start, end) byte ranges of at most 'task_bytes' bytes.
+    """
+    tasks = []
+    for path in lidar_files:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), task_bytes):
+            tasks.append((path, start, min(start + task_bytes, size)))
+    return tasks
+
+
+_worker_lattice = None
+
+
+def _init_lidar_worker(lattice):
+    global _worker_lattice
+    _worker_lattice = lattice
+
+
+def bin_lidar_range(path, start, end):
+    """
+    Process pool task binning byte range of the LIDAR file. Returns (partial aggregates, first invalid line).
+    """
+    bins = LidarBins(*_worker_lattice)
+    first_invalid = bins.add_file(path, start=start, end=end)
+    return bins.partial(), first_invalid
+
+
+def spawn_process_context():
+    """
+    Return 'spawn' multiprocessing context for the plugin process pools.
+    In embedded interpreters (e.g. QGIS) sys.executable is the application itself,
+    so child processes are started with the Python interpreter bundled within sys.exec_prefix.
+    """
+    context = multiprocessing.get_context("spawn")
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        candidates = [
+            os.path.join(sys.exec_prefix, "pythonw.exe"),
+            os.path.join(sys.exec_prefix, "python.exe"),
+            os.path.join(sys.exec_prefix, "bin", "python3"),
+        ]
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                context.set_executable(candidate)
+                break
+    return context
+
+
+def lidar_process_pool(bins, max_workers):
+    """
+    Return process pool for 'bin_lidar_range' tasks. Workers get the lattice of given bins once at startup.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=spawn_process_context(),
+        initializer=_init_lidar_worker,
+        initargs=(bins.lattice(),),
+    )
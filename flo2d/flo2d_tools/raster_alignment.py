@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+import numpy as np
+
+from .grid_index import cached_grid_index
+from .grid_tools import sampled_values
+
+
+def raster_georeference(raster):
+    """
+    Return (geotransform, width, height, crs) key of the GDALRasterLayer pixel lattice.
+    """
+    geotransform = " ".join("{:.12g}".format(v) for v in raster.ds.GetGeoTransform())
+    return geotransform, raster.width, raster.height, raster.ds.GetProjection()
+
+
+def raster_aligned_with_grid(raster, grid_idx, tolerance=1e-3):
+    """
+    Check if raster pixels coincide with grid cells (same pixel size and cell centroids in pixel centers).
+    """
+    x_off, x_res, x_rot, y_off, y_rot, y_res = raster.ds.GetGeoTransform()
+    if x_rot or y_rot or grid_idx.count == 0:
+        return False
+    cell_size = grid_idx.cell_size
+    if abs(x_res - cell_size) > tolerance * cell_size or abs(-y_res - cell_size) > tolerance * cell_size:
+        return False
+    fcol = (grid_idx.x_origin - x_off) / x_res - 0.5
+    frow = (grid_idx.y_origin - y_off) / y_res - 0.5
+    return abs(fcol - round(fcol)) < tolerance and abs(frow - round(frow)) < tolerance
+
+
+class GridRasterAlignment(object):
+    """
+    Cache of grid cells to raster pixels mapping kept in the 'grid_raster_alignment' table.
+    Every row holds flat pixel indexes (-1 outside the raster) of all grid cells for one raster georeference,
+    so sampling any raster on the same lattice is a single gather from its band blocks.
+    Pixels holding the cells centroids are what nearest neighbour resampling takes, so it is used for source rasters
+    in the grid CRS regardless of their alignment (other algorithms and reprojection need the warp).
+    Rows made for a different grid layout are replaced when the mapping is requested again.
+    """
+
+    def __init__(self, gutils):
+        self.gutils = gutils
+
+    def create_table(self):
+        self.gutils.execute(
+            """CREATE TABLE IF NOT EXISTS "grid_raster_alignment" (
+                "fid" INTEGER PRIMARY KEY NOT NULL,
+                "geotransform" TEXT,
+                "width" INTEGER,
+                "height" INTEGER,
+                "crs" TEXT,
+                "grid_hash" TEXT,
+                "pixels" BLOB
+            );"""
+        )
+        self.gutils.execute(
+            """INSERT OR IGNORE INTO gpkg_contents (table_name, data_type) VALUES ('grid_raster_alignment', 'aspatial');"""
+        )
+
+    def pixels(self, raster, grid_idx):
+        """
+        Return (rows, cols) arrays of raster pixels holding centroids of grid cells (in GridIndex order).
+        """
+        self.create_table()
+        georeference = raster_georeference(raster)
+        grid_hash = grid_idx.fingerprint()
+        qry = """SELECT grid_hash, pixels FROM grid_raster_alignment
+                 WHERE geotransform = ? AND width = ? AND height = ? AND crs = ?;"""
+        row = self.gutils.execute(qry, georeference).fetchone()
+        if row is not None and row[0] == grid_hash:
+            flat = np.frombuffer(row[1], dtype=np.int64)
+            rows, cols = np.divmod(flat, raster.width)
+            rows[flat < 0] = -1
+            cols[flat < 0] = -1
+            return rows, cols
+
+        rows, cols = raster.index(grid_idx.x, grid_idx.y)
+        inside = (rows >= 0) & (rows < raster.height) & (cols >= 0) & (cols < raster.width)
+        flat = np.where(inside, rows * raster.width + cols, -1).astype(np.int64)
+        del_qry = """DELETE FROM grid_raster_alignment
+                     WHERE grid_hash <> ? OR (geotransform = ? AND width = ? AND height = ? AND crs = ?);"""
+        ins_qry = """INSERT INTO grid_raster_alignment (geotransform, width, height, crs, grid_hash, pixels)
+                     VALUES (?,?,?,?,?,?);"""
+        self.gutils.execute(del_qry, (grid_hash,) + georeference)
+        self.gutils.execute(ins_qry, georeference + (grid_hash, flat.tobytes()))
+        return rows, cols
+
+    def sample(self, raster, band=1):
+        """
+        Return (fids, values) arrays of raster band values at grid cells centroids (NaN for NODATA).
+        """
+        grid_idx = cached_grid_index(self.gutils)
+        rows, cols = self.pixels(raster, grid_idx)
+        return grid_idx.fid, raster.sample_pixels(rows, cols, band)
+
+    def clear(self):
+        self.create_table()
+        self.gutils.clear_tables("grid_raster_alignment")
+
+
+def sample_raster_on_grid(gutils, raster_path, band=1):
+    """
+    Return list of (value, fid) rows of raster values sampled at grid cells centroids (None for NODATA).
+    Pixel indexes of cells are taken from the GeoPackage alignment cache.
+    """
+    from ..misc.gdal_utils import GDALRasterLayer
+
+    raster = GDALRasterLayer(raster_path)
+    fids, values = GridRasterAlignment(gutils).sample(raster, band)
+    return sampled_values(values, fids)
+
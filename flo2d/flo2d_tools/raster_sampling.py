@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+import numpy as np
+
+from .grid_index import cached_grid_index
+from .grid_tools import sampled_values
+from .lidar_binning import LidarBins
+from .raster_alignment import GridRasterAlignment, raster_aligned_with_grid
+
+# Resampling algorithms evaluated directly from source pixels falling into the cells.
+ZONAL_STATISTICS = {"average": "mean", "min": "min", "max": "max", "mode": "mode"}
+
+
+def grid_bounds(grid_idx):
+    """
+    Return (xmin, ymin, xmax, ymax) extent of the grid cells lattice.
+    """
+    half = grid_idx.cell_size * 0.5
+    xmin = grid_idx.x_origin - half
+    ymin = grid_idx.y_origin - half
+    return xmin, ymin, xmin + grid_idx.ncols * grid_idx.cell_size, ymin + grid_idx.nrows * grid_idx.cell_size
+
+
+def warp_to_grid(
+    src_raster,
+    grid_idx,
+    resample_alg="near",
+    src_srs=None,
+    dst_srs=None,
+    nodata=-9999,
+    output_type=None,
+    multithread=False,
+):
+    """
+    Warp raster in-process into the memory dataset with pixels aligned to the grid cells.
+    Output type is given by GDAL data type name (e.g. 'Float32'), source type is kept if not given.
+    """
+    from ..misc.gdal_utils import gdal
+
+    kwargs = {
+        "format": "MEM",
+        "outputBounds": grid_bounds(grid_idx),
+        "xRes": grid_idx.cell_size,
+        "yRes": grid_idx.cell_size,
+        "dstNodata": nodata,
+        "resampleAlg": resample_alg,
+        "multithread": multithread,
+        "warpOptions": ["OPTIMIZE_SIZE=TRUE"] + (["NUM_THREADS=ALL_CPUS"] if multithread else []),
+        "options": ["-ovr", "NONE"],
+    }
+    if src_srs:
+        kwargs["srcSRS"] = src_srs
+    if dst_srs:
+        kwargs["dstSRS"] = dst_srs
+    if output_type:
+        kwargs["outputType"] = gdal.GetDataTypeByName(output_type)
+    return gdal.Warp("", src_raster, **kwargs)
+
+
+def fill_raster_nodata(ds, max_distance, band=1):
+    """
+    Fill NODATA pixels of the (memory) dataset band in-process.
+    """
+    from ..misc.gdal_utils import gdal
+
+    gdal.FillNodata(ds.GetRasterBand(band), None, max_distance, 0)
+    return ds
+
+
+def _reduce_mode_counts(cells, values, counts):
+    """
+    Merge counts of repeated (cell, value) pairs.
+    """
+    pairs = np.stack([cells.astype(np.float64), values], axis=1)
+    unique_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+    summed = np.bincount(inverse.ravel(), weights=counts, minlength=unique_pairs.shape[0])
+    return unique_pairs[:, 0].astype(np.int64), unique_pairs[:, 1], summed
+
+
+def zonal_grid_values(src_raster, grid_idx, statistic="mean", band=1, max_block_bytes=64 * 1024 * 1024):
+    """
+    Return per cell statistic ('mean', 'min', 'max' or 'mode') of raster pixels with centers inside the cells.
+    Values are in GridIndex order (NaN for cells without valid pixels). Raster is read in blocks of rows
+    limited to the grid extent, and pixels are binned into the cells lattice like LIDAR points.
+    Raster is expected in the grid CRS with pixels not larger than the cells.
+    """
+    from ..misc.gdal_utils import GDALRasterLayer
+
+    raster = src_raster if isinstance(src_raster, GDALRasterLayer) else GDALRasterLayer(src_raster)
+    x_off, x_res, __, y_off, __, y_res = raster.ds.GetGeoTransform()
+    raster_band = raster.ds.GetRasterBand(band)
+    nodata = raster_band.GetNoDataValue()
+
+    xmin, ymin, xmax, ymax = grid_bounds(grid_idx)
+    col_first = max(int(np.floor((xmin - x_off) / x_res)), 0)
+    col_last = min(int(np.ceil((xmax - x_off) / x_res)), raster.width)
+    row_first = max(int(np.floor((ymax - y_off) / y_res)), 0)
+    row_last = min(int(np.ceil((ymin - y_off) / y_res)), raster.height)
+
+    bins = LidarBins.from_grid_index(grid_idx)
+    mode_cells, mode_values, mode_counts = [], [], []
+    if col_first < col_last:
+        xsize = col_last - col_first
+        rows_per_read = max(1, max_block_bytes // (8 * xsize))
+        xs_row = x_off + (np.arange(col_first, col_last) + 0.5) * x_res
+        for row in range(row_first, row_last, rows_per_read):
+            ysize = min(rows_per_read, row_last - row)
+            block = raster_band.ReadAsArray(col_first, row, xsize, ysize).astype(np.float64)
+            ys_col = y_off + (np.arange(row, row + ysize) + 0.5) * y_res
+            valid = ~np.isnan(block)
+            if nodata is not None:
+                valid &= block != nodata
+            row_idx, col_idx = np.nonzero(valid)
+            xs, ys, zs = xs_row[col_idx], ys_col[row_idx], block[valid]
+            if statistic == "mode":
+                fids = grid_idx.fids_at(xs, ys)
+                inside = fids > 0
+                cells, values, counts = _reduce_mode_counts(fids[inside], zs[inside], np.ones(np.count_nonzero(inside)))
+                mode_cells.append(cells)
+                mode_values.append(values)
+                mode_counts.append(counts)
+                if sum(c.shape[0] for c in mode_cells) > max_block_bytes // 8:
+                    merged = _reduce_mode_counts(
+                        np.concatenate(mode_cells), np.concatenate(mode_values), np.concatenate(mode_counts)
+                    )
+                    mode_cells, mode_values, mode_counts = [merged[0]], [merged[1]], [merged[2]]
+            else:
+                bins.add(xs, ys, zs)
+
+    if statistic != "mode":
+        values, __ = bins.cell_values(grid_idx, statistic)
+        return values
+
+    values = np.full(grid_idx.count, np.nan, dtype=np.float64)
+    if mode_cells:
+        cells, pixel_values, counts = _reduce_mode_counts(
+            np.concatenate(mode_cells), np.concatenate(mode_values), np.concatenate(mode_counts)
+        )
+        # The most frequent value of every cell (the lowest one for ties).
+        order = np.lexsort((pixel_values, -counts, cells))
+        cells, pixel_values = cells[order], pixel_values[order]
+        first = np.ones(cells.shape, dtype=bool)
+        first[1:] = cells[1:] != cells[:-1]
+        values[grid_idx.positions(cells[first])] = pixel_values[first]
+    return values
+
+
+def resample_raster_to_grid(
+    gutils,
+    src_raster,
+    resample_alg="near",
+    src_srs=None,
+    dst_srs=None,
+    nodata=-9999,
+    output_type=None,
+    multithread=False,
+    fill_distance=None,
+):
+    """
+    Return list of (value, fid) rows of source raster resampled into the grid cells (None for NODATA).
+    Everything is done in-process without intermediate files:
+        - rasters aligned with the grid and nearest neighbour resampling in the grid CRS are sampled directly
+          at the cells centroids (pixel indexes of cells are cached in the GeoPackage for every source lattice),
+        - average, min, max and mode of rasters with pixels not larger than cells of the regular grid
+          are aggregated from band blocks,
+        - other cases are warped into the memory dataset aligned with the grid (optionally with NODATA filled).
+    """
+    from ..misc.gdal_utils import GDALRasterLayer
+
+    grid_idx = cached_grid_index(gutils)
+    alignment = GridRasterAlignment(gutils)
+    raster = GDALRasterLayer(src_raster)
+    same_crs = not src_srs or not dst_srs or src_srs == dst_srs
+    if fill_distance is None and same_crs:
+        if resample_alg == "near" or raster_aligned_with_grid(raster, grid_idx):
+            fids, values = alignment.sample(raster)
+            return sampled_values(values, fids)
+        __, x_res, x_rot, __, y_rot, y_res = raster.ds.GetGeoTransform()
+        north_up = not x_rot and not y_rot and x_res > 0 and y_res < 0
+        fine_pixels = max(x_res, -y_res) <= grid_idx.cell_size
+        if resample_alg in ZONAL_STATISTICS and grid_idx.regular and north_up and fine_pixels:
+            values = zonal_grid_values(raster, grid_idx, ZONAL_STATISTICS[resample_alg])
+            return sampled_values(values, grid_idx.fid)
+
+    ds = warp_to_grid(src_raster, grid_idx, resample_alg, src_srs, dst_srs, nodata, output_type, multithread)
+    if fill_distance is not None:
+        fill_raster_nodata(ds, fill_distance)
+    fids, values = alignment.sample(GDALRasterLayer(ds))
+    return sampled_values(values, fids)
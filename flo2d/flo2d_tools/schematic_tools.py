@@ -21,23 +21,32 @@ from qgis.core import (
     QgsPoint,
     QgsPointXY,
     QgsSpatialIndex,
-    QgsVector,
     QgsWkbTypes,
 )
 from qgis.PyQt.QtWidgets import QApplication
 
 from ..geopackage_utils import GeoPackageUtils
+from ..misc.gpb import linestring_gpb, multilinestring_gpb, point_gpb
 from ..user_communication import UserCommunication
+from .grid_index import cached_grid_index
 from .grid_tools import (
     adjacent_grid_elevations,
     buildCellIDNPArray,
-    fid_from_grid,
     fid_from_grid_features,
-    get_adjacent_cell_elevation,
+    gridRegionGenerator,
     spatial_index,
     three_adjacent_grid_elevations,
 )
 
+# Directions 1-8 in clockwise order from the north (also octagon sides to levee directions).
+CLOCKWISE_DIRS = np.array([1, 5, 2, 6, 3, 7, 4, 8], dtype=np.int64)
+# Lattice (col, row) offsets of adjacent cells and opposite directions for directions 1-8
+# (N, E, S, W, NE, SE, SW, NW) of levees and streets.
+DIR_OFFSETS = np.array([[0, 0], [0, 1], [1, 0], [0, -1], [-1, 0], [1, 1], [1, -1], [-1, -1], [-1, 1]], dtype=np.int64)
+OPPOSITE_DIRS = np.array([0, 3, 4, 1, 2, 7, 8, 5, 6], dtype=np.int64)
+# Directions of steps between adjacent cells indexed by [sign(dcol) + 1, sign(drow) + 1].
+STEP_DIRS = np.array([[7, 4, 8], [3, 0, 1], [6, 2, 5]], dtype=np.int64)
+
 
 # Levees tools
 def get_intervals(line_feature, point_features, col_value, buffer_size):
@@ -214,10 +223,155 @@ def levee_grid_isect_pts(levee_fid, grid_fid, levee_lyr, grid_lyr, with_centroid
         return pts, None
 
 
+def levee_grid_crossings(gutils, levee_lyr, grid_lyr):
+    """
+    Return (lids, fids, x1, y1, x2, y2) arrays of levee pieces inside the grid cells found with spatial queries.
+    Used for irregular grids, which cannot be walked on the lattice by levee_cell_crossings.
+    """
+    pieces = []
+    visited = set()
+    for lid_gid_elev, regionReq in fid_from_grid_features(gutils, grid_lyr, levee_lyr):
+        for lid, gid, elev in lid_gid_elev:
+            # regions overlap by their padding
+            if (lid, gid) in visited:
+                continue
+            visited.add((lid, gid))
+            isect = levee_grid_isect_pts(lid, gid, levee_lyr, grid_lyr, with_centroid=False)
+            if isect is None:
+                continue
+            for p1, p2 in isect[0]:
+                pieces.append((lid, gid, p1.x(), p1.y(), p2.x(), p2.y()))
+    if not pieces:
+        empty = np.zeros(0, dtype=np.float64)
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), empty, empty, empty, empty
+    lids, gids, x1, y1, x2, y2 = zip(*pieces)
+    return (
+        np.array(lids, dtype=np.int64),
+        np.array(gids, dtype=np.int64),
+        np.array(x1, dtype=np.float64),
+        np.array(y1, dtype=np.float64),
+        np.array(x2, dtype=np.float64),
+        np.array(y2, dtype=np.float64),
+    )
+
+
+def levee_cell_crossings(grid_idx, xs, ys):
+    """
+    Split polyline given by vertices coordinates into pieces lying inside the grid cells.
+    Returns (fids, x1, y1, x2, y2) arrays with the cell and the entry and leaving points of every piece.
+    Line leaving the cell and coming back into it gives separate pieces. Works only for regular grids.
+    """
+    if not grid_idx.regular:
+        raise ValueError("Levee crossings can be walked only on the regular grid lattice.")
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    if xs.shape[0] < 2 or grid_idx.count == 0:
+        empty = np.zeros(0, dtype=np.float64)
+        return np.zeros(0, dtype=np.int64), empty, empty, empty, empty
+    # Vertices in lattice units with the cells edges on integer values.
+    u = (xs - grid_idx.x_origin) / grid_idx.cell_size + 0.5
+    v = (ys - grid_idx.y_origin) / grid_idx.cell_size + 0.5
+    nseg = xs.shape[0] - 1
+    segments = [np.arange(nseg), np.arange(nseg)]
+    params = [np.zeros(nseg), np.ones(nseg)]
+    for start, end in ((u[:-1], u[1:]), (v[:-1], v[1:])):
+        # Parameters of segments crossings with the cells edges.
+        low = np.floor(np.minimum(start, end))
+        counts = np.maximum(np.ceil(np.maximum(start, end)) - low - 1, 0).astype(np.int64)
+        seg = np.repeat(np.arange(nseg), counts)
+        edges = low[seg] + 1 + np.arange(seg.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+        segments.append(seg)
+        params.append((edges - start[seg]) / (end[seg] - start[seg]))
+    seg = np.concatenate(segments)
+    t = np.concatenate(params)
+    order = np.lexsort((t, seg))
+    seg, t = seg[order], t[order]
+    px = xs[seg] + (xs[seg + 1] - xs[seg]) * t
+    py = ys[seg] + (ys[seg + 1] - ys[seg]) * t
+    # Sub-segments between consecutive crossings are inside single cells.
+    keep = (seg[1:] == seg[:-1]) & (t[1:] > t[:-1])
+    sx1, sy1 = px[:-1][keep], py[:-1][keep]
+    sx2, sy2 = px[1:][keep], py[1:][keep]
+    fids = grid_idx.fids_at((sx1 + sx2) * 0.5, (sy1 + sy2) * 0.5)
+    first = np.ones(fids.shape, dtype=bool)
+    first[1:] = fids[1:] != fids[:-1]
+    starts = np.nonzero(first)[0]
+    ends = np.append(starts[1:], fids.shape[0]) - 1
+    inside = fids[starts] > 0
+    starts, ends = starts[inside], ends[inside]
+    return fids[starts], sx1[starts], sy1[starts], sx2[ends], sy2[ends]
+
+
+def octagon_sides(cx, cy, x1, y1, x2, y2):
+    """
+    Return (pieces, sides) arrays of the cell octagon sides crossed by the pieces of lines.
+    Pieces enter the octagon around the cell centroid (cx, cy) at (x1, y1) and leave it at (x2, y2).
+    Sides are counted clockwise from 0 for the side next to the north node.
+    """
+    a1 = np.arctan2(np.asarray(y1) - cy, np.asarray(x1) - cx)
+    a2 = np.arctan2(np.asarray(y2) - cy, np.asarray(x2) - cx)
+    # drawing direction (is it clockwise?)
+    cw = np.mod(a2 - a1, 2 * pi) >= pi
+    # nearest octagon nodes
+    n1 = (np.mod(pi / 2 - a1, 2 * pi) // (pi / 4)).astype(np.int64) % 8
+    n2 = (np.mod(pi / 2 - a2, 2 * pi) // (pi / 4)).astype(np.int64) % 8
+    # starting and ending octagon side for every piece
+    step = np.where(cw, 1, -1)
+    s1 = np.where(cw, n1 + 1, n1) % 8
+    s2 = np.where(cw, n2, n2 + 1) % 8
+    counts = np.mod((s2 - s1) * step, 8) + 1
+    # if entry and leaving octagon node are identical, skip the piece (no levee seg)
+    counts[n1 == n2] = 0
+    pieces = np.repeat(np.arange(counts.shape[0]), counts)
+    offsets = np.arange(pieces.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    sides = np.mod(s1[pieces] + step[pieces] * offsets, 8)
+    return pieces, sides
+
+
+def levee_opposite_duplicates(grid_idx, grid_fids, ldirs, crests, cells_on_points=None):
+    """
+    Return sorted list of (grid_fid, ldir) levee directions duplicated by the opposite directions in adjacent cells.
+    Lower crest of the pair is deleted, for equal crests the one in the cell with higher fid.
+    Adjacent cells are found under the shifted centroids with 'cells_on_points(xs, ys)' function
+    (lattice lookup by default, which needs a regular grid).
+    """
+    if cells_on_points is None:
+        if not grid_idx.regular:
+            raise ValueError("Adjacent cells of the irregular grid need a spatial lookup.")
+        cells_on_points = grid_idx.fids_at
+    grid_fids = np.asarray(grid_fids, dtype=np.int64)
+    ldirs = np.asarray(ldirs, dtype=np.int64)
+    crests = np.asarray(crests, dtype=np.float64)
+    if grid_fids.shape[0] == 0:
+        return []
+    keys = grid_fids * 9 + ldirs
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    pos = grid_idx.positions(grid_fids)
+    dcol, drow = DIR_OFFSETS[ldirs].T
+    cs = grid_idx.cell_size
+    opp_cells = np.asarray(cells_on_points(grid_idx.x[pos] + dcol * cs, grid_idx.y[pos] + drow * cs), dtype=np.int64)
+    opp_cells[pos < 0] = 0
+    opp_dirs = OPPOSITE_DIRS[ldirs]
+    opp_keys = opp_cells * 9 + opp_dirs
+    found_at = np.minimum(np.searchsorted(sorted_keys, opp_keys), sorted_keys.shape[0] - 1)
+    found = (opp_cells > 0) & (sorted_keys[found_at] == opp_keys)
+    opp_crests = crests[order[found_at]]
+    delete_self = found & ((crests < opp_crests) | ((crests == opp_crests) & (opp_cells <= grid_fids)))
+    delete_opp = found & ~delete_self
+    to_delete = np.unique(np.concatenate([keys[delete_self], opp_keys[delete_opp]]))
+    return [(int(key // 9), int(key % 9)) for key in to_delete]
+
+
 def generate_schematic_levees(gutils, levee_lyr, grid_lyr):
+    """
+    Generator creating schematic levees and levee failures region by region.
+    Levee lines are split into pieces crossing the cells once on the grid lattice (or by spatial queries for irregular
+    grids), octagon sides crossed by the pieces are computed in bulk for each region and attributes of user levee
+    lines are read only once.
+    Yields (number of cells, number of levee directions, number of levee failures, region request).
+    """
     try:
-        # octagon nodes to sides map
-        octagon_levee_dirs = {0: 1, 1: 5, 2: 2, 3: 6, 4: 3, 5: 7, 6: 4, 7: 8}
         levee_dir_pts = {
             1: (
                 lambda x, y, square_half, octa_half: (
@@ -285,9 +439,6 @@ def generate_schematic_levees(gutils, levee_lyr, grid_lyr):
             ),
         }
 
-        # lid_gid_elev = fid_from_grid(gutils, "user_levee_lines", None, False, False, "elevation")
-        # print (lid_gid_elev[0])
-        # get user levee lines features
         print("Deleting existing schematized levee and levee failure elements")
         del_levees_sql = """DELETE FROM levee_data  WHERE user_line_fid IS NOT NULL;"""
         del_levee_failures_sql = """DELETE FROM levee_failure;"""
@@ -296,121 +447,117 @@ def generate_schematic_levees(gutils, levee_lyr, grid_lyr):
         gutils.con.commit()
         print("Intersecting levee elements with grid")
 
-        for lid_gid_elev, regionReq in fid_from_grid_features(
-            gutils, grid_lyr, levee_lyr
-        ):  # "user_levee_lines", None, False, False, "elevation")
-            # print (lid_gid_elev[0])
-            cell_size = float(gutils.get_cont_par("CELLSIZE"))
-            scale = 0.9
-            # square half
-            sh = cell_size * 0.5 * scale
-            # octagon half
-            oh = sh / 2.414
-            schem_lines = levee_schematic(lid_gid_elev, levee_lyr, grid_lyr)
-
-            ins_levees_sql = """INSERT INTO levee_data (grid_fid, ldir, levcrest, user_line_fid, geom)
-                         VALUES (?,?,?,?, AsGPB(ST_GeomFromText(?)));"""
-
-            levee_failure_qry = """SELECT failevel, failtime, levbase, failwidthmax, failrate, failwidrate
-                                    FROM levee_failure 
-                                    WHERE grid_fid = ?"""
-
-            ins_levees_failure_sql = """INSERT INTO levee_failure (grid_fid, lfaildir, failevel, failtime,
-                                                              levbase, failwidthmax, failrate, failwidrate)
-                                         VALUES (?,?,?,?,?,?,?,?);"""
-
-            select_user_levees_qry = """SELECT failElev, failDepth, failDuration, failBaseElev, failMaxWidth, 
-                                                            failVRate, failHRate, elev, correction
-                                FROM user_levee_lines 
-                                WHERE fid = ?"""
-
-            # Create levee segments for distinct levee directions in each grid element
-            grid_levee_seg = {}
+        grid_idx = cached_grid_index(gutils)
+        scale = 0.9
+        # square half
+        sh = grid_idx.cell_size * 0.5 * scale
+        # octagon half
+        oh = sh / 2.414
+
+        ins_levees_sql = """INSERT INTO levee_data (grid_fid, ldir, levcrest, user_line_fid, geom)
+                     VALUES (?,?,?,?,?);"""
+
+        ins_levees_failure_sql = """INSERT INTO levee_failure (grid_fid, lfaildir, failevel, failtime,
+                                                          levbase, failwidthmax, failrate, failwidrate)
+                                     VALUES (?,?,?,?,?,?,?,?);"""
+
+        select_user_levees_qry = """SELECT fid, failElev, failDepth, failDuration, failBaseElev, failMaxWidth,
+                                           failVRate, failHRate, elev, correction
+                            FROM user_levee_lines;"""
+        user_levees = {row[0]: row[1:] for row in gutils.execute(select_user_levees_qry)}
+
+        # Pieces of all levee lines crossing the grid cells.
+        if grid_idx.regular:
+            pieces = [[] for _ in range(6)]
+            for feat in levee_lyr.getFeatures():
+                geom = feat.geometry()
+                if geom is None or geom.isEmpty():
+                    continue
+                parts = geom.asMultiPolyline() if geom.isMultipart() else [geom.asPolyline()]
+                for part in parts:
+                    crossings = levee_cell_crossings(grid_idx, [p.x() for p in part], [p.y() for p in part])
+                    pieces[0].append(np.full(crossings[0].shape, feat.id(), dtype=np.int64))
+                    for i, array in enumerate(crossings, 1):
+                        pieces[i].append(array)
+            if not pieces[0]:
+                return
+            lids, gids, x1, y1, x2, y2 = [np.concatenate(arrays) for arrays in pieces]
+        else:
+            lids, gids, x1, y1, x2, y2 = levee_grid_crossings(gutils, levee_lyr, grid_lyr)
+            if lids.shape[0] == 0:
+                return
+        pos = grid_idx.positions(gids)
+        cx, cy, elevs = grid_idx.x[pos], grid_idx.y[pos], grid_idx.elevation[pos]
+        pending = np.ones(lids.shape, dtype=bool)
+
+        for regionReq in gridRegionGenerator(gutils, grid_lyr):
+            rect = regionReq.filterRect()
+            in_region = pending & (cx >= rect.xMinimum()) & (cx <= rect.xMaximum())
+            in_region &= (cy >= rect.yMinimum()) & (cy <= rect.yMaximum())
+            if not in_region.any():
+                continue
+            pending &= ~in_region
+            region_pieces = np.nonzero(in_region)[0]
+            piece, sides = octagon_sides(
+                cx[region_pieces],
+                cy[region_pieces],
+                x1[region_pieces],
+                y1[region_pieces],
+                x2[region_pieces],
+                y2[region_pieces],
+            )
+            piece = region_pieces[piece]
+
+            # Create levee segments for distinct levee directions in each grid element.
+            # The side crossed by more levee lines is taken from the one with the lowest fid.
+            order = np.lexsort((lids[piece], sides, gids[piece]))
+            piece, sides = piece[order], sides[order]
+            distinct = np.ones(piece.shape, dtype=bool)
+            distinct[1:] = (gids[piece][1:] != gids[piece][:-1]) | (sides[1:] != sides[:-1])
+            piece, sides = piece[distinct], sides[distinct]
+            ldirs = CLOCKWISE_DIRS[sides]
+            dcol, drow = DIR_OFFSETS[ldirs].T
+            cs = grid_idx.cell_size
+            adj_cells, adj_elevs = gutils.grid_on_points(cx[piece] + dcol * cs, cy[piece] + drow * cs, True)
+            adj_elevs[adj_cells == 0] = -999.0
+
             data = []
             fail_data = []
-            for gid, gdata in schem_lines.items():
-                elev = gdata["elev"]
-                grid_levee_seg[gid] = {}
-                grid_levee_seg[gid]["sides"] = {}
-                grid_levee_seg[gid]["centroid"] = gdata["centroid"]
-                for lid, sides in gdata["lines"].items():
-                    if sides:
-                        for side in sides:
-                            if side not in list(grid_levee_seg[gid]["sides"].keys()):
-                                side_elev = elev
-                                grid_levee_seg[gid]["sides"][side] = lid
-                                ldir = octagon_levee_dirs[side]
-                                c = gdata["centroid"]
-
-                                user_levees_data = gutils.con.execute(select_user_levees_qry, (lid,)).fetchone()
-                                if user_levees_data:
-                                    if not all(v == 0 for v in user_levees_data):
-                                        if not user_levees_data[0] == 0.0:
-                                            # failElev selected, use it.
-                                            fail_data.append(
-                                                (
-                                                    gid,
-                                                    ldir,
-                                                    user_levees_data[0],
-                                                    user_levees_data[2],
-                                                    user_levees_data[3],
-                                                    user_levees_data[4],
-                                                    user_levees_data[5],
-                                                    user_levees_data[6],
-                                                )
-                                            )
-                                        elif not user_levees_data[1] == 0.0:
-                                            # failDepth selected, use adjacent cell elevations to calculate fail elevation.
-
-                                            (
-                                                adj_cell,
-                                                adj_elev,
-                                            ) = get_adjacent_cell_elevation(gutils, grid_lyr, gid, ldir, cell_size)
-                                            grid_elev = gutils.grid_value(gid, "elevation")
-                                            max_elev = max(adj_elev, grid_elev)
-
-                                            fail_data.append(
-                                                (
-                                                    gid,
-                                                    ldir,
-                                                    max_elev + user_levees_data[1],
-                                                    user_levees_data[2],
-                                                    user_levees_data[3],
-                                                    user_levees_data[4],
-                                                    user_levees_data[5],
-                                                    user_levees_data[6],
-                                                )
-                                            )
-                                        else:  # do not set failure data for this direction.
-                                            pass
-
-                                        if user_levees_data[7] is None:  # crest elevation in user levees not defined
-                                            (
-                                                adj_cell,
-                                                adj_elev,
-                                            ) = get_adjacent_cell_elevation(gutils, grid_lyr, gid, ldir, cell_size)
-                                            side_elev = max(adj_elev, elev)
-
-                                data.append(
-                                    (
-                                        gid,
-                                        ldir,
-                                        side_elev,
-                                        lid,
-                                        "LINESTRING({0} {1}, {2} {3})".format(
-                                            *levee_dir_pts[ldir](c.x(), c.y(), sh, oh)
-                                        ),
-                                    )
-                                )
+            for gid, ldir, lid, x, y, elev, adj_elev in zip(
+                gids[piece].tolist(),
+                ldirs.tolist(),
+                lids[piece].tolist(),
+                cx[piece].tolist(),
+                cy[piece].tolist(),
+                elevs[piece].tolist(),
+                adj_elevs.tolist(),
+            ):
+                side_elev = elev
+                user_levees_data = user_levees.get(lid)
+                if user_levees_data and not all(v == 0 for v in user_levees_data):
+                    if not user_levees_data[0] == 0.0:
+                        # failElev selected, use it.
+                        fail_data.append((gid, ldir, user_levees_data[0]) + tuple(user_levees_data[2:7]))
+                    elif not user_levees_data[1] == 0.0:
+                        # failDepth selected, use adjacent cell elevations to calculate fail elevation.
+                        max_elev = max(adj_elev, elev)
+                        fail_data.append((gid, ldir, max_elev + user_levees_data[1]) + tuple(user_levees_data[2:7]))
+                    else:  # do not set failure data for this direction.
+                        pass
+
+                    if user_levees_data[7] is None:  # crest elevation in user levees not defined
+                        side_elev = max(adj_elev, elev)
+
+                xa, ya, xb, yb = levee_dir_pts[ldir](x, y, sh, oh)
+                data.append((gid, ldir, side_elev, lid, linestring_gpb([(xa, ya), (xb, yb)])))
 
             gutils.con.executemany(ins_levees_sql, data)
 
             gutils.con.executemany(ins_levees_failure_sql, fail_data)
 
             gutils.con.commit()
-            yield (len(schem_lines), len(data), len(fail_data), regionReq)
+            yield (np.unique(gids[region_pieces]).shape[0], len(data), len(fail_data), regionReq)
 
-        # return len(schem_lines), len(data), len(fail_data)
     except Exception as e:
         raise e
         # self.uc.show_error("ERROR 291219.0428: Error while creating schematic levees octagons!.\n", e)
@@ -543,103 +690,14 @@ def delete_levee_directions_duplicates(gutils, levees, grid_lyr):
     Eliminate levee opposite directions. Select the one with highest crest elevation.
     """
     try:
-        cell_size = float(gutils.get_cont_par("CELLSIZE"))
-        levees_qry = "SELECT grid_fid, ldir, levcrest FROM levee_data ORDER BY grid_fid"
-        sel_levee_qry = "SELECT levcrest FROM levee_data WHERE grid_fid = ? AND ldir = ?"
-        delete_qry = "DELETE FROM levee_data WHERE grid_fid = ? AND ldir = ?"
-        delete_failure_qry = "DELETE FROM levee_failure WHERE grid_fid = ? and lfaildir = ?;"
-
+        levees_qry = "SELECT grid_fid, ldir, levcrest FROM levee_data ORDER BY fid;"
         levees = gutils.execute(levees_qry).fetchall()
-        toDelete = []
-        for nextLevee in levees:
-            #         for nextLevee in levees.getFeatures():
-
-            #             cell = nextLevee[1]
-            #             dir = nextLevee[2]
-            #             crest = nextLevee[3]
-
-            cell = nextLevee[0]
-            dir = nextLevee[1]
-            crest = nextLevee[2]
-
-            oppositeCrest = None
-            cellFeat = next(grid_lyr.getFeatures(QgsFeatureRequest(cell)))
-            xx, yy = cellFeat.geometry().centroid().asPoint()
-            if dir == 1:  # "N"
-                # North cell:
-                y = yy + cell_size
-                x = xx
-                dirOpp = 3
-
-            elif dir == 5:  # "NE"
-                # NorthEast cell:
-                y = yy + cell_size
-                x = xx + cell_size
-                dirOpp = 7
-
-            elif dir == 2:  # "E"
-                # East cell:
-                y = yy
-                x = xx + cell_size
-                dirOpp = 4
-
-            elif dir == 6:  # "SE"
-                # SouthEast cell:
-                y = yy - cell_size
-                x = xx + cell_size
-                dirOpp = 8
-
-            elif dir == 3:  # "S"
-                # South cell:
-                y = yy - cell_size
-                x = xx
-                dirOpp = 1
-
-            elif dir == 7:  # "SW"
-                # SouthWest cell:
-                y = yy - cell_size
-                x = xx - cell_size
-                dirOpp = 5
-
-            elif dir == 4:  # "W"
-                # West cell:
-                y = yy
-                x = xx - cell_size
-                dirOpp = 2
-
-            elif dir == 8:  # "NW"
-                # NorthWest cell:
-                y = yy + cell_size
-                x = xx - cell_size
-                dirOpp = 6
-
-            else:
-                X = -99
-                y = -99
-
-            oppositeCell = gutils.grid_on_point(x, y)
-            if oppositeCell is not None:
-                oppositeCrest = gutils.execute(sel_levee_qry, (oppositeCell, dirOpp)).fetchone()
-                if oppositeCrest:
-                    if crest < oppositeCrest[0]:
-                        toDelete.append((cell, dir))
-                    #                         gutils.execute(delete_qry, (cell,dir))
-
-                    elif crest == oppositeCrest[0]:
-                        # Arbitrary delete high cell number to avoid duplicate later.
-                        if oppositeCell > cell:
-                            toDelete.append((oppositeCell, dirOpp))
-                        #                            gutils.execute(delete_qry, (oppositeCell,dir))
-                        else:
-                            toDelete.append((cell, dir))
-                    #                            gutils.execute(delete_qry, (oppositeCell,dir))
-                    else:
-                        toDelete.append((oppositeCell, dirOpp))
-        #                         gutils.execute(delete_qry, (oppositeCell,dir))
-
-        toDelete = list(set(toDelete))
-        toDelete.sort()
-        return toDelete
+        if not levees:
+            return []
+        grid_fids, ldirs, crests = zip(*levees)
+        grid_idx = cached_grid_index(gutils)
+        crests = np.array(crests, dtype=np.float64)
+        return levee_opposite_duplicates(grid_idx, grid_fids, ldirs, crests, gutils.grid_on_points)
 
     except Exception as e:
         QApplication.restoreOverrideCursor()
@@ -705,60 +763,13 @@ def delete_levee_directions_duplicates(gutils, levees, grid_lyr):
 # ....................................
 
 
-def levee_schematic(lid_gid_elev, levee_lyr, grid_lyr):
-    try:
-        schem_lines = {}
-        gids = []
-        nv = QgsVector(0, 1)
-        # for each line crossing a grid element
-        for lid, gid, elev in lid_gid_elev:
-            pts, c = levee_grid_isect_pts(lid, gid, levee_lyr, grid_lyr)
-            if pts is None:
-                pass
-            if gid not in gids:
-                schem_lines[gid] = {}
-                schem_lines[gid]["lines"] = {}
-                schem_lines[gid]["centroid"] = c
-                schem_lines[gid]["elev"] = elev
-                gids.append(gid)
-            else:
-                pass
-            sides = []
-            # for each entry and leaving point pair
-            for pts_pair in pts:
-                p1, p2 = pts_pair
-                c_p1 = p1 - c
-                c_p2 = p2 - c
-                a = c_p1.angle(c_p2)
-                a = 2 * pi + a if a < 0 else a
-                # drawing direction (is it clockwise?)
-                cw = a >= pi
-                c_p1_a = c_p1.angle(nv)
-                c_p1_a = 2 * pi + c_p1_a if c_p1_a < 0 else c_p1_a
-                c_p2_a = c_p2.angle(nv)
-                c_p2_a = 2 * pi + c_p2_a if c_p2_a < 0 else c_p2_a
-                # nearest octagon nodes
-                n1 = int(c_p1_a / (pi / 4)) % 8
-                n2 = int(c_p2_a / (pi / 4)) % 8
-                # if entry and leaving octagon node are identical, skip the pair (no levee seg)
-                if n1 == n2:
-                    continue
-                else:
-                    pass
-                # starting and ending octagon side for current pts pair
-                s1 = (n1 + 1 if cw else n1) % 8
-                s2 = (n2 if cw else n2 + 1) % 8
-                # add sides from s1 to s2 for creating the segments
-                sides.append(s2)
-                while s1 != s2:
-                    sides.insert(0, s1)
-                    s1 = (s1 + 1 if cw else s1 - 1) % 8
-            sides = set(sides)
-            schem_lines[gid]["lines"][lid] = sides
-        return schem_lines
-    except Exception as e:
-        raise e
-        # self.uc.show_error("ERROR 030120.0731: Error while creating schematic levees!.\n", e)
+def snap_vertices(xs, ys, cell_size, offset_x, offset_y):
+    """
+    Take line vertices coordinates and return arrays of integer (col, row) coordinates of cells containing them.
+    """
+    cols = np.rint((np.asarray(xs, dtype=np.float64) + offset_x) / float(cell_size)).astype(np.int64)
+    rows = np.rint((np.asarray(ys, dtype=np.float64) + offset_y) / float(cell_size)).astype(np.int64)
+    return cols, rows
 
 
 def snap_line(x1, y1, x2, y2, cell_size, offset_x, offset_y):
@@ -766,23 +777,8 @@ def snap_line(x1, y1, x2, y2, cell_size, offset_x, offset_y):
     Take line from (x1,y1) to (x2,y2) and generate list of cell coordinates
     covered by the line within the given grid.
     """
-
-    def float_to_int_coords(x, y):
-        xt = int(round((x + offset_x) / float(cell_size)))
-        yt = int(round((y + offset_y) / float(cell_size)))
-        return xt, yt
-
-    def int_to_float_coords(xt, yt):
-        x = xt * cell_size - offset_x
-        y = yt * cell_size - offset_y
-        return x, y
-
-    xt1, yt1 = float_to_int_coords(x1, y1)
-    xt2, yt2 = float_to_int_coords(x2, y2)
-
-    points = bresenham_line(xt1, yt1, xt2, yt2)
-
-    return [int_to_float_coords(x, y) for x, y in points]
+    cols, rows = bresenham_cells(*snap_vertices([x1, x2], [y1, y2], cell_size, offset_x, offset_y))
+    return list(zip((cols * cell_size - offset_x).tolist(), (rows * cell_size - offset_y).tolist()))
 
 
 # Line schematizing tools
@@ -790,47 +786,60 @@ def bresenham_line(x1, y1, x2, y2):
     """
     Bresenham's Line Algorithm.
     Returns a list of [x,y] tuples. Works with integer coordinates.
-    Based on impl from http://www.roguebasin.com/index.php?title=Bresenham%27s_Line_Algorithm
     """
+    cols, rows = bresenham_cells([x1, x2], [y1, y2])
+    return list(zip(cols.tolist(), rows.tolist()))
 
-    # Determine how steep the line is
-    is_steep = abs(y2 - y1) > abs(x2 - x1)
-
-    # Rotate line
-    if is_steep:
-        x1, y1 = y1, x1
-        x2, y2 = y2, x2
-
-    # Swap start and end points if necessary and store swap state
-    swapped = False
-    if x1 > x2:
-        x1, x2 = x2, x1
-        y1, y2 = y2, y1
-        swapped = True
-
-    # Calculate differentials
-    dx = x2 - x1
-    dy = y2 - y1
-
-    # Calculate error
-    error = int(dx / 2.0)
-    ystep = 1 if y1 < y2 else -1
-
-    # Iterate over bounding box generating points between start and end
-    y = y1
-    points = []
-    for x in range(x1, x2 + 1):
-        coord = (y, x) if is_steep else (x, y)
-        points.append(coord)
-        error -= abs(dy)
-        if error < 0:
-            y += ystep
-            error += dx
-
-    # Reverse the list if the coordinates were swapped
-    if swapped:
-        points.reverse()
-    return points
+
+def bresenham_cells(cols, rows):
+    """
+    Bresenham's Line Algorithm evaluated at once for all segments of polyline given by integer vertices coordinates.
+    Returns (cols, rows) arrays of cells visited from the first to the last vertex
+    (cells of vertices shared by adjacent segments are listed once).
+    Every segment is walked along its major axis, where the minor axis coordinate of k-th step
+    is shifted by the number of error term underflows ceil((k * |d_minor| - d_major // 2) / d_major).
+    """
+    cols = np.asarray(cols, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    if cols.shape[0] < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    c1, c2, r1, r2 = cols[:-1], cols[1:], rows[:-1], rows[1:]
+    # Rotate steep segments and swap start and end points if necessary
+    steep = np.abs(r2 - r1) > np.abs(c2 - c1)
+    a1, a2 = np.where(steep, r1, c1), np.where(steep, r2, c2)
+    b1, b2 = np.where(steep, c1, r1), np.where(steep, c2, r2)
+    swapped = a1 > a2
+    a1, a2 = np.where(swapped, a2, a1), np.where(swapped, a1, a2)
+    b1, b2 = np.where(swapped, b2, b1), np.where(swapped, b1, b2)
+    # Calculate differentials and error
+    da = a2 - a1
+    db = np.abs(b2 - b1)
+    error = da // 2
+    bstep = np.where(b1 < b2, 1, -1)
+    # Steps along the major axis of every segment (in order of drawing)
+    counts = da + 1
+    seg = np.repeat(np.arange(counts.shape[0]), counts)
+    steps = np.arange(seg.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    steps = np.where(swapped[seg], da[seg] - steps, steps)
+    underflows = np.maximum(-((error[seg] - steps * db[seg]) // np.maximum(da[seg], 1)), 0)
+    a = a1[seg] + steps
+    b = b1[seg] + bstep[seg] * underflows
+    seg_cols = np.where(steep[seg], b, a)
+    seg_rows = np.where(steep[seg], a, b)
+    # Skipping starting cells of segments following the first one
+    keep = np.ones(seg.shape, dtype=bool)
+    keep[np.cumsum(counts)[:-1]] = False
+    return seg_cols[keep], seg_rows[keep]
+
+
+def schematize_line_cells(line, cell_size, offset_x, offset_y):
+    """
+    Return (cols, rows) arrays of integer coordinates of cells crossed by the line geometry.
+    """
+    vertices = line.geometry().asPolyline()
+    xs = [v.x() for v in vertices]
+    ys = [v.y() for v in vertices]
+    return bresenham_cells(*snap_vertices(xs, ys, cell_size, offset_x, offset_y))
 
 
 def schematize_lines(lines, cell_size, offset_x, offset_y, feats_only=False, get_id=False):
@@ -843,24 +852,12 @@ def schematize_lines(lines, cell_size, offset_x, offset_y, feats_only=False, get
     """
     line_features = lines.getFeatures() if feats_only is False else lines
     for line in line_features:
-        segment = []
-        try:
-            vertices = line.geometry().asPolyline()
-            iver = iter(vertices)
-            x1, y1 = next(iver)
-            x2, y2 = next(iver)
-            vals = [x for x in snap_line(x1, y1, x2, y2, cell_size, offset_x, offset_y)]
-            segment += vals
-            while True:
-                x1, y1 = x2, y2
-                x2, y2 = next(iver)
-                vals = [x for x in snap_line(x1, y1, x2, y2, cell_size, offset_x, offset_y)][1:]
-                segment += vals
-        except StopIteration:
-            if get_id is True:
-                yield line.id(), segment
-            else:
-                yield segment
+        cols, rows = schematize_line_cells(line, cell_size, offset_x, offset_y)
+        segment = list(zip((cols * cell_size - offset_x).tolist(), (rows * cell_size - offset_y).tolist()))
+        if get_id is True:
+            yield line.id(), segment
+        else:
+            yield segment
 
 
 def inject_points(line_geom, points):
@@ -942,54 +939,83 @@ def populate_directions(coords, grids):
         return
 
 
+def cells_directions(cols, rows):
+    """
+    Return (cols, rows, directions) arrays of directions leaving and entering consecutive cells of schematized line.
+    """
+    cols = np.asarray(cols, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    dirs = STEP_DIRS[np.sign(np.diff(cols)) + 1, np.sign(np.diff(rows)) + 1]
+    moved = dirs > 0
+    dirs = dirs[moved]
+    step_cols = np.concatenate([cols[:-1][moved], cols[1:][moved]])
+    step_rows = np.concatenate([rows[:-1][moved], rows[1:][moved]])
+    return step_cols, step_rows, np.concatenate([dirs, OPPOSITE_DIRS[dirs]])
+
+
 def schematize_streets(gutils, line_layer, cell_size):
     """
     Calculating and writing schematized streets into the 'street_seg' table.
+    Street lines are rasterized into arrays of cells, so directions and grid elements come straight from cells indexes.
+    Every cell belongs to the first street crossing it.
     """
     streets_sql = """INSERT INTO streets (fid) VALUES (?);"""
-    seg_sql = """INSERT INTO street_seg (geom, str_fid) VALUES (AsGPB(ST_GeomFromText('MULTILINESTRING({0})')), ?)"""
-    elems_sql = """INSERT INTO street_elems (seg_fid, istdir) VALUES (?,?)"""
-    gpb_part = """({0} {1}, {2} {3})"""
+    seg_sql = """INSERT INTO street_seg (fid, geom, str_fid, igridn) VALUES (?,?,?,?);"""
+    elems_sql = """INSERT INTO street_elems (seg_fid, istdir) VALUES (?,?);"""
     half_cell = cell_size * 0.5
     gutils.clear_tables("streets", "street_seg", "street_elems")
-    functions = {
-        1: (lambda x, y, shift: (x, y + shift)),
-        2: (lambda x, y, shift: (x + shift, y)),
-        3: (lambda x, y, shift: (x, y - shift)),
-        4: (lambda x, y, shift: (x - shift, y)),
-        5: (lambda x, y, shift: (x + shift, y + shift)),
-        6: (lambda x, y, shift: (x + shift, y - shift)),
-        7: (lambda x, y, shift: (x - shift, y - shift)),
-        8: (lambda x, y, shift: (x - shift, y + shift)),
-    }
     x_offset, y_offset = gutils.calculate_offset(cell_size)
-    fid_segments = schematize_lines(line_layer, cell_size, x_offset, y_offset, get_id=True)
-    cursor = gutils.con.cursor()
-    fid_coords = {}
-    coords = defaultdict(set)
-    # Populating directions within each grid cell
-    for fid, grids in fid_segments:
-        populate_directions(coords, grids)
-        # Assigning user line fid for each grid centroid coordinates
-        for xy in coords.keys():
-            if xy not in fid_coords:
-                fid_coords[xy] = fid
-            else:
-                continue
-        cursor.execute(streets_sql, (fid,))
-    for i, (xy, directions) in enumerate(iter(coords.items()), 1):
-        x1, y1 = xy
-        xy_dir = []
-        for d in directions:
-            cursor.execute(elems_sql, (i, d))
-            xy_dir.append(functions[d](x1, y1, half_cell))
-        multiline = ",".join((gpb_part.format(x1, y1, x2, y2) for x2, y2 in xy_dir))
-        gpb_insert = seg_sql.format(multiline)
-        cursor.execute(gpb_insert, (fid_coords[xy],))
-    gutils.con.commit()
-    fid_grid = fid_from_grid(gutils, "street_seg", grid_center=True, switch=True)
-    grid_sql = """UPDATE street_seg SET igridn = ? WHERE fid = ?;"""
-    gutils.execute_many(grid_sql, fid_grid)
+    street_fids = []
+    cells, owners, steps = [], [], []
+    for line in line_layer.getFeatures():
+        fid = line.id()
+        street_fids.append((fid,))
+        cols, rows = schematize_line_cells(line, cell_size, x_offset, y_offset)
+        if cols.shape[0] < 2:
+            continue
+        cells.append(np.stack([cols, rows], axis=1))
+        owners.append(np.full(cols.shape, fid, dtype=np.int64))
+        steps.append(np.stack(cells_directions(cols, rows), axis=1))
+    gutils.execute_many(streets_sql, street_fids)
+    if cells:
+        cells = np.concatenate(cells)
+        owners = np.concatenate(owners)
+        steps = np.concatenate(steps)
+        # Distinct cells numbered in order of appearance
+        cell_min = cells.min(axis=0)
+        nrows = int(cells[:, 1].max() - cell_min[1]) + 1
+        keys = (cells[:, 0] - cell_min[0]) * nrows + (cells[:, 1] - cell_min[1])
+        unique_keys, first = np.unique(keys, return_index=True)
+        order = np.argsort(first)
+        ranks = np.empty(order.shape, dtype=np.int64)
+        ranks[order] = np.arange(order.shape[0])
+        seg_cols, seg_rows = cells[first[order], 0], cells[first[order], 1]
+        seg_owners = owners[first[order]]
+        # Distinct directions within each cell
+        step_keys = (steps[:, 0] - cell_min[0]) * nrows + (steps[:, 1] - cell_min[1])
+        step_ranks = ranks[np.searchsorted(unique_keys, step_keys)]
+        elems = np.unique(step_ranks * 9 + steps[:, 2])
+        elem_ranks, elem_dirs = np.divmod(elems, 9)
+        # Grid elements of cells centroids (cells outside of the grid are skipped)
+        xs = seg_cols * cell_size - x_offset
+        ys = seg_rows * cell_size - y_offset
+        igridn = gutils.grid_on_points(xs, ys)
+        inside = igridn > 0
+        seg_fids = np.cumsum(inside)
+        elems_inside = inside[elem_ranks]
+        elem_ranks, elem_dirs = elem_ranks[elems_inside], elem_dirs[elems_inside]
+        ends_x = xs[elem_ranks] + DIR_OFFSETS[elem_dirs, 0] * half_cell
+        ends_y = ys[elem_ranks] + DIR_OFFSETS[elem_dirs, 1] * half_cell
+        bounds = np.searchsorted(elem_ranks, np.arange(xs.shape[0] + 1))
+        segments = []
+        for rank in np.nonzero(inside)[0].tolist():
+            start, end = bounds[rank], bounds[rank + 1]
+            x, y = xs[rank], ys[rank]
+            parts = [((x, y), xy) for xy in zip(ends_x[start:end].tolist(), ends_y[start:end].tolist())]
+            segments.append((int(seg_fids[rank]), multilinestring_gpb(parts), int(seg_owners[rank]), int(igridn[rank])))
+        with gutils.bulk_load("street_seg"):
+            gutils.execute_many(seg_sql, segments)
+        gutils.execute_many(elems_sql, zip(seg_fids[elem_ranks].tolist(), elem_dirs.tolist()))
     update_streets = """
     UPDATE streets SET
         stname = (SELECT name FROM user_streets WHERE fid = streets.fid),
@@ -1006,13 +1032,9 @@ def schematize_streets(gutils, line_layer, cell_size):
                     FROM user_streets AS us, street_seg AS seg
                     WHERE us.fid = seg.str_fid AND street_elems.seg_fid = seg.fid);
                     """
-    crop_seg_sql = """DELETE FROM street_seg WHERE igridn IS NULL;"""
-    crop_elem_sql = """DELETE FROM street_elems WHERE seg_fid NOT IN (SELECT fid FROM street_seg);"""
     gutils.execute(update_streets)
     gutils.execute(update_street_seg)
     gutils.execute(update_street_elems)
-    gutils.execute(crop_seg_sql)
-    gutils.execute(crop_elem_sql)
 
 
 def schematize_reservoirs(gutils):
@@ -1053,10 +1075,11 @@ class ChannelsSchematizer(GeoPackageUtils):
         self.update_banks_elev()
 
     def update_banks_elev(self):
+        lgid = rgid = None
         try:
-            sel_qry = """SELECT elevation FROM grid WHERE fid = ?;"""
             update_table = {"T": "user_chan_t", "R": "user_chan_r"}
-            elems = {}
+            xsections = []
+            xs, ys = [], []
             for feat in self.user_xsections_lyr.getFeatures():
                 fid = feat["fid"]
                 typ = feat["type"]
@@ -1065,11 +1088,19 @@ class ChannelsSchematizer(GeoPackageUtils):
                 line_geom = feat.geometry().asPolyline()
                 start = line_geom[0]
                 end = line_geom[-1]
-                lgid = self.grid_on_point(start.x(), start.y())
-                rgid = self.grid_on_point(end.x(), end.y())
-                lelev = self.execute(sel_qry, (lgid,)).fetchone()[0]
-                relev = self.execute(sel_qry, (rgid,)).fetchone()[0]
-                elems[fid] = (lelev, relev, typ)
+                xsections.append((fid, typ))
+                xs += [start.x(), end.x()]
+                ys += [start.y(), end.y()]
+            # Banks cells of all cross sections in one lookup (left and right ends interleaved).
+            gids, elevs = self.grid_on_points(xs, ys, with_elevation=True)
+            gids = gids.tolist()
+            elevs = [None if np.isnan(elev) else elev for elev in elevs.tolist()]
+            elems = {}
+            for i, (fid, typ) in enumerate(xsections):
+                lgid, rgid = gids[2 * i] or None, gids[2 * i + 1] or None
+                if lgid is None or rgid is None:
+                    raise ValueError("Bank of cross section {} is outside the grid.".format(fid))
+                elems[fid] = (elevs[2 * i], elevs[2 * i + 1], typ)
 
             update_qry = """UPDATE {0} SET {1} = ? WHERE user_xs_fid = ? AND {1} IS NULL;"""
             for fid, (lelev, relev, typ) in list(elems.items()):
@@ -2334,6 +2365,41 @@ class Confluences(GeoPackageUtils):
         self.execute(del_sql, (seg_fid, vertex_id))
 
 
+def floodplain_xs_cells(grid_idx, x1, y1, x2, y2, cells_on_points=None):
+    """
+    Return (sections, fids) arrays of grid cells of floodplain cross-sections drawn from (x1, y1) to (x2, y2).
+    Every section starts in the cell containing its first point and steps cell by cell in the nearest of 8 directions
+    for the length of the user line. Sections are cut before the first cell outside the grid.
+    Cells are found under the points and the shifted centroids with 'cells_on_points(xs, ys)' function
+    (lattice lookup by default, which needs a regular grid).
+    """
+    if cells_on_points is None:
+        if not grid_idx.regular:
+            raise ValueError("Cross-section cells of the irregular grid need a spatial lookup.")
+        cells_on_points = grid_idx.fids_at
+    x1, y1, x2, y2 = [np.asarray(c, dtype=np.float64) for c in (x1, y1, x2, y2)]
+    start_pos = grid_idx.positions(np.asarray(cells_on_points(x1, y1), dtype=np.int64))
+    # Azimuth rounded to the nearest multiple of 45 degrees
+    azimuth = np.mod(np.degrees(np.arctan2(x2 - x1, y2 - y1)), 360)
+    octants = np.rint(azimuth / 45).astype(np.int64) % 8
+    dcols, drows = DIR_OFFSETS[CLOCKWISE_DIRS[octants]].T
+    steps = np.where(octants % 2 == 0, grid_idx.cell_size, sqrt(2) * grid_idx.cell_size)
+    counts = np.floor(np.hypot(x2 - x1, y2 - y1) / steps + 0.5).astype(np.int64) + 1
+    sections = np.repeat(np.arange(counts.shape[0]), counts)
+    starts = np.cumsum(counts) - counts
+    cells = np.arange(sections.shape[0]) - starts[sections]
+    offsets = cells * grid_idx.cell_size
+    pos = start_pos[sections]
+    xs = grid_idx.x[pos] + dcols[sections] * offsets
+    ys = grid_idx.y[pos] + drows[sections] * offsets
+    fids = np.asarray(cells_on_points(xs, ys), dtype=np.int64)
+    fids[pos < 0] = 0
+    outside = np.cumsum(fids == 0)
+    outside_before = np.concatenate([[0], outside])[starts]
+    inside = outside == outside_before[sections]
+    return sections[inside], fids[inside]
+
+
 class FloodplainXS(GeoPackageUtils):
     """
     Class for schematizing floodplain cross-sections.
@@ -2343,69 +2409,57 @@ class FloodplainXS(GeoPackageUtils):
         super(FloodplainXS, self).__init__(con, iface)
         self.lyrs = lyrs
         self.cell_size = float(self.get_cont_par("CELLSIZE"))
-        self.diagonal = sqrt(2) * self.cell_size
         self.user_fpxs_lyr = lyrs.data["user_fpxsec"]["qlyr"]
         self.schema_fpxs_lyr = lyrs.data["fpxsec"]["qlyr"]
         self.cells_fpxs_lyr = lyrs.data["fpxsec_cells"]["qlyr"]
 
-    def interpolate_points(self, line, step):
-        length = line.length()
-        reps = round(length / step)
-        distance = 0
-        while reps >= 0:
-            pnt = line.interpolate(distance).asPoint()
-            gid = self.grid_on_point(pnt.x(), pnt.y())
-            geom = self.single_centroid(gid, buffers=True)
-            yield (geom, gid)
-            distance = min(length, distance + step)
-            reps -= 1
-
     def schematize_floodplain_xs(self):
-        self.clear_tables("fpxsec", "fpxsec_cells")
+        """
+        Schematizing user floodplain cross-sections on the grid lattice (spatial lookup on irregular grids).
+        Sections and their cells are written in a single transaction with geometries built from cells centroids.
+        """
         fpxsec_qry = "INSERT INTO fpxsec (geom, fid, iflo, nnxsec) VALUES (?,?,?,?);"
         fpxsec_cells_qry = "INSERT INTO fpxsec_cells (geom, grid_fid, fpxsec_fid) VALUES (?,?,?);"
-        cell_qry = """SELECT ST_AsText(ST_Centroid(GeomFromGPB(geom))) FROM grid WHERE fid = ?;"""
-        point_rows = []
-        line_rows = []
+        sections = []
+        coords = []
         for feat in self.user_fpxs_lyr.getFeatures():
-            # Schematizing user floodplain cross-section
-            feat_fid = feat["fid"]
-            geom = feat.geometry()
-            geom_poly = geom.asPolyline()
+            geom_poly = feat.geometry().asPolyline()
+            if not geom_poly:
+                continue
             start, end = geom_poly[0], geom_poly[-1]
-            # Getting start grid fid and its centroid
-            start_gid = self.grid_on_point(start.x(), start.y())
-            start_wkt = self.execute(cell_qry, (start_gid,)).fetchone()[0]
-            start_x, start_y = [float(s) for s in start_wkt.strip("POINT()").split()]
-            # Finding shift vector between original start point and start grid centroid
-            shift = QgsPointXY(start_x, start_y) - start
-            # Shifting start and end point of line
-            start += shift
-            end += shift
-            # Calculating and adjusting line angle
-            azimuth = start.azimuth(end)
-            if azimuth < 0:
-                azimuth += 360
-            closest_angle = round(azimuth / 45) * 45
-            rotation = closest_angle - azimuth
-            end_geom = QgsGeometry.fromPointXY(end)
-            end_geom.rotate(rotation, start)
-            end_point = end_geom.asPoint()
-            # Getting shifted and rotated end grid fid and its centroid
-            end_gid = self.grid_on_point(end_point.x(), end_point.y())
-            # Finding 'fpxsec_cells' for floodplain cross-section
-            step = self.cell_size if closest_angle % 90 == 0 else self.diagonal
-            end_wkt = self.execute(cell_qry, (end_gid,)).fetchone()[0]
-            end_x, end_y = [float(e) for e in end_wkt.strip("POINT()").split()]
-            fpxec_line = QgsGeometry.fromPolylineXY([QgsPointXY(start_x, start_y), QgsPointXY(end_x, end_y)])
-            sampling_points = tuple(self.interpolate_points(fpxec_line, step))
-            # Adding schematized line for 'fpxsec' table
-            line_geom = self.build_linestring([start_gid, end_gid])
-            line_rows.append((line_geom, feat_fid, feat["iflo"], len(sampling_points)))
-            for point_geom, gid in sampling_points:
-                point_rows.append((point_geom, gid, feat_fid))
+            sections.append((feat["fid"], feat["iflo"]))
+            coords.append((start.x(), start.y(), end.x(), end.y()))
+        grid_idx = cached_grid_index(self)
+        line_rows = []
+        point_rows = []
+        if sections:
+            cells_on_points = None if grid_idx.regular else self.grid_on_points
+            cell_sections, fids = floodplain_xs_cells(
+                grid_idx, *np.array(coords, dtype=np.float64).T, cells_on_points=cells_on_points
+            )
+            pos = grid_idx.positions(fids)
+            xs, ys = grid_idx.x[pos].tolist(), grid_idx.y[pos].tolist()
+            counts = np.bincount(cell_sections, minlength=len(sections)).tolist()
+            first = 0
+            for (feat_fid, iflo), count in zip(sections, counts):
+                if count == 0:
+                    continue
+                last = first + count - 1
+                line_geom = linestring_gpb([(xs[first], ys[first]), (xs[last], ys[last])])
+                line_rows.append((line_geom, feat_fid, iflo, count))
+                for i in range(first, last + 1):
+                    point_rows.append((point_gpb(xs[i], ys[i]), int(fids[i]), feat_fid))
+                first = last + 1
         # Writing schematized floodplain cross-sections and cells to GeoPackage
-        self.execute_many(fpxsec_cells_qry, point_rows)
-        self.execute_many(fpxsec_qry, line_rows)
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM fpxsec;")
+            cur.execute("DELETE FROM fpxsec_cells;")
+            cur.executemany(fpxsec_cells_qry, point_rows)
+            cur.executemany(fpxsec_qry, line_rows)
+            self.con.commit()
+        except Exception:
+            self.con.rollback()
+            raise
         self.schema_fpxs_lyr.triggerRepaint()
         self.cells_fpxs_lyr.triggerRepaint()
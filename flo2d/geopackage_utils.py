@@ -8,12 +8,18 @@
 # as published by the Free Software Foundation; either version 2
 # of the License, or (at your option) any later version
 import os
+import sqlite3
 import traceback
 from collections import defaultdict
+from contextlib import contextmanager
 from functools import wraps
 
+import numpy as np
 from qgis.core import QgsGeometry
 
+from .errors import Flo2dError
+from .flo2d_tools.grid_index import cached_grid_index, invalidate_grid_index
+from .misc.gpb import gpb_envelopes, polygon_gpb, square_gpb, squares_gpb
 from .user_communication import UserCommunication
 
 
@@ -109,12 +115,187 @@ def database_disconnect(con):
     Disconnect from database.
     """
     try:
+        invalidate_grid_index(con)
         con.close()
     except Exception as e:
         # There is no active connection!
         pass
 
 
+class SessionConnection(object):
+    """
+    Connection proxy used inside ImportSession.
+    Work done between commits is kept in the "work" savepoint, so commit only releases it into the session
+    transaction and rollback undoes changes since the last commit, like on the plain connection.
+    """
+
+    def __init__(self, con):
+        self.con = con
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    def begin_work(self):
+        self.con.execute('SAVEPOINT "work";')
+
+    def commit(self):
+        try:
+            self.con.execute('RELEASE "work";')
+        except sqlite3.OperationalError as e:
+            # Savepoints are gone after commit done through the plain connection.
+            raise Flo2dError("Import session transaction was committed through the plain connection.") from e
+        self.begin_work()
+
+    def rollback(self):
+        try:
+            self.con.execute('ROLLBACK TO "work";')
+        except sqlite3.Error:
+            # Transaction was already rolled back by SQLite itself.
+            pass
+
+
+class ImportSession(object):
+    """
+    Context manager running bulk import into GeoPackage as a single transaction.
+    While the session is active, connections of 'gutils' and any other given objects are replaced with
+    SessionConnection, PRAGMAs are tuned for bulk writes, geometry triggers and R-tree maintenance are disabled.
+    Spatial indexes are rebuilt once before the final commit. Any exception rolls back the whole session.
+    Journal and synchronous modes are left untouched, so a crash during the import can't corrupt the GeoPackage.
+    If the transaction gets committed behind the session (through the plain connection), the spatial indexes
+    and triggers are restored anyway and Flo2dError is raised.
+    """
+
+    PRAGMAS = [
+        ("cache_size", "-262144"),
+        ("temp_store", "MEMORY"),
+    ]
+
+    def __init__(self, gutils, *clients):
+        self.gutils = gutils
+        self.clients = (gutils,) + clients
+        self.con = gutils.con
+        self.connection = SessionConnection(self.con)
+        self.checkpoint_name = None
+        self.pragmas = []
+        self.triggers_state = []
+        self.rtree_triggers = {}
+
+    def __enter__(self):
+        self.con.commit()
+        self.set_pragmas()
+        self.con.execute("BEGIN;")
+        for client in self.clients:
+            client.con = self.connection
+        self.checkpoint("import_session")
+        self.triggers_state = self.gutils.execute("""SELECT fid, enabled FROM trigger_control;""").fetchall()
+        self.gutils.disable_geom_triggers()
+        for table, column in self.gutils.spatial_indexes():
+            self.rtree_triggers[(table, column)] = self.gutils.drop_rtree_triggers(table, column)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        committed_early = False
+        try:
+            if exc_type is None:
+                try:
+                    self.checkpoint("spatial_indexes")
+                except sqlite3.OperationalError:
+                    # Session savepoint is gone, so the transaction was committed through the plain connection.
+                    committed_early = True
+                    self.release_clients()
+                self.restore_spatial_indexes()
+                self.con.commit()
+            else:
+                self.con.rollback()
+                if self.rtree_triggers_missing():
+                    # Dropped R-tree triggers were committed before the failure, rollback can't bring them back.
+                    committed_early = True
+                    self.release_clients()
+                    self.restore_spatial_indexes()
+                    self.con.commit()
+        except Exception:
+            self.con.rollback()
+            raise
+        finally:
+            self.release_clients()
+            self.restore_pragmas()
+        if committed_early and exc_type is None:
+            raise Flo2dError("Import session transaction was committed before the end of the session.")
+        return False
+
+    def release_clients(self):
+        for client in self.clients:
+            client.con = self.con
+
+    def rtree_triggers_missing(self):
+        qry = """SELECT COUNT(name) FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?;"""
+        for (table, column), triggers in self.rtree_triggers.items():
+            if triggers and self.con.execute(qry, ("rtree_{0}_{1}%".format(table, column),)).fetchone()[0] == 0:
+                return True
+        return False
+
+    def restore_spatial_indexes(self):
+        for (table, column), triggers in self.rtree_triggers.items():
+            self.gutils.rebuild_rtree(table, column)
+            for trigger_sql in triggers:
+                self.gutils.execute(trigger_sql)
+        qry = """UPDATE trigger_control SET enabled = ? WHERE fid = ?;"""
+        self.con.executemany(qry, [(enabled, fid) for fid, enabled in self.triggers_state])
+
+    def set_pragmas(self):
+        self.pragmas = []
+        for pragma, value in self.PRAGMAS:
+            try:
+                current = self.con.execute("PRAGMA {0};".format(pragma)).fetchone()[0]
+                self.con.execute("PRAGMA {0} = {1};".format(pragma, value))
+                self.pragmas.append((pragma, current))
+            except sqlite3.Error:
+                continue
+
+    def restore_pragmas(self):
+        for pragma, value in reversed(self.pragmas):
+            try:
+                self.con.execute("PRAGMA {0} = {1};".format(pragma, value))
+            except sqlite3.Error:
+                continue
+
+    def checkpoint(self, name):
+        """
+        Set new checkpoint - the whole work done after it can be rolled back with rollback_to_checkpoint().
+        """
+        if self.checkpoint_name is not None:
+            self.con.execute('RELEASE "{0}";'.format(self.checkpoint_name))
+        self.con.execute('SAVEPOINT "{0}";'.format(name))
+        self.checkpoint_name = name
+        self.connection.begin_work()
+
+    def rollback_to_checkpoint(self):
+        try:
+            self.con.execute('ROLLBACK TO "{0}";'.format(self.checkpoint_name))
+        except sqlite3.Error:
+            # Transaction was already rolled back by SQLite itself.
+            return
+        self.connection.begin_work()
+
+
+def zorder_keys(envelopes):
+    """
+    Return Z-order (Morton) keys of envelopes centers - sorting by them keeps spatially close features together.
+    """
+    centers = np.column_stack(
+        ((envelopes[:, 0] + envelopes[:, 1]) * 0.5, (envelopes[:, 2] + envelopes[:, 3]) * 0.5)
+    )
+    lower = centers.min(axis=0)
+    span = np.maximum(centers.max(axis=0) - lower, 1e-12)
+    quantized = ((centers - lower) / span * 0xFFFF).astype(np.uint64)
+    keys = np.zeros(centers.shape[0], dtype=np.uint64)
+    for bit in range(16):
+        mask = np.uint64(1 << bit)
+        keys |= (quantized[:, 0] & mask) << np.uint64(bit)
+        keys |= (quantized[:, 1] & mask) << np.uint64(bit + 1)
+    return keys
+
+
 # Generate list of QgsPoints from input geometry ( can be point, line, or polygon )
 def extractPoints(geom):
     multi_geom = QgsGeometry()
@@ -219,17 +400,18 @@ class GeoPackageUtils(object):
         tabs = [row[0] for row in self.execute(tab_sql)]
         self.execute("ATTACH ? AS other;", (other_gpkg,))
         insert_sql = """INSERT INTO {0} ({1}) SELECT {1} FROM other.{0};"""
-        self.clear_tables(*tabs)
-        for tab in tabs:
-            names_new = self.table_info(tab, only_columns=True)
-            names_old = set(self.table_info(tab, only_columns=True, attached_db="other"))
-            import_names = (name for name in names_new if name in names_old)
-            columns = ", ".join(import_names)
-            try:
-                qry = insert_sql.format(tab, columns)
-                self.execute(qry)
-            except Exception as e:
-                self.uc.log_info(traceback.format_exc())
+        with self.bulk_load(*tabs):
+            self.clear_tables(*tabs)
+            for tab in tabs:
+                names_new = self.table_info(tab, only_columns=True)
+                names_old = set(self.table_info(tab, only_columns=True, attached_db="other"))
+                import_names = (name for name in names_new if name in names_old)
+                columns = ", ".join(import_names)
+                try:
+                    qry = insert_sql.format(tab, columns)
+                    self.execute(qry)
+                except Exception as e:
+                    self.uc.log_info(traceback.format_exc())
         self.execute("DETACH other;")
 
     def execute(self, statement, inputs=None, get_rowid=False):
@@ -473,50 +655,27 @@ class GeoPackageUtils(object):
         return gpb_buff
 
     def build_square_xy(self, x, y, size):
-        half_size = size * 0.5
-        gpb = """SELECT AsGPB(ST_GeomFromText('POLYGON(({} {}, {} {}, {} {}, {} {}, {} {}))'))""".format(
-            x - half_size,
-            y - half_size,
-            x + half_size,
-            y - half_size,
-            x + half_size,
-            y + half_size,
-            x - half_size,
-            y + half_size,
-            x - half_size,
-            y - half_size,
-        )
-        gpb_buff = self.execute(gpb).fetchone()[0]
+        gpb_buff = square_gpb(float(x), float(y), float(size))
         return gpb_buff
 
     def build_square(self, wkt_geom, size):
         x, y = [float(x) for x in wkt_geom.strip("POINT()").split()]
-        half_size = float(size) * 0.5
-        gpb = """SELECT AsGPB(ST_GeomFromText('POLYGON(({} {}, {} {}, {} {}, {} {}, {} {}))'))""".format(
-            x - half_size,
-            y - half_size,
-            x + half_size,
-            y - half_size,
-            x + half_size,
-            y + half_size,
-            x - half_size,
-            y + half_size,
-            x - half_size,
-            y - half_size,
-        )
-        gpb_buff = self.execute(gpb).fetchone()[0]
+        gpb_buff = square_gpb(x, y, float(size))
         return gpb_buff
 
+    def build_squares_xy(self, xs, ys, size):
+        """
+        Generator of square polygons GPB blobs for arrays of centroid coordinates.
+        """
+        return squares_gpb(xs, ys, float(size))
+
     def build_square_from_polygon(self, polygon_coordinates):
-        gpb = """SELECT AsGPB(ST_GeomFromText('POLYGON(({} {}, {} {}, {} {}, {} {}, {} {}))'))""".format(
-            *polygon_coordinates
-        )
-        gpb_buff = self.execute(gpb).fetchone()[0]
+        ring = zip(polygon_coordinates[0:10:2], polygon_coordinates[1:10:2])
+        gpb_buff = polygon_gpb(ring)
         return gpb_buff
 
     def build_square_from_polygon2(self, polyColRow):
-        gpb = """SELECT AsGPB(ST_GeomFromText('POLYGON(({} {}, {} {}, {} {}, {} {}, {} {}))'))""".format(*polyColRow[0])
-        gpb_buff = self.execute(gpb).fetchone()[0]
+        gpb_buff = self.build_square_from_polygon(polyColRow[0])
         return (gpb_buff, polyColRow[1], polyColRow[2])
 
     def get_max(self, table, field="fid"):
@@ -671,6 +830,84 @@ class GeoPackageUtils(object):
         qry = "UPDATE trigger_control SET enabled = 1;"
         self.execute(qry)
 
+    def spatial_indexes(self):
+        """
+        Get list of (table, column) pairs with GeoPackage R-tree spatial index.
+        """
+        qry = """SELECT table_name, column_name FROM gpkg_extensions WHERE extension_name = 'gpkg_rtree_index';"""
+        return [(table, column) for table, column in self.execute(qry)]
+
+    def drop_rtree_triggers(self, table, column="geom"):
+        """
+        Drop triggers maintaining R-tree spatial index of the table and return their SQL definitions.
+        """
+        prefix = "rtree_{0}_{1}_".format(table, column)
+        qry = """SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?;"""
+        triggers = [(name, sql) for name, sql in self.execute(qry, (table,)) if name.startswith(prefix)]
+        for name, sql in triggers:
+            self.execute("""DROP TRIGGER IF EXISTS "{0}";""".format(name))
+        return [sql for name, sql in triggers]
+
+    def rebuild_rtree(self, table, column="geom", chunksize=500000):
+        """
+        Repopulate R-tree spatial index of the table in one go.
+        Bounding boxes are read from GPB headers and inserted in chunks sorted in Z-order.
+        Geometries without envelope in the header are measured with SpatiaLite.
+        """
+        rtree = "rtree_{0}_{1}".format(table, column)
+        self.execute("""DELETE FROM "{0}";""".format(rtree))
+        insert_qry = """INSERT INTO "{0}" (id, minx, maxx, miny, maxy) VALUES (?, ?, ?, ?, ?);""".format(rtree)
+        measure_qry = """
+        SELECT ROWID, ST_MinX("{1}"), ST_MaxX("{1}"), ST_MinY("{1}"), ST_MaxY("{1}")
+        FROM "{0}"
+        WHERE ROWID = ? AND NOT ST_IsEmpty("{1}");
+        """.format(
+            table, column
+        )
+        cursor = self.con.cursor()
+        cursor.execute("""SELECT ROWID, "{1}" FROM "{0}" WHERE "{1}" NOT NULL;""".format(table, column))
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            ids, blobs = zip(*rows)
+            ids = np.array(ids, dtype=np.int64)
+            envelopes = gpb_envelopes(blobs)
+            measured = ~np.isnan(envelopes).any(axis=1)
+            ids_measured, envelopes = ids[measured], envelopes[measured]
+            if ids_measured.shape[0]:
+                order = np.argsort(zorder_keys(envelopes), kind="stable")
+                records = np.column_stack((ids_measured[order], envelopes[order])).tolist()
+                self.con.executemany(insert_qry, ((int(r[0]), r[1], r[2], r[3], r[4]) for r in records))
+            for rowid in ids[~measured].tolist():
+                record = self.con.execute(measure_qry, (rowid,)).fetchone()
+                if record is not None and None not in record:
+                    self.con.execute(insert_qry, record)
+        self.con.commit()
+
+    @contextmanager
+    def bulk_load(self, *tables, column="geom"):
+        """
+        Context manager for bulk writes into tables with R-tree spatial index.
+        Triggers maintaining the index are dropped for the time of loading and the index is rebuilt once at the end.
+        Tables without spatial index (or with index maintenance already deferred) are left untouched.
+        """
+        indexed = set(self.spatial_indexes())
+        deferred = []
+        for table in tables:
+            if (table, column) not in indexed:
+                continue
+            triggers = self.drop_rtree_triggers(table, column)
+            if triggers:
+                deferred.append((table, triggers))
+        try:
+            yield
+        finally:
+            for table, triggers in deferred:
+                self.rebuild_rtree(table, column)
+                for trigger_sql in triggers:
+                    self.execute(trigger_sql)
+
     def calculate_offset(self, cell_size):
         """
         Finding offset of grid squares centers which is formed after switching from float to integers.
@@ -707,6 +944,69 @@ class GeoPackageUtils(object):
             gid = None
         return gid
 
+    def grid_on_points(self, xs, ys, with_elevation=False):
+        """
+        Getting fids of grid cells which contain given points (0 for points outside the grid).
+        Regular grids are resolved arithmetically from the grid origin, irregular ones with a single spatial index join.
+        If 'with_elevation' is True, (fids, elevations) arrays are returned (NaN for points outside the grid).
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        grid_idx = cached_grid_index(self)
+        if grid_idx.regular:
+            fids = grid_idx.fids_at(xs, ys)
+        else:
+            fids = self.grid_on_points_rtree(xs, ys)
+        if not with_elevation:
+            return fids
+        elevations = np.full(fids.shape, np.nan, dtype=np.float64)
+        pos = grid_idx.positions(fids)
+        found = pos >= 0
+        elevations[found] = grid_idx.elevation[pos[found]]
+        return fids, elevations
+
+    def grid_on_points_rtree(self, xs, ys):
+        """
+        Getting fids of grid cells which contain given points by joining them with the 'rtree_grid_geom' index.
+        Points are loaded into the temporary table, so all of them are resolved with a single query.
+        Temporary rows are written inside a savepoint, so the caller's transaction is neither committed nor broken.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        fids = np.zeros(xs.size, dtype=np.int64)
+        if xs.size == 0:
+            return fids.reshape(xs.shape)
+        qry = """
+        SELECT p.fid, MIN(g.fid)
+        FROM grid_query_points AS p
+        JOIN rtree_grid_geom AS r
+            ON p.x <= r.maxx AND p.x >= r.minx AND p.y <= r.maxy AND p.y >= r.miny
+        JOIN grid AS g
+            ON g.ROWID = r.id
+        WHERE ST_Intersects(GeomFromGPB(g.geom), MakePoint(p.x, p.y))
+        GROUP BY p.fid;
+        """
+        cur = self.con.cursor()
+        cur.execute("""SAVEPOINT grid_query_points;""")
+        try:
+            cur.execute("""CREATE TEMP TABLE IF NOT EXISTS grid_query_points (fid INTEGER PRIMARY KEY, x REAL, y REAL);""")
+            cur.execute("""DELETE FROM grid_query_points;""")
+            cur.executemany(
+                """INSERT INTO grid_query_points (fid, x, y) VALUES (?,?,?);""",
+                zip(range(xs.size), xs.ravel().tolist(), ys.ravel().tolist()),
+            )
+            rows = cur.execute(qry).fetchall()
+            cur.execute("""DELETE FROM grid_query_points;""")
+        except Exception:
+            cur.execute("""ROLLBACK TO SAVEPOINT grid_query_points;""")
+            raise
+        finally:
+            cur.execute("""RELEASE SAVEPOINT grid_query_points;""")
+        if rows:
+            pids, gids = np.array(rows, dtype=np.int64).T
+            fids[pids] = gids
+        return fids.reshape(xs.shape)
+
     def grid_elevation_on_point(self, x, y):
         """
         Getting elevation of grid which contains given point.
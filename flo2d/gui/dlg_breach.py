@@ -39,11 +39,7 @@ from ..flo2d_tools.grid_tools import (
     adjacent_grid_elevations_np,
     buildCellElevNPArray,
     buildCellIDNPArray,
-    cellElevNumpyArray,
-    cellIDNumpyArray,
     number_of_elements,
-    xvalsNumpyArray,
-    yvalsNumpyArray,
 )
 from ..geopackage_utils import GeoPackageUtils
 from ..user_communication import UserCommunication
@@ -683,12 +679,8 @@ class IndividualLeveesDialog(qtBaseClass, uiDialog_individual_levees):
 
         self.grid_count = self.gutils.count("grid", field="fid")
 
-        global cellIDNumpyArray
-        global cellElevNumpyArray
-        if cellIDNumpyArray is None:
-            cellIDNumpyArray, xvalsNumpyArray, yvalsNumpyArray = buildCellIDNPArray(self.gutils)
-        if cellElevNumpyArray is None:
-            cellElevNumpyArray = buildCellElevNPArray(self.gutils, cellIDNumpyArray)
+        self.cellIDNumpyArray, xvals, yvals = buildCellIDNPArray(self.gutils)
+        self.cellElevNumpyArray = buildCellElevNPArray(self.gutils, self.cellIDNumpyArray)
 
         # Allow only integers:
         validator = QIntValidator()
@@ -1084,7 +1076,7 @@ class IndividualLeveesDialog(qtBaseClass, uiDialog_individual_levees):
                 # print ("Adjacent_grid_elevations: %s"  % (datetime.now() - starttime).total_seconds())
                 cell = int(cell)
                 # starttime = datetime.now()
-                elevs = adjacent_grid_elevations_np(cell, cellIDNumpyArray, cellElevNumpyArray)
+                elevs = adjacent_grid_elevations_np(cell, self.cellIDNumpyArray, self.cellElevNumpyArray)
                 # print ("Adjacent_grid_elevations_np: %s"  % (datetime.now() - starttime).total_seconds())
 
                 if self.grid_count >= cell and cell > 0:
@@ -12,6 +12,7 @@ import os
 import time
 from multiprocessing.pool import ApplyResult
 
+import numpy as np
 from qgis.core import *
 from qgis.core import (
     Qgis,
@@ -45,6 +46,8 @@ from qgis.PyQt.QtWidgets import (
     qApp,
 )
 
+from ..flo2d_tools.conflicts import Conflicts
+from ..flo2d_tools.grid_index import cached_grid_index
 from ..flo2d_tools.grid_tools import (
     get_adjacent_cell_elevation,
     grid_has_empty_elev,
@@ -55,14 +58,13 @@ from ..gui.dlg_sampling_buildings_elevations import SamplingBuildingsElevationsD
 from ..gui.dlg_sampling_elev import SamplingElevDialog
 from ..user_communication import UserCommunication
 from ..utils import copy_tablewidget_selection
+from .issues_model import IssuesIndex, IssuesTableModel
 from .table_editor_widget import StandardItem, StandardItemModel
 from .ui_utils import center_canvas, load_ui, set_icon, zoom, zoom_show_n_cells
 
 # from qgis.core import QgsFeature, QgsGeometry, QgsPointXY
 
 
-# from ..flo2d_tools.conflicts import Conflicts
-
 uiDialog, qtBaseClass = load_ui("errors_2")
 
 
@@ -238,7 +240,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
         self.errors_cbo.activated.connect(self.errors_cbo_activated)
         self.elements_cbo.activated.connect(self.elements_cbo_activated)
         self.find_cell_btn.clicked.connect(self.find_cell_clicked)
-        self.description_tblw.cellClicked.connect(self.description_tblw_cell_clicked)
+        self.description_tblw.clicked.connect(self.description_tblw_cell_clicked)
         self.zoom_in_btn.clicked.connect(self.zoom_in)
         self.zoom_out_btn.clicked.connect(self.zoom_out)
         self.next_grid_issues_btn.clicked.connect(self.load_next_combo)
@@ -249,6 +251,9 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
         self.previous_grid_issues_btn.setVisible(False)
         self.next_grid_issues_btn.setVisible(False)
 
+        self.issues_index = IssuesIndex(self.errors)
+        self.issues_model = IssuesTableModel(self.errors, self)
+        self.description_tblw.setModel(self.issues_model)
         self.description_tblw.setSortingEnabled(False)
         self.description_tblw.setColumnWidth(2, 550)
         self.description_tblw.resizeRowsToContents()
@@ -414,6 +419,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                 self.errors_cbo.addItem(" ")
 
                 seen = set(self.cells)
+                cell_rows = []
                 with open(debug_file, "r") as f1:
                     for line in f1:
                         row = line.split(",")
@@ -426,13 +432,13 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                             if self.n_cells >= iCell and iCell > 0:
                                 description = ", ".join(row[2:]).strip()
                                 self.errors.append([cell, row[1].strip(), description])
-                                # Create points for issues layer:
-                                if cell not in seen:
-                                    seen.add(cell)
+                                if iCell not in seen:
+                                    seen.add(iCell)
                                     self.cells.append(iCell)
-                                    feat = next(self.grid.getFeatures(QgsFeatureRequest(iCell)))
-                                    x, y = feat.geometry().centroid().asPoint()
-                                    features.append([x, y, iCell, description])  # x, y, cell, description
+                                    cell_rows.append([iCell, description])
+
+                # Create points for issues layer:
+                features = self.cells_centroids(cell_rows)  # x, y, cell, description
 
                 fields = [["cell", "I"], ["description", "S"]]
 
@@ -474,14 +480,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
             return False
 
     def populate_errors_cbo(self):
-        singleErrors = []
-        for x in self.errors:
-            err = int(x[1].strip())
-            if err not in singleErrors:
-                singleErrors.append(err)
-
-        singleErrors.sort()
-        for error in singleErrors:
+        for error in self.issues_index.unique_codes().tolist():
             self.errors_cbo.addItem(str(error))
 
     def import_other_issues_files(self):
@@ -680,6 +679,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                 QApplication.setOverrideCursor(Qt.WaitCursor)
                 # qApp.processEvents()
                 features = []
+                cell_rows = []
                 with open(file, "r") as f:
                     for _ in range(1):
                         next(f)
@@ -696,22 +696,20 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                                 )
                                 cell = int(values[0])
                                 if self.n_cells >= cell and cell > 0:
-                                    feat = next(self.grid.getFeatures(QgsFeatureRequest(cell)))
-                                    x, y = feat.geometry().centroid().asPoint()
-                                    features.append(
+                                    cell_rows.append(
                                         [
-                                            x,
-                                            y,
                                             values[0],
                                             values[1],
                                             values[2],
                                             values[3],
                                             values[4],
                                         ]
-                                    )  # x, y, cell, etc
+                                    )
                                 else:
                                     self.cells_out += 1
 
+                features = self.cells_centroids(cell_rows)  # x, y, cell, etc
+
             except Exception as e:
                 QApplication.restoreOverrideCursor()
                 self.close()
@@ -754,6 +752,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                 QApplication.setOverrideCursor(Qt.WaitCursor)
                 # qApp.processEvents()
                 features = []
+                cell_rows = []
                 with open(file, "r") as f:
                     for _ in range(3):
                         next(f)
@@ -770,12 +769,12 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                             )
                             cell = int(values[0])
                             if self.n_cells >= cell and cell > 0:
-                                feat = next(self.grid.getFeatures(QgsFeatureRequest(cell)))
-                                x, y = feat.geometry().centroid().asPoint()
-                                features.append([x, y, values[0], values[1]])
+                                cell_rows.append([values[0], values[1]])
                             else:
                                 self.cells_out += 1
 
+                features = self.cells_centroids(cell_rows)  # x, y, cell, etc
+
             except Exception as e:
                 QApplication.restoreOverrideCursor()
                 self.close()
@@ -812,6 +811,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                 QApplication.setOverrideCursor(Qt.WaitCursor)
                 # qApp.processEvents()
                 features = []
+                cell_rows = []
                 with open(file, "r") as f:
                     for _ in range(1):
                         next(f)
@@ -834,22 +834,20 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                             )
                             cell = int(values[0])
                             if self.n_cells >= cell and cell > 0:
-                                feat = next(self.grid.getFeatures(QgsFeatureRequest(cell)))
-                                x, y = feat.geometry().centroid().asPoint()
-                                features.append(
+                                cell_rows.append(
                                     [
-                                        x,
-                                        y,
                                         values[0],
                                         values[1],
                                         values[2],
                                         values[3],
                                         values[4],
                                     ]
-                                )  # x, y, cell, etc
+                                )
                             else:
                                 self.cells_out += 1
 
+                features = self.cells_centroids(cell_rows)  # x, y, cell, etc
+
             except Exception as e:
                 QApplication.restoreOverrideCursor()
                 self.close()
@@ -892,6 +890,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                 QApplication.setOverrideCursor(Qt.WaitCursor)
                 # qApp.processEvents()
                 features = []
+                cell_rows = []
                 with open(file, "r") as f:
                     for row in f:
                         values = row.split()
@@ -905,12 +904,12 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                             )
                             cell = int(values[0])
                             if self.n_cells >= cell and cell > 0:
-                                feat = next(self.grid.getFeatures(QgsFeatureRequest(cell)))
-                                x, y = feat.geometry().centroid().asPoint()
-                                features.append([x, y, values[0]])  # x, y, cell, etc
+                                cell_rows.append([values[0]])
                             else:
                                 self.cells_out += 1
 
+                features = self.cells_centroids(cell_rows)  # x, y, cell, etc
+
             except Exception as e:
                 QApplication.restoreOverrideCursor()
                 self.close()
@@ -1014,9 +1013,8 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
     def populate_elements_cbo(self):
         self.elements_cbo.clear()
         self.elements_cbo.addItem(" ")
-        for x in self.errors:
-            if self.elements_cbo.findText(x[0].strip()) == -1:
-                self.elements_cbo.addItem(x[0].strip())
+        elements = dict.fromkeys(x[0].strip() for x in self.errors)
+        self.elements_cbo.addItems(list(elements))
 
     def codes_cbo_activated(self):
         QApplication.setOverrideCursor(Qt.WaitCursor)
@@ -1024,7 +1022,7 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
         QApplication.restoreOverrideCursor()
 
     def loadIssues(self):
-        self.description_tblw.setRowCount(0)
+        self.issues_model.set_rows([])
         codes = self.issues_codes_cbo.currentText()
         if codes == "Depressed Elements (DEPRESSED_ELEMENTS.OUT)":
             self.uc.bar_info("Depressed Elements (DEPRESSED_ELEMENTS.OUT)", 2)
@@ -1066,101 +1064,48 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
                 second = codes[1]
 
             if first.isdigit():
-                for item in self.errors:
-                    if second == "" and int(item[1]) == int(first):
-                        rowPosition = self.description_tblw.rowCount()
-                        self.description_tblw.insertRow(rowPosition)
-                        itm = QTableWidgetItem()
-                        itm.setData(Qt.EditRole, item[0].strip())
-                        self.description_tblw.setItem(rowPosition, 0, itm)
-                        itm = QTableWidgetItem()
-                        itm.setData(Qt.EditRole, item[1].strip())
-                        self.description_tblw.setItem(rowPosition, 1, itm)
-                        itm = QTableWidgetItem()
-                        itm.setData(Qt.EditRole, item[2])
-                        self.description_tblw.setItem(rowPosition, 2, itm)
-                    elif second != "" and int(item[1]) >= int(first) and int(item[1]) <= int(second):
-                        rowPosition = self.description_tblw.rowCount()
-                        self.description_tblw.insertRow(rowPosition)
-                        itm = QTableWidgetItem()
-                        itm.setData(Qt.EditRole, item[0].strip())
-                        self.description_tblw.setItem(rowPosition, 0, itm)
-                        itm = QTableWidgetItem()
-                        itm.setData(Qt.EditRole, item[1].strip())
-                        self.description_tblw.setItem(rowPosition, 1, itm)
-                        itm = QTableWidgetItem()
-                        itm.setData(Qt.EditRole, item[2])
-                        self.description_tblw.setItem(rowPosition, 2, itm)
+                if second == "":
+                    self.issues_model.set_rows(self.issues_index.code_rows(int(first)))
+                else:
+                    self.issues_model.set_rows(self.issues_index.code_rows(int(first), int(second)))
             elif first == "All":
-                for item in self.errors:
-                    rowPosition = self.description_tblw.rowCount()
-                    self.description_tblw.insertRow(rowPosition)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[0].strip())
-                    self.description_tblw.setItem(rowPosition, 0, itm)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[1].strip())
-                    self.description_tblw.setItem(rowPosition, 1, itm)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[2])
-                    self.description_tblw.setItem(rowPosition, 2, itm)
+                self.issues_model.set_rows(self.issues_index.all_rows())
 
-            if self.description_tblw.rowCount() > 0:
+            if self.issues_model.rowCount() > 0:
                 self.description_tblw.selectRow(0)
-                cell = self.description_tblw.item(0, 0).text()
+                cell = self.issues_model.cell(0)
                 self.find_cell(cell)
             else:
                 self.lyrs.clear_rubber()
 
         self.errors_cbo.setCurrentIndex(0)
         self.elements_cbo.setCurrentIndex(0)
-        if self.description_tblw.rowCount() > 0:
+        if self.issues_model.rowCount() > 0:
             self.description_tblw.selectRow(0)
-            cell = self.description_tblw.item(0, 0).text()
+            cell = self.issues_model.cell(0)
             self.find_cell(cell)
 
         QApplication.restoreOverrideCursor()
 
     def elements_cbo_activated(self):
-        self.description_tblw.setRowCount(0)
+        self.issues_model.set_rows([])
         nElems = self.elements_cbo.count()
         if nElems > 0:
             cell = self.elements_cbo.currentText().strip()
-            for item in self.errors:
-                if item[0].strip() == cell:
-                    rowPosition = self.description_tblw.rowCount()
-                    self.description_tblw.insertRow(rowPosition)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[0].strip())
-                    self.description_tblw.setItem(rowPosition, 0, itm)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[1].strip())
-                    self.description_tblw.setItem(rowPosition, 1, itm)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[2])
-                    self.description_tblw.setItem(rowPosition, 2, itm)
+            if cell.lstrip("-").isdigit():
+                self.issues_model.set_rows(self.issues_index.cell_rows(int(cell)))
 
             self.find_cell(cell)
             self.errors_cbo.setCurrentIndex(0)
             self.issues_codes_cbo.setCurrentIndex(0)
 
     def errors_cbo_activated(self):
-        self.description_tblw.setRowCount(0)
+        self.issues_model.set_rows([])
         nElems = self.errors_cbo.count()
         if nElems > 0:
-            for item in self.errors:
-                if item[1].strip() == self.errors_cbo.currentText().strip():
-                    rowPosition = self.description_tblw.rowCount()
-                    self.description_tblw.insertRow(rowPosition)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[0].strip())
-                    self.description_tblw.setItem(rowPosition, 0, itm)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[1].strip())
-                    self.description_tblw.setItem(rowPosition, 1, itm)
-                    itm = QTableWidgetItem()
-                    itm.setData(Qt.EditRole, item[2])
-                    self.description_tblw.setItem(rowPosition, 2, itm)
+            code = self.errors_cbo.currentText().strip()
+            if code.isdigit():
+                self.issues_model.set_rows(self.issues_index.code_rows(int(code)))
             self.elements_cbo.setCurrentIndex(0)
             self.issues_codes_cbo.setCurrentIndex(0)
 
@@ -1230,8 +1175,8 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
         finally:
             QApplication.restoreOverrideCursor()
 
-    def description_tblw_cell_clicked(self, row, column):
-        cell = self.description_tblw.item(row, 0).text()
+    def description_tblw_cell_clicked(self, index):
+        cell = self.issues_model.cell(index.row())
         self.find_cell(cell)
 
     def zoom_in(self):
@@ -1255,6 +1200,18 @@ class IssuesFromDEBUGDialog(qtBaseClass, uiDialog):
     def update_extent(self):
         self.ext = self.iface.mapCanvas().extent()
 
+    def cells_centroids(self, cell_rows):
+        """
+        Return rows prefixed with x, y of centroids of cells given in the first item of each row.
+        Centroids of all cells are taken at once from the grid index. Rows of cells missing in the grid are dropped.
+        """
+        if not cell_rows:
+            return []
+        grid_idx = cached_grid_index(self.gutils)
+        positions = grid_idx.positions([int(row[0]) for row in cell_rows])
+        xs, ys = grid_idx.x[positions].tolist(), grid_idx.y[positions].tolist()
+        return [[xs[i], ys[i]] + row for i, row in enumerate(cell_rows) if positions[i] >= 0]
+
     def create_points_shapefile(self, shapefile, name, fields, features):
         try:
             lyr = QgsProject.instance().mapLayersByName(name)
@@ -1516,6 +1473,8 @@ class CurrentConflictsDialog(qtBaseClass, uiDialog):
             self.gutils = GeoPackageUtils(self.con, self.iface)
 
     def populate_issues(self):
+        self.conflicts_engine = Conflicts(self.gutils)
+
         # Inflow conflicts:
 
         self.conflict4(
@@ -2214,6 +2173,8 @@ class CurrentConflictsDialog(qtBaseClass, uiDialog):
             "2 or more Streets in same cell",
         )
 
+        self.insert_engine_conflicts()
+
         self.setWindowTitle("Errors and Warnings for: " + self.issue1 + " with " + self.issue2)
 
         self.create_current_conflicts_layer()
@@ -2293,9 +2254,8 @@ class CurrentConflictsDialog(qtBaseClass, uiDialog):
     def populate_elements_cbo(self):
         self.elements_cbo.clear()
         self.elements_cbo.addItem(" ")
-        for x in self.errors:
-            if self.elements_cbo.findText(x[0].strip()) == -1:
-                self.elements_cbo.addItem(x[0].strip())
+        elements = dict.fromkeys(x[0].strip() for x in self.errors)
+        self.elements_cbo.addItems(list(elements))
         self.elements_cbo.model().sort(0)
 
     def populate_errors_cbo(self):
@@ -2461,133 +2421,31 @@ class CurrentConflictsDialog(qtBaseClass, uiDialog):
         copy_tablewidget_selection(self.description_tblw)
 
     def conflict(self, comp1, table1, cell_1, comp2, table2, cell_2, description):
-        cells1 = []
-        cells2 = []
-        repeated = []
-        sqr1 = "SELECT {0} FROM {1}".format(cell_1, table1)
-        sqr2 = "SELECT {0} FROM {1}".format(cell_2, table2)
-        rows1 = self.gutils.execute(sqr1).fetchall()
-        rows2 = self.gutils.execute(sqr2).fetchall()
-        if not rows1 or not rows2:
-            pass
-        else:
-            for row in rows1:
-                cells1.append(row)
-            for row in rows2:
-                cells2.append(row)
-            size1 = len(cells1)
-            size2 = len(cells2)
-
-            if comp1 == comp2:
-                for i in range(size1):
-                    k = i + 1
-                    for j in range(k, size1):
-                        if cells1[i][0] == cells1[j][0] and cells1[i][0] not in repeated:
-                            repeated.append(cells1[i][0])
-                            break
-            else:
-                for i in range(size1):
-                    for j in range(size2):
-                        if cells1[i][0] == cells2[j][0] and cells1[i][0] not in repeated:
-                            repeated.append(cells1[i][0])
-                            break
-        if repeated:
-            for r in repeated:
+        engine = Conflicts(self.gutils)
+        engine.add_pair((table1, cell_1), (table2, cell_2), (comp1, comp2, description))
+        for data, cells in engine.evaluate():
+            for r in cells.tolist():
                 self.errors.append([str(r), comp1, comp2, description])
 
     def conflict2(self, comp1, table1, cell_1, comp2, table2, cell_2, description):
-        repeated = []
-        rows1 = []
-        rows2 = []
-
-        sqr1 = "SELECT {0} FROM {1} ORDER BY {0} LIMIT {2}".format(cell_1, table1, self.numErrors.text())
-        sqr2 = "SELECT {0} FROM {1} ORDER BY {0} LIMIT {2}".format(cell_2, table2, self.numErrors.text())
-
-        rows1 = self.gutils.execute(sqr1).fetchall()
-        rows2 = self.gutils.execute(sqr2).fetchall()
-
-        size1 = len(rows1)
-        size2 = len(rows2)
-
-        if not rows1 or not rows2:
-            pass
-        else:
-            if comp1 == comp2:
-                for i in range(size1 - 2):
-                    if rows1[i][0] == rows1[i + 1][0]:
-                        if rows1[i][0] not in repeated:
-                            repeated.append(rows1[i][0])
-            else:
-                try:
-                    k = 0
-                    for i in range(size1):
-                        while True:
-                            if rows2[k][0] < rows1[i][0]:
-                                if k < size2 - 1:
-                                    k += 1
-                                    continue
-                                else:
-                                    k = 0
-                                    break
-                            elif rows2[k][0] > rows1[i][0]:
-                                break
-                            elif rows1[i][0] not in repeated:
-                                repeated.append(rows1[i][0])
-                            if k < size2 - 1:
-                                k += 1
-                            else:
-                                k = 0
-                                break
-
-                except ValueError:
-                    pass
-
-        if repeated:
-            for r in repeated:
+        engine = Conflicts(self.gutils)
+        engine.add_pair((table1, cell_1), (table2, cell_2), (comp1, comp2, description))
+        n = int(self.numErrors.text())
+        for data, cells in engine.evaluate():
+            for r in cells[:n].tolist():
                 self.errors.append([str(r), comp1, comp2, description])
 
     def conflict3(self, comp1, rows1, comp2, rows2, description):
-        repeated = []
-
-        size1 = len(rows1)
-        size2 = len(rows2)
-
         if not rows1 or not rows2:
             return 0
+        cells1 = np.array([row[0] for row in rows1])
+        if comp1 == comp2:
+            cells, counts = np.unique(cells1, return_counts=True)
+            repeated = cells[counts > 1]
         else:
-            if comp1 == comp2:
-                for i in range(size1 - 2):
-                    if rows1[i][0] == rows1[i + 1][0]:
-                        if rows1[i][0] not in repeated:
-                            repeated.append(rows1[i][0])
-            else:
-                try:
-                    k = 0
-                    for i in range(size1):
-                        while True:
-                            if rows2[k][0] < rows1[i][0]:
-                                if k < size2 - 1:
-                                    k += 1
-                                    continue
-                                else:
-                                    k = 0
-                                    break
-                            elif rows2[k][0] > rows1[i][0]:
-                                break
-                            elif rows1[i][0] not in repeated:
-                                repeated.append(rows1[i][0])
-                            if k < size2 - 1:
-                                k += 1
-                            else:
-                                k = 0
-                                break
-
-                except ValueError:
-                    pass
-
-        if repeated:
-            for r in repeated:
-                self.errors.append([str(r), comp1, comp2, description])
+            repeated = np.intersect1d(cells1, np.array([row[0] for row in rows2]))
+        for r in repeated.tolist():
+            self.errors.append([str(r), comp1, comp2, description])
         return len(repeated)
 
     def conflict4(self, comp1, table1, cell_1, comp2, table2, cell_2, description):
@@ -2599,42 +2457,7 @@ class CurrentConflictsDialog(qtBaseClass, uiDialog):
         cond6 = (comp1 == self.issue1 and comp2 in self.issue2) or (comp2 == self.issue1 and comp1 in self.issue2)
 
         if cond1 or cond2 or cond3 or cond4 or cond5 or cond6:
-            repeated = []
-
-            if table1 == table2 and cell_1 == cell_2:
-                sql = """SELECT {0}, COUNT(*) 
-                        FROM {1} 
-                        GROUP BY {0}
-                        HAVING COUNT(*) > 1 ORDER BY {0}
-                    """.format(
-                    cell_1, table1
-                )
-
-            else:
-                sql = """SELECT {0} FROM {1} 
-                WHERE {0} IN 
-                (
-                    SELECT {0}
-                    FROM {1}
-                    INTERSECT
-                    SELECT {2}
-                    FROM {3}
-                ) ORDER BY {0}""".format(
-                    cell_1, table1, cell_2, table2
-                )
-
-            rows = self.gutils.execute(sql).fetchall()
-
-            if not rows:
-                pass
-            else:
-                size = len(rows)
-                for i in range(size):
-                    if rows[i][0] not in repeated:
-                        repeated.append(rows[i][0])
-            if repeated:
-                for r in repeated:
-                    self.errors.append([str(r), comp1, comp2, description])
+            self.add_engine_conflict((table1, cell_1), (table2, cell_2), comp1, comp2, description)
 
     def InletsConflicts(self):
         cond1 = self.issue1 == "All" and self.issue2 == "All"
@@ -2647,179 +2470,56 @@ class CurrentConflictsDialog(qtBaseClass, uiDialog):
         )
 
         if cond1 or cond2 or cond3 or cond4 or cond5 or cond6:
-            repeated = []
-
-            sql = """SELECT swmm_jt, COUNT(*) 
-                    FROM  swmmflo WHERE SUBSTRING(swmm_iden, 1, 1) LIKE "I%"
-                    GROUP BY swmm_jt
-                    HAVING COUNT(*) > 1 ORDER BY swmm_jt
-                """
-
-            # sql = """SELECT {0}, COUNT(*)
-            #         FROM {1}
-            #         GROUP BY {0}
-            #         HAVING COUNT(*) > 1 ORDER BY {0}
-            #     """.format("swmm_jt", "swmmflo")
+            inlets = ("swmmflo", "swmm_jt", 'SUBSTRING(swmm_iden, 1, 1) LIKE "I%"')
+            self.add_engine_conflict(
+                inlets,
+                inlets,
+                "Storm Drain Inlets",
+                "Storm Drain Inlets",
+                "2 or more Storm Drain Inlets in same cell",
+            )
 
-            rows = self.gutils.execute(sql).fetchall()
+    def add_engine_conflict(self, source1, source2, comp1, comp2, description):
+        """
+        Register pair of sources in the conflicts engine together with the current position in the errors list.
+        """
+        position = len(self.errors)
+        self.conflicts_engine.add_pair(source1, source2, (position, comp1, comp2, description))
 
-            if not rows:
-                pass
-            else:
-                size = len(rows)
-                for i in range(size):
-                    if rows[i][0] not in repeated:
-                        repeated.append(rows[i][0])
-            if repeated:
-                for r in repeated:
-                    self.errors.append(
-                        [
-                            str(r),
-                            "Storm Drain Inlets",
-                            "Storm Drain Inlets",
-                            "2 or more Storm Drain Inlets in same cell",
-                        ]
-                    )
+    def insert_engine_conflicts(self):
+        """
+        Evaluate the registered pairs in one pass and insert their errors where the checks were called.
+        """
+        found = []
+        for (position, comp1, comp2, description), cells in self.conflicts_engine.evaluate():
+            found.append((position, [[str(r), comp1, comp2, description] for r in cells.tolist()]))
+        for position, rows in reversed(found):
+            self.errors[position:position] = rows
+        self.conflicts_engine.clear()
+
+    def arf_conflict(self, table, column, arf_condition):
+        qry = """SELECT DISTINCT c.{1} FROM {0} AS c
+                 JOIN blocked_cells AS b ON b.grid_fid = c.{1}
+                 WHERE CAST(b.arf AS REAL) {2}
+                 ORDER BY c.{1};""".format(
+            table, column, arf_condition
+        )
+        return [row[0] for row in self.gutils.execute(qry)]
 
     def conflict_inflow_partialARF(self):
-        in_cells = []
-        ARF_cells = []
-        repeated = []
-        inf = "SELECT grid_fid FROM inflow_cells"
-        ARF = "SELECT grid_fid, arf FROM blocked_cells"
-        in_rows = self.gutils.execute(inf).fetchall()
-        ARF_rows = self.gutils.execute(ARF).fetchall()
-        if not in_rows or not ARF_rows:
-            return repeated
-        else:
-            for row in in_rows:
-                in_cells.append(row)
-            for row in ARF_rows:
-                ARF_cells.append(row)
-            in_size = len(in_cells)
-            ARF_size = len(ARF_cells)
-            for i in range(in_size):
-                for j in range(ARF_size):
-                    if (
-                        in_cells[i][0] == ARF_cells[j][0]
-                        and float(ARF_cells[j][1]) < 1.0
-                        and in_cells[i][0] not in repeated
-                    ):
-                        repeated.append(in_cells[i][0])
-                        break
-            return repeated
+        return self.arf_conflict("inflow_cells", "grid_fid", "< 1.0")
 
     def conflict_outflow_partialARF(self):
-        out_cells = []
-        ARF_cells = []
-        repeated = []
-        outf = "SELECT grid_fid FROM outflow_cells"
-        ARF = "SELECT grid_fid, arf FROM blocked_cells"
-        out_rows = self.gutils.execute(outf).fetchall()
-        ARF_rows = self.gutils.execute(ARF).fetchall()
-        if not out_rows or not ARF_rows:
-            return repeated
-        else:
-            for row in out_rows:
-                out_cells.append(row)
-            for row in ARF_rows:
-                ARF_cells.append(row)
-            in_size = len(out_cells)
-            ARF_size = len(ARF_cells)
-            for i in range(in_size):
-                for j in range(ARF_size):
-                    if (
-                        out_cells[i][0] == ARF_cells[j][0]
-                        and float(ARF_cells[j][1]) < 1.0
-                        and out_cells[i][0] not in repeated
-                    ):
-                        repeated.append(out_cells[i][0])
-                        break
-            return repeated
+        return self.arf_conflict("outflow_cells", "grid_fid", "< 1.0")
 
     def conflict_outfall_partialARF(self):
-        out_cells = []
-        ARF_cells = []
-        repeated = []
-        outf = "SELECT grid_fid FROM swmmoutf"
-        ARF = "SELECT grid_fid, arf FROM blocked_cells"
-        out_rows = self.gutils.execute(outf).fetchall()
-        ARF_rows = self.gutils.execute(ARF).fetchall()
-        if not out_rows or not ARF_rows:
-            return repeated
-        else:
-            for row in out_rows:
-                out_cells.append(row)
-            for row in ARF_rows:
-                ARF_cells.append(row)
-            in_size = len(out_cells)
-            ARF_size = len(ARF_cells)
-            for i in range(in_size):
-                for j in range(ARF_size):
-                    if (
-                        out_cells[i][0] == ARF_cells[j][0]
-                        and float(ARF_cells[j][1]) < 1.0
-                        and out_cells[i][0] not in repeated
-                    ):
-                        repeated.append(out_cells[i][0])
-                        break
-            return repeated
+        return self.arf_conflict("swmmoutf", "grid_fid", "< 1.0")
 
     def conflict_inlet_partialARF(self):
-        out_cells = []
-        ARF_cells = []
-        repeated = []
-        outf = "SELECT swmm_jt FROM swmmflo"
-        ARF = "SELECT grid_fid, arf FROM blocked_cells"
-        out_rows = self.gutils.execute(outf).fetchall()
-        ARF_rows = self.gutils.execute(ARF).fetchall()
-        if not out_rows or not ARF_rows:
-            return repeated
-        else:
-            for row in out_rows:
-                out_cells.append(row)
-            for row in ARF_rows:
-                ARF_cells.append(row)
-            in_size = len(out_cells)
-            ARF_size = len(ARF_cells)
-            for i in range(in_size):
-                for j in range(ARF_size):
-                    if (
-                        out_cells[i][0] == ARF_cells[j][0]
-                        and float(ARF_cells[j][1]) < 1.0
-                        and out_cells[i][0] not in repeated
-                    ):
-                        repeated.append(out_cells[i][0])
-                        break
-            return repeated
+        return self.arf_conflict("swmmflo", "swmm_jt", "< 1.0")
 
     def conflict_outflow_fullARF(self):
-        out_cells = []
-        ARF_cells = []
-        repeated = []
-        outf = "SELECT grid_fid FROM outflow_cells"
-        ARF = "SELECT grid_fid, arf FROM blocked_cells"
-        out_rows = self.gutils.execute(outf).fetchall()
-        ARF_rows = self.gutils.execute(ARF).fetchall()
-        if not out_rows or not ARF_rows:
-            return repeated
-        else:
-            for row in out_rows:
-                out_cells.append(row)
-            for row in ARF_rows:
-                ARF_cells.append(row)
-            in_size = len(out_cells)
-            ARF_size = len(ARF_cells)
-            for i in range(in_size):
-                for j in range(ARF_size):
-                    if (
-                        out_cells[i][0] == ARF_cells[j][0]
-                        and float(ARF_cells[j][1]) == 1.0
-                        and out_cells[i][0] not in repeated
-                    ):
-                        repeated.append(out_cells[i][0])
-                        break
-            return repeated
+        return self.arf_conflict("outflow_cells", "grid_fid", "= 1.0")
 
 
 uiDialog, qtBaseClass = load_ui("levee_crests")
@@ -2990,9 +2690,8 @@ class LeveeCrestsDialog(qtBaseClass, uiDialog):
     def populate_elements_cbo(self):
         self.elements_cbo.clear()
         self.elements_cbo.addItem("All ")
-        for x in self.levee_crests:
-            if self.elements_cbo.findText(str(x[1])) == -1:
-                self.elements_cbo.addItem(str(x[1]))
+        elements = dict.fromkeys(str(x[1]) for x in self.levee_crests)
+        self.elements_cbo.addItems(list(elements))
         self.elements_cbo.model().sort(1)
 
     def populate_errors_cbo(self):
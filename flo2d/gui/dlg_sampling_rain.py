@@ -8,13 +8,13 @@
 # as published by the Free Software Foundation; either version 2
 # of the License, or (at your option) any later version
 import os
-from subprocess import PIPE, STDOUT, Popen
 
 from qgis.core import QgsRasterLayer
 from qgis.PyQt.QtCore import QSettings
 from qgis.PyQt.QtWidgets import QFileDialog
 
-from ..flo2d_tools.grid_tools import grid_has_empty_elev, raster2grid
+from ..flo2d_tools.grid_tools import grid_has_empty_elev
+from ..flo2d_tools.raster_sampling import resample_raster_to_grid
 from ..geopackage_utils import GeoPackageUtils
 from ..user_communication import UserCommunication
 from .ui_utils import load_ui
@@ -128,56 +128,19 @@ class SamplingRainDialog(qtBaseClass, uiDialog):
         Resample raster to be aligned with the grid, then probe values and update elements elevation attr.
         """
         self.src_raster = self.srcRasterCbo.itemData(self.srcRasterCbo.currentIndex())
-        self.out_raster = "{}_interp.tif".format(self.src_raster[:-4])
-        try:
-            if os.path.isfile(self.out_raster):
-                os.remove(self.out_raster)
-        except OSError:
-            msg = "WARNING 060319.1652: Couldn't remove existing raster:\n{}\nChoose another filename.".format(
-                self.out_raster
-            )
-            self.uc.show_warn(msg)
-            return False
         self.get_worp_opts_data()
-        opts = [
-            "-of GTiff",
-            "-ot {}".format(self.RTYPE[self.raster_type]),
-            "-tr {0} {0}".format(self.cell_size),
-            "-te {}".format(" ".join([str(c) for c in self.output_bounds])),
-            '-te_srs "{}"'.format(self.out_srs),
-            "-dstnodata {}".format(self.src_nodata),
-            "-r {}".format(self.algCbo.itemData(self.algCbo.currentIndex())),
-            "-co COMPRESS=LZW",
-            "-wo OPTIMIZE_SIZE=TRUE",
-        ]
-
-        if len(self.src_srs) > 0:
-            opts.append('-s_srs "{}"'.format(self.src_srs))
-        if len(self.out_srs) > 0:
-            opts.append('-t_srs "{}"'.format(self.out_srs))
-
-        if self.multiThreadChBox.isChecked():
-            opts.append("-multi -wo NUM_THREADS=ALL_CPUS")
-        else:
-            pass
-        cmd = 'gdalwarp {} "{}" "{}"'.format(" ".join([opt for opt in opts]), self.src_raster, self.out_raster)
-        proc = Popen(
-            cmd,
-            shell=True,
-            stdin=open(os.devnull),
-            stdout=PIPE,
-            stderr=STDOUT,
-            universal_newlines=True,
+        fill_distance = self.radiusSBox.value() if self.fillNoDataChBox.isChecked() else None
+        sampler = resample_raster_to_grid(
+            self.gutils,
+            self.src_raster,
+            self.algCbo.itemData(self.algCbo.currentIndex()),
+            self.src_srs,
+            self.out_srs,
+            self.src_nodata,
+            self.RTYPE.get(self.raster_type),
+            self.multiThreadChBox.isChecked(),
+            fill_distance,
         )
-        out = proc.communicate()
-        for line in out:
-            self.uc.log_info(line)
-        # Fill NODATA raster cells if desired
-        if self.fillNoDataChBox.isChecked():
-            self.fill_nodata()
-        else:
-            pass
-        sampler = raster2grid(self.grid, self.out_raster)
 
         qry = """INSERT INTO rain_arf_cells (arf, grid_fid) VALUES (?,?);"""
         self.con.executemany(qry, sampler)
@@ -189,21 +152,6 @@ class SamplingRainDialog(qtBaseClass, uiDialog):
         self.con.commit()
         return True
 
-    def fill_nodata(self):
-        opts = ["-md {}".format(self.radiusSBox.value())]
-        cmd = 'gdal_fillnodata {} "{}"'.format(" ".join([opt for opt in opts]), self.out_raster)
-        proc = Popen(
-            cmd,
-            shell=True,
-            stdin=open(os.devnull),
-            stdout=PIPE,
-            stderr=STDOUT,
-            universal_newlines=True,
-        )
-        out = proc.communicate()
-        for line in out:
-            self.uc.log_info(line)
-
     def show_probing_result_info(self):
         null_nr = grid_has_empty_elev(self.gutils)
         if null_nr:
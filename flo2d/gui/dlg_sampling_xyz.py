@@ -13,25 +13,22 @@ import stat
 import sys
 import time
 import traceback
+from concurrent.futures import FIRST_COMPLETED, wait
 from pickle import TRUE
 
+import numpy as np
 from plugins.processing.tools.vector import values
 from qgis.core import (
     Qgis,
-    QgsFeature,
     QgsFeatureRequest,
-    QgsField,
     QgsFields,
-    QgsGeometry,
     QgsMarkerSymbol,
     QgsPointXY,
-    QgsProject,
     QgsVectorFileWriter,
-    QgsVectorLayer,
     QgsWkbTypes,
 )
 from qgis.PyQt import QtCore, QtGui
-from qgis.PyQt.QtCore import QObject, QSettings, Qt, QVariant, pyqtSignal
+from qgis.PyQt.QtCore import QCoreApplication, QEventLoop, QObject, QSettings, Qt, QThread, pyqtSignal
 from qgis.PyQt.QtWidgets import (
     QApplication,
     QFileDialog,
@@ -44,16 +41,22 @@ from qgis.PyQt.QtWidgets import (
 )
 
 from ..errors import Flo2dError
+from ..flo2d_tools.grid_index import cached_grid_index
 from ..flo2d_tools.grid_tools import (
-    ZonalStatistics,
-    adjacent_average_elevation,
     adjacent_grid_elevations,
     cell_centroid,
     cell_elevation,
     fid_from_grid,
+    fill_grid_nodata,
     number_of_elements,
     render_grid_elevations2,
 )
+from ..flo2d_tools.lidar_binning import (
+    LidarBins,
+    bin_lidar_range,
+    lidar_process_pool,
+    lidar_tasks,
+)
 from ..geopackage_utils import GeoPackageUtils
 from ..user_communication import UserCommunication
 from ..utils import (
@@ -63,7 +66,6 @@ from ..utils import (
     get_min_max_elevs,
     grid_index,
     is_grid_index,
-    second_smallest,
     set_grid_index,
     set_min_max_elevs,
     time_taken,
@@ -147,122 +149,69 @@ class SamplingXYZDialog(qtBaseClass, uiDialog):
 
         try:
             QApplication.setOverrideCursor(Qt.WaitCursor)
-            elevs = {}
             read_error = "Error reading files:\n\n"
-            outside_grid, inside_grid = 0, 0
-
-            gid_indx = {}
-            cells = self.gutils.execute("SELECT fid, col, row FROM grid").fetchall()
-            for cell in cells:
-                gid_indx[cell[1], cell[2]] = [cell[0], 0.0, 0]
 
             start_time = time.time()
 
+            worker = LIDARWorker(self.iface, lidar_files, self.lyrs)
+
             statBar = self.iface.mainWindow().statusBar()
             statusLabel = QLabel()
             statBar.addWidget(statusLabel, 5)
             advanceBar = QProgressBar()
             advanceBar.setStyleSheet("QProgressBar::chunk { background-color: lightskyblue}")
             advanceBar.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
-            advanceBar.setMinimum(0)
+            advanceBar.setRange(0, 100)
             statBar.addWidget(advanceBar, 2)
-
-            size = 0
-            lines = 0
-            for file in lidar_files:
-                file_size = os.path.getsize(file)
-                with open(file, "r") as f:
-                    line = f.readline()
-
-                    line_size = len(line) + 1
-                size += file_size / line_size
-
-            progress = self.uc.progress_bar2(
-                "Reading " + "{:,}".format(int(size)) + " lines from " + str(len(lidar_files)) + " files...",
-                0,
-                len(lidar_files),
-                0,
+            cancelButton = QPushButton("Cancel")
+            cancelButton.clicked.connect(worker.THREAD_kill)
+            statBar.addWidget(cancelButton)
+
+            size = sum(os.path.getsize(file) for file in lidar_files)
+            statusLabel.setText(
+                "Reading  "
+                + "{:,}".format(int(size / 1048576))
+                + "  MB from "
+                + "<FONT COLOR=blue>"
+                + str(len(lidar_files))
+                + "</FONT>"
+                + " files using "
+                + str(worker.max_workers)
+                + " processes"
             )
-            step = 50000
-            for i, file in enumerate(lidar_files, 1):
-                progress.setValue(i)
-                n_commas = 0
-                n_spaces = 0
-
-                # See if comma or space delimited:
-                with open(file, "r") as f:
-                    while True:
-                        line = f.readline()
-                        line = line.replace("\t", "")
-                        if line.strip() != "":
-                            n_commas = line.count(",")
-                            if n_commas == 0:
-                                n_spaces = len(line.split())
-                            break
-
-                if n_commas != 0 or n_spaces != 0:
-                    # Read file:
-                    with open(file, "r") as f1:
-                        try:
-                            lines = f1.readlines()
-                            n_lines = len(lines)
-                            statusLabel.setText(
-                                "Reading  "
-                                + "{:,}".format(n_lines)
-                                + "  lines from "
-                                + "<FONT COLOR=blue>"
-                                + os.path.basename(file)
-                                + "</FONT>"
-                            )
-                            advanceBar.setMaximum(n_lines)
-
-                            step = int(n_lines / 20)
-
-                            if n_lines > step:
-                                advanceBar.setValue(int(step / 2))
-                                # self.iface.mainWindow().repaint()
-
-                            for i, line in enumerate(lines, 1):
-                                if int(i % step) == 0:
-                                    advanceBar.setValue(i)
-                                    qApp.processEvents()
-
-                                line = line.replace("\t", "")
-                                if n_commas == 0:  # No commas, values separated by spaces.
-                                    values = line.split()
-                                    n_values = len(values)
-                                    if n_values == 3:
-                                        xpp, ypp, zpp = values
-                                    elif n_values == 4:
-                                        xpp, ypp, zpp, dummy = values
-                                    elif n_values == 5:
-                                        dummy1, xpp, ypp, zpp, dummy2 = values
-                                    else:
-                                        break
-                                elif n_commas == 2:  # 3 columns.
-                                    xpp, ypp, zpp = line.split(",")
-                                elif n_commas == 3:  # 4 columns.
-                                    xpp, ypp, zpp, dummy = line.split(",")
-                                elif n_commas == 4:  # 5 columns.
-                                    dummy1, xpp, ypp, zpp, dummy2 = line.split(",")
-                                else:
-                                    break
-
-                                col = int((float(xpp) - self.xMinimum) / self.cell_size) + 2
-                                row = int((float(ypp) - self.yMinimum) / self.cell_size) + 2
-                                if (col, row) in gid_indx:
-                                    gid_indx[col, row][1] += float(zpp)
-                                    gid_indx[col, row][2] += 1
-                                    inside_grid += 1
-                                else:
-                                    outside_grid += 1
-
-                        except ValueError:
-                            read_error += os.path.basename(file) + " at line " + str(i) + "\n\n"
+            worker.THREAD_progrss.connect(lambda value: advanceBar.setValue(int(value)))
+            worker_errors = []
+            worker.THREAD_error.connect(lambda e, exception_string: worker_errors.append(e))
+
+            # Bin the files on a worker thread and keep the GUI responsive until it finishes:
+            thread = QThread()
+            worker.moveToThread(thread)
+            loop = QEventLoop()
+            worker.THREAD_finished.connect(loop.quit)
+            thread.started.connect(worker.run)
+            thread.start()
+            loop.exec_()
+            thread.quit()
+            thread.wait()
 
-            self.uc.clear_bar_messages()
             statBar.removeWidget(statusLabel)
             statBar.removeWidget(advanceBar)
+            statBar.removeWidget(cancelButton)
+            if worker_errors:
+                raise worker_errors[0]
+            if worker.THREAD_killed or worker.bins is None:
+                self.uc.clear_bar_messages()
+                QApplication.restoreOverrideCursor()
+                if worker.THREAD_killed:
+                    self.uc.bar_warn("Reading LIDAR files cancelled!")
+                return
+
+            grid_idx, bins = worker.grid_idx, worker.bins
+            for file, error in worker.read_errors.items():
+                read_error += os.path.basename(file) + " " + error + "\n\n"
+            inside_grid, outside_grid = bins.inside, bins.outside
+
+            self.uc.clear_bar_messages()
             qApp.processEvents()
             self.uc.bar_info("Updating grid elevations...")
 
@@ -275,12 +224,17 @@ class SamplingXYZDialog(qtBaseClass, uiDialog):
 
             if inside_grid > 0:
                 qry = "UPDATE grid SET elevation = ? WHERE fid = ?;"
-                for gi in gid_indx.items():
-                    if gi[1][2] != 0:
-                        elevation = round(gi[1][1] / gi[1][2], 4)
-                        cell_elev.append((elevation, gi[1][0]))
-                    else:
-                        nope.append((gi[1][0], gi[0][0], gi[0][1]))  # element, col, row
+                means, counts = bins.cell_values(grid_idx)
+                assigned = counts > 0
+                elevations = np.round(means[assigned], 4)
+                cell_elev = list(zip(elevations.tolist(), grid_idx.fid[assigned].tolist()))
+                nope = list(
+                    zip(
+                        grid_idx.fid[~assigned].tolist(),
+                        grid_idx.col[~assigned].tolist(),
+                        grid_idx.row[~assigned].tolist(),
+                    )
+                )  # element, col, row
                 self.gutils.execute_many(qry, cell_elev)
 
             self.uc.clear_bar_messages()
@@ -377,85 +331,21 @@ class SamplingXYZDialog(qtBaseClass, uiDialog):
                     adjacent = []
 
                     if dlg.interpolate_radio.isChecked():
-                        for lyr in QgsProject.instance().mapLayers().values():
-                            if lyr.name() == "Cell elevations from LIDAR":
-                                QgsProject.instance().removeMapLayers([lyr.id()])
-
-                        epsg = self.grid.crs().authid()
-                        vl = QgsVectorLayer(
-                            "{}?crs={}".format("Point", epsg),
-                            "Cell elevations from LIDAR",
-                            "memory",
-                        )
-                        pr = vl.dataProvider()
-                        # add fields
-                        pr.addAttributes(
-                            [
-                                QgsField("elevation", QVariant.Double),
-                                QgsField("grid", QVariant.Int),
-                            ]
-                        )
-                        vl.updateFields()  # tell the vector layer to fetch changes from the provider
-                        # Enter editing mode
-                        vl.startEditing()
-                        for item in assigned:
-                            fet = QgsFeature()
-                            pnt = self.gutils.single_centroid(item[1])
-                            pt = QgsGeometry().fromWkt(pnt).asPoint()
-                            if pt.x is not None and pt.y is not None:
-                                fet.setGeometry(QgsGeometry().fromPointXY(pt))
-                                fet.setAttributes([item[0], item[1]])
-                                pr.addFeatures([fet])
-
-                        vl.commitChanges()
-                        QgsProject.instance().addMapLayer(vl)
-
-                        QApplication.setOverrideCursor(Qt.WaitCursor)
-                        elevs = [x[0] for x in assigned]
-                        mini = -9999
-                        mini2 = min(elevs)
-                        maxi = max(elevs)
-                        render_grid_elevations2(vl, True, mini, mini2, maxi)
-                        self.lyrs.lyrs_to_repaint = [vl]
-                        self.lyrs.repaint_layers()
-
-                        QApplication.restoreOverrideCursor()
-
-                        # $$$$$$$$$$$$$$$$$$$$$$$
-                        zfield = "elevation"
-                        calc_type = "Mean"
                         search_distance = dlg.search_distance_sbox.value()
 
                         try:
                             ini_time = time.time()
                             QApplication.setOverrideCursor(Qt.WaitCursor)
-                            zs = ZonalStatistics(
-                                self.gutils,
-                                self.grid,
-                                vl,
-                                zfield,
-                                calc_type,
-                                search_distance,
-                            )
-                            points_elevation = zs.points_elevation()
-                            zs.set_elevation(points_elevation)
-                            cmd, out = zs.rasterize_grid()
-                            self.uc.log_info(cmd)
-                            self.uc.log_info(out)
-                            cmd, out = zs.fill_nodata()
-                            self.uc.log_info(cmd)
-                            self.uc.log_info(out)
-                            null_elevation = zs.null_elevation()
-                            zs.set_elevation(null_elevation)
-                            zs.remove_rasters()
+                            filled, remaining = fill_grid_nodata(self.gutils, -9999, search_distance)
+                            adjacent = filled.tolist()
+                            nope = [(fid, None, None) for fid in remaining.tolist()]
 
                             self.gutils.execute("UPDATE grid SET elevation = -9999 WHERE elevation IS NULL;")
-                            elevs = [x[0] for x in self.gutils.execute("SELECT elevation FROM grid").fetchall()]
-                            # elevs = [x if x is not None else -9999 for x in elevs]
-                            if elevs:
-                                mini = min(elevs)
-                                mini2 = second_smallest(elevs)
-                                maxi = max(elevs)
+                            elevs = cached_grid_index(self.gutils).elevation
+                            if elevs.size:
+                                mini = float(elevs.min())
+                                mini2 = float(np.unique(elevs)[:2][-1])
+                                maxi = float(elevs.max())
                                 render_grid_elevations2(self.grid, True, mini, mini2, maxi)
                                 set_min_max_elevs(mini, maxi)
                                 self.lyrs.lyrs_to_repaint = [self.grid]
@@ -466,48 +356,23 @@ class SamplingXYZDialog(qtBaseClass, uiDialog):
                             fin_time = time.time()
                             duration = time_taken(ini_time, fin_time)
                             self.uc.show_info(
-                                "Calculating elevation finished." + "\n\n(Elapsed time: " + duration + ")"
+                                "Elevation to "
+                                + "{0:,d}".format(len(adjacent))
+                                + " non-interpolated cells were assigned from adjacent elevations."
+                                + "\n\n(Elapsed time: "
+                                + duration
+                                + ")"
                             )
-
-                            break
+                            if not nope:
+                                break
 
                         except Exception as e:
                             QApplication.restoreOverrideCursor()
                             self.uc.log_info(traceback.format_exc())
                             self.uc.show_error(
-                                "ERROR 060319.1712: Calculating grid elevation aborted! Please check elevation points layer.\n",
+                                "ERROR 060319.1712: Calculating grid elevation aborted! Please check grid elevations.\n",
                                 e,
                             )
-                    # &&&&&&&&&&&&&&&&&&&&&&&&
-
-                    # ini_time = time.time()
-                    # QApplication.setOverrideCursor(Qt.WaitCursor)
-                    #
-                    # for this_cell in nope:
-                    #
-                    #     xx = self.xMinimum + (this_cell[1]-2)*self.cell_size + self.cell_size/2
-                    #     yy = self.yMinimum + (this_cell[2]-2)*self.cell_size + self.cell_size/2
-                    #
-                    #     avrg = adjacent_average_elevation(self.gutils, self.grid, xx, yy, self.cell_size)
-                    #     if avrg != -9999:
-                    #         qry_values.append((avrg, this_cell[0]))
-                    #         adjacent.append(this_cell[0])
-                    #
-                    # self.gutils.execute_many(update_qry, qry_values)
-                    #
-                    # nope = [i for i in nope if i[0] not in adjacent]
-                    #
-                    # QApplication.restoreOverrideCursor()
-                    # fin_time = time.time()
-                    #
-                    # duration = time_taken(ini_time, fin_time)
-                    #
-                    # self.lyrs.lyrs_to_repaint = [self.grid]
-                    # self.lyrs.repaint_layers()
-                    #
-                    # self.uc.show_info("Elevation to " + '{0:,d}'.format(len(qry_values)) + " non-interpolated cells were assigned from adjacent elevations." +
-                    #                   "\n\n There are still " + '{0:,d}'.format(len(nope)) + " non-interpolated cells."
-                    #                    "\n\n(Elapsed time: " + duration + ")")
 
                     elif dlg.assign_radio.isChecked():
                         ini_time = time.time()
@@ -572,15 +437,6 @@ class SamplingXYZDialog(qtBaseClass, uiDialog):
             self.uc.show_error("ERROR 030521.0848: failed to process non-interpolated cells!", e)
             return
 
-    def adjacent_elev(self, x, y):
-        elev = 0
-        elem = self.gutils.grid_on_point(x, y)
-        if elem is not None:
-            altitude = self.gutils.execute("SELECT elevation FROM grid WHERE fid = ?;", (elem,)).fetchone()[0]
-            if altitude != -9999:
-                elev = altitude
-        return elev
-
     def check_LIDAR_file(self, file):
         file_name, file_ext = os.path.splitext(os.path.basename(file))
         error0 = ""
@@ -610,9 +466,16 @@ class SamplingXYZDialog(qtBaseClass, uiDialog):
 
 
 class LIDARWorker(QObject):
-    def __init__(self, iface, lidar_files, lyrs):
+    """
+    Bins LIDAR files into grid cells. Byte ranges of the files are processed by a pool of processes
+    and their partial aggregates are merged into 'bins'.
+    The grid index is read on the creating thread, so 'run' doesn't touch the GeoPackage and can be moved to a QThread.
+    """
+
+    def __init__(self, iface, lidar_files, lyrs, max_workers=None):
         QObject.__init__(self)
         self.lidar_files = lidar_files
+        self.max_workers = max_workers or os.cpu_count() or 1
         self.THREAD_killed = False
 
         self.iface = iface
@@ -620,8 +483,13 @@ class LIDARWorker(QObject):
         self.uc = UserCommunication(iface, "FLO-2D")
         self.con = None
         self.gutils = None
+        self.grid_idx = None
+        self.bins = None
+        self.read_errors = {}
 
         self.setup_connection()
+        if self.gutils is not None:
+            self.grid_idx = cached_grid_index(self.gutils)
 
     def setup_connection(self):
         con = self.iface.f2d["con"]
@@ -633,80 +501,71 @@ class LIDARWorker(QObject):
 
     def run(self):
         try:
-            THREAD_progress_count = 0
-            n_files = len(self.lidar_files)
-            for i, file in enumerate(self.lidar_files, 1):
-                if self.THREAD_killed is True:
-                    # kill request received, exit loop early
-                    break
-                time.sleep(0.2)  # simulate a more time consuming task
-                # increment progrss
-                THREAD_progress_count += 1
-                self.THREAD_progrss.emit(THREAD_progress_count * 100 / n_files)
-
-                n_commas = 0
-                n_spaces = 0
-
-                #                 err0, err1 = self.check_LIDAR_file(file)
-                #                 if err0 == "" and err1 == "" :
-
-                # See if comma or space delimited:
-                with open(file, "r") as f:
-                    while True:
-                        line = f.readline()
-                        line = line.replace("\t", "")
-                        if line.strip() != "":
-                            n_commas = line.count(",")
-                            if n_commas == 0:
-                                n_spaces = len(line.split())
-                            break
-
-                if n_commas != 0 or n_spaces != 0:
-                    # Read file:
-
-                    with open(file, "r") as f1:
-                        try:
-                            k = 0
-                            for line in f1:
-                                line = line.replace("\t", "")
-                                if n_commas == 0:  # No commas, values separated by spaces.
-                                    values = line.split()
-                                    n_values = len(values)
-                                    if n_values == 3:
-                                        xpp, ypp, zpp = values
-                                    elif n_values == 4:
-                                        xpp, ypp, zpp, dummy = values
-                                    elif n_values == 5:
-                                        dummy1, xpp, ypp, zpp, dummy2 = values
-                                    else:
-                                        break
-                                elif n_commas == 2:  # 3 columns.
-                                    xpp, ypp, zpp = line.split(",")
-                                elif n_commas == 3:  # 4 columns.
-                                    xpp, ypp, zpp, dummy = line.split(",")
-                                elif n_commas == 4:  # 5 columns.
-                                    dummy1, xpp, ypp, zpp, dummy2 = line.split(",")
-                                else:
-                                    break
-
-                        except ValueError:
-                            read_error += os.path.basename(file) + "\n\n"
-
+            self.bins = LidarBins.from_grid_index(self.grid_idx)
+            tasks = lidar_tasks(self.lidar_files)
+            if self.max_workers == 1 or len(tasks) == 1:
+                self.run_sequential(tasks)
+            else:
+                self.run_pool(tasks)
             if self.THREAD_killed is False:
                 self.THREAD_progrss.emit(100)
 
         except Exception as e:
             # forward the exception upstream
             self.THREAD_error.emit(e, traceback.format_exc())
-            self.uc.show_error("ERROR 140321.1653: importing LIDAR files failed!", e)
 
         self.THREAD_finished.emit()
 
+    def run_sequential(self, tasks):
+        total = sum(end - start for path, start, end in tasks) or 1
+        done = [0]
+
+        def block_read(nbytes):
+            done[0] += nbytes
+            self.THREAD_progrss.emit(done[0] * 100 / total)
+            QCoreApplication.processEvents()
+            return self.THREAD_killed
+
+        for path, start, end in tasks:
+            first_invalid = self.bins.add_file(path, start=start, end=end, progress=block_read)
+            self.add_read_error(path, start, first_invalid)
+            if self.THREAD_killed is True:
+                break
+
+    def run_pool(self, tasks):
+        total = sum(end - start for path, start, end in tasks) or 1
+        done = 0
+        executor = lidar_process_pool(self.bins, min(self.max_workers, len(tasks)))
+        try:
+            pending = {executor.submit(bin_lidar_range, *task): task for task in tasks}
+            while pending:
+                finished, __ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, start, end = pending.pop(future)
+                    partial, first_invalid = future.result()
+                    self.bins.merge_partial(partial)
+                    self.add_read_error(path, start, first_invalid)
+                    done += end - start
+                    self.THREAD_progrss.emit(done * 100 / total)
+                QCoreApplication.processEvents()
+                if self.THREAD_killed is True:
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def add_read_error(self, path, start, first_invalid):
+        if first_invalid is None or path in self.read_errors:
+            return
+        if start == 0:
+            self.read_errors[path] = "at line " + str(first_invalid)
+        else:
+            self.read_errors[path] = "at line " + str(first_invalid) + " after byte " + "{:,}".format(start)
+
     def THREAD_kill(self):
         self.THREAD_killed = True
 
     THREAD_finished = QtCore.pyqtSignal()
-    THREAD_error = QtCore.pyqtSignal(Exception, basestring)
+    THREAD_error = QtCore.pyqtSignal(Exception, str)
     THREAD_progrss = QtCore.pyqtSignal(float)
 
 
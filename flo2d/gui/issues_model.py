@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+import numpy as np
+from qgis.PyQt.QtCore import QAbstractTableModel, QModelIndex, Qt
+from qgis.PyQt.QtGui import QFont
+
+
+def _to_int(value, default=-1):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class IssuesIndex(object):
+    """
+    Index over the list of [cell, code, description] issues, keyed by error code and cell.
+    Issues appended to the list after the last build are indexed on the next query.
+    """
+
+    def __init__(self, issues):
+        self.issues = issues
+        self.size = 0
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.codes = np.zeros(0, dtype=np.int64)
+        self.by_code = np.zeros(0, dtype=np.int64)
+        self.by_cell = np.zeros(0, dtype=np.int64)
+
+    def update(self):
+        if self.size == len(self.issues):
+            return
+        new_issues = self.issues[self.size :]
+        new_cells = np.fromiter((_to_int(str(i[0]).strip()) for i in new_issues), dtype=np.int64, count=len(new_issues))
+        new_codes = np.fromiter((_to_int(str(i[1]).strip()) for i in new_issues), dtype=np.int64, count=len(new_issues))
+        self.cells = np.concatenate([self.cells, new_cells])
+        self.codes = np.concatenate([self.codes, new_codes])
+        self.by_code = np.argsort(self.codes, kind="stable")
+        self.by_cell = np.argsort(self.cells, kind="stable")
+        self.size = len(self.issues)
+
+    def all_rows(self):
+        self.update()
+        return np.arange(self.size, dtype=np.int64)
+
+    def code_rows(self, first, last=None):
+        """
+        Return rows of issues with codes between 'first' and 'last' (inclusive) in order of reading.
+        """
+        self.update()
+        last = first if last is None else last
+        sorted_codes = self.codes[self.by_code]
+        start = np.searchsorted(sorted_codes, first, side="left")
+        end = np.searchsorted(sorted_codes, last, side="right")
+        return np.sort(self.by_code[start:end])
+
+    def cell_rows(self, cell):
+        """
+        Return rows of issues for the cell in order of reading.
+        """
+        self.update()
+        sorted_cells = self.cells[self.by_cell]
+        start = np.searchsorted(sorted_cells, cell, side="left")
+        end = np.searchsorted(sorted_cells, cell, side="right")
+        return self.by_cell[start:end]
+
+    def unique_codes(self):
+        self.update()
+        return np.unique(self.codes)
+
+
+class IssuesTableModel(QAbstractTableModel):
+    """
+    Read only model showing subset of issues (given by rows of IssuesIndex) without creating any item widgets.
+    """
+
+    HEADERS = ["Element", "Error Code", "Description"]
+
+    def __init__(self, issues, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.issues = issues
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.header_font = QFont()
+        self.header_font.setBold(True)
+        self.header_font.setItalic(True)
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else int(self.rows.shape[0])
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        issue = self.issues[self.rows[index.row()]]
+        value = issue[index.column()]
+        return str(value).strip() if index.column() < 2 else value
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            if role == Qt.DisplayRole:
+                return self.HEADERS[section]
+            if role == Qt.FontRole:
+                return self.header_font
+        elif role == Qt.DisplayRole:
+            return section + 1
+        return None
+
+    def cell(self, row):
+        """
+        Return cell (as text) of the issue shown in the row.
+        """
+        return str(self.issues[self.rows[row]][0]).strip()
@@ -18,7 +18,7 @@ from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtWidgets import QApplication, QFileDialog, QInputDialog, QMessageBox
 
 from ..flo2d_ie.flo2dgeopackage import Flo2dGeoPackage
-from ..flo2d_ie.rainfall_io import ASCProcessor, HDFProcessor
+from ..flo2d_ie.rainfall_io import ASCProcessor, HDFProcessor, rainfall_frames
 from ..flo2dobjects import Rain
 from ..geopackage_utils import GeoPackageUtils
 from ..gui.dlg_sampling_rain import SamplingRainDialog
@@ -170,8 +170,7 @@ class RainEditorWidget(qtBaseClass, uiDialog):
                 time_interval = 0
                 for rain_series in asc_processor.rainfall_sampling():
                     cur = self.gutils.con.cursor()
-                    for val, gid in rain_series:
-                        cur.execute(data_qry, (time_interval, gid, val))
+                    cur.executemany(data_qry, ((time_interval, gid, val) for val, gid in rain_series))
                     self.gutils.con.commit()
                     time_interval += time_step
                 QApplication.restoreOverrideCursor()
@@ -243,11 +242,12 @@ class RainEditorWidget(qtBaseClass, uiDialog):
                 if header:
                     rainintime, irinters, timestamp = header
                     header_data = [rainintime, irinters, timestamp]
-                    qry_data = "SELECT iraindum FROM raincell_data ORDER BY rrgrid, time_interval;"
-                    data = self.gutils.execute(qry_data).fetchall()
-                    data = [data[i : i + irinters] for i in range(0, len(data), irinters)]
+                    qry_cells = "SELECT COUNT(fid) FROM raincell_data WHERE time_interval = (SELECT MIN(time_interval) FROM raincell_data);"
+                    qry_data = "SELECT iraindum FROM raincell_data ORDER BY time_interval, rrgrid;"
+                    cells_number = self.gutils.execute(qry_cells).fetchone()[0]
+                    frames = rainfall_frames(self.gutils.execute(qry_data), cells_number)
                     hdf_processor = HDFProcessor(hdf_file)
-                    hdf_processor.export_rainfall_to_binary_hdf5(header_data, data)
+                    hdf_processor.export_rainfall_frames(header_data, cells_number, frames)
                     QApplication.restoreOverrideCursor()
                     self.uc.show_info("Exporting Rainfall Data finished!")
                 else:
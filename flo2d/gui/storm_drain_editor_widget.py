@@ -511,8 +511,9 @@ class StormDrainEditorWidget(qtBaseClass, uiDialog):
             rt_inserts = []
             rt_updates = []
             rt_deletes = []
-            user_nodes = self.user_swmm_nodes_lyr.getFeatures()
-            for this_user_node in user_nodes:
+            user_nodes = []
+            points = []
+            for this_user_node in self.user_swmm_nodes_lyr.getFeatures():
                 geom = this_user_node.geometry()
                 if geom is None:
                     QApplication.restoreOverrideCursor()
@@ -522,8 +523,11 @@ class StormDrainEditorWidget(qtBaseClass, uiDialog):
                         + "Please check user Storm Drain Nodes layer."
                     )
                     return False
-                point = geom.asPoint()
-                grid_fid = self.gutils.grid_on_point(point.x(), point.y())
+                user_nodes.append(this_user_node)
+                points.append(geom.asPoint())
+            grid_fids = self.gutils.grid_on_points([p.x() for p in points], [p.y() for p in points])
+            for this_user_node, grid_fid in zip(user_nodes, grid_fids.tolist()):
+                grid_fid = grid_fid or None
                 sd_type = this_user_node["sd_type"]
                 name = this_user_node["name"]
                 rt_fid = this_user_node["rt_fid"]
@@ -15,6 +15,8 @@ import sys
 import traceback
 import warnings
 
+import numpy as np
+
 sys.path.append(os.path.dirname(__file__))
 from affine import Affine
 from transform import TransformMethodsMixin
@@ -29,9 +31,58 @@ with warnings.catch_warnings():
 class GDALRasterLayer(TransformMethodsMixin):
     def __init__(self, raster_file):
         self.raster_file = raster_file
-        self.ds = gdal.Open(raster_file)
+        self.ds = raster_file if isinstance(raster_file, gdal.Dataset) else gdal.Open(raster_file)
 
     @property
     def transform(self):
         geotransform = self.ds.GetGeoTransform()
         return Affine.from_gdal(*geotransform)
+
+    @property
+    def width(self):
+        return self.ds.RasterXSize
+
+    @property
+    def height(self):
+        return self.ds.RasterYSize
+
+    def sample(self, xs, ys, band=1, max_block_bytes=64 * 1024 * 1024):
+        """
+        Return float64 array of band values at points (NaN for points outside the raster or on NODATA pixels).
+        Pixel indexes of all points are calculated at once and band is read in blocks of rows holding the points.
+        """
+        rows, cols = self.index(np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))
+        return self.sample_pixels(rows, cols, band, max_block_bytes)
+
+    def sample_pixels(self, rows, cols, band=1, max_block_bytes=64 * 1024 * 1024):
+        """
+        Return float64 array of band values at pixel indexes (NaN for pixels outside the raster or NODATA).
+        """
+        raster_band = self.ds.GetRasterBand(band)
+        nodata = raster_band.GetNoDataValue()
+        values = np.full(rows.shape, np.nan, dtype=np.float64)
+        inside = np.flatnonzero((rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width))
+        if inside.size == 0:
+            return values
+        inside = inside[np.argsort(rows[inside], kind="stable")]
+        sorted_rows = rows[inside]
+        block_height = raster_band.GetBlockSize()[1]
+        rows_per_read = max(block_height, max_block_bytes // (8 * self.width) // block_height * block_height, 1)
+        first_row = int(sorted_rows[0])
+        while first_row <= sorted_rows[-1]:
+            start = np.searchsorted(sorted_rows, first_row, side="left")
+            end = np.searchsorted(sorted_rows, first_row + rows_per_read, side="left")
+            points = inside[start:end]
+            if points.size:
+                block_cols = cols[points]
+                xoff = int(block_cols.min())
+                xsize = int(block_cols.max()) - xoff + 1
+                ysize = min(rows_per_read, self.height - first_row)
+                block = raster_band.ReadAsArray(xoff, first_row, xsize, ysize)
+                values[points] = block[rows[points] - first_row, block_cols - xoff]
+            if end >= sorted_rows.size:
+                break
+            first_row = int(sorted_rows[end])
+        if nodata is not None:
+            values[values == nodata] = np.nan
+        return values
@@ -14,6 +14,7 @@ from __future__ import division
 import collections
 import math
 
+import numpy as np
 from affine import Affine
 
 IDENTITY = Affine.identity()
@@ -211,6 +212,9 @@ def rowcol(transform, xs, ys, op=math.floor, precision=None):
         list of column indices
     """
 
+    if isinstance(xs, np.ndarray) and isinstance(ys, np.ndarray):
+        return _rowcol_arrays(transform, xs, ys, op, precision)
+
     single_x = False
     single_y = False
     if not isinstance(xs, collections.Iterable):
@@ -240,3 +244,21 @@ def rowcol(transform, xs, ys, op=math.floor, precision=None):
         rows = rows[0]
 
     return rows, cols
+
+
+_ARRAY_OPS = {math.floor: np.floor, math.ceil: np.ceil, round: np.rint}
+
+
+def _rowcol_arrays(transform, xs, ys, op=math.floor, precision=None):
+    """
+    Vectorized version of `rowcol` for NumPy arrays of coordinates.
+    All points are transformed at once and int64 arrays of rows and cols are returned.
+    """
+    if precision is None:
+        eps = 0.0
+    else:
+        eps = 10.0**-precision * (1.0 - 2.0 * op(0.1))
+
+    array_op = _ARRAY_OPS.get(op, op)
+    fcol, frow = ~transform * (xs.astype(np.float64) + eps, ys.astype(np.float64) - eps)
+    return array_op(frow).astype(np.int64), array_op(fcol).astype(np.int64)
@@ -11,6 +11,8 @@
 import os
 import unittest
 
+import numpy as np
+
 from .utilities import get_qgis_app
 
 QGIS_APP = get_qgis_app()
@@ -22,8 +24,13 @@ EXPORT_DATA_DIR = os.path.join(THIS_DIR, "data")
 CONT_1 = os.path.join(IMPORT_DATA_DIR_1, "CONT.DAT")
 CONT_2 = os.path.join(IMPORT_DATA_DIR_2, "CONT.DAT")
 
+from flo2d.errors import Flo2dError
+from flo2d.flo2d_ie.flo2d_parser import ParseDAT
 from flo2d.flo2d_ie.flo2dgeopackage import Flo2dGeoPackage
-from flo2d.geopackage_utils import database_create
+from flo2d.flo2d_tools.conflicts import Conflicts
+from flo2d.flo2d_tools import grid_index
+from flo2d.flo2d_tools.grid_index import GridIndex, cached_grid_index
+from flo2d.geopackage_utils import ImportSession, database_create, database_disconnect
 
 
 def file_len(fname):
@@ -101,6 +108,145 @@ class TestFlo2dGeoPackage(unittest.TestCase):
         rows = self.f2g_2.execute("""SELECT COUNT(fid) FROM grid;""").fetchone()[0]
         self.assertEqual(float(rows), 9205)
 
+    def test_prefetch_numeric(self):
+        parser = ParseDAT()
+        parser.scan_project_dir(CONT_1)
+        parser.prefetch_min_bytes = 0
+        parser.prefetch_numeric("MANNINGS_N.DAT", "TOPO.DAT", "TOLSPATIAL.DAT", "CONT.DAT")
+        self.assertListEqual(sorted(parser.prefetched), ["MANNINGS_N.DAT", "TOLSPATIAL.DAT", "TOPO.DAT"])
+        try:
+            prefetched = list(parser.parse_mannings_n_topo_arrays(1000))
+            fids, tol = parser.parse_tolspatial_arrays()
+        finally:
+            parser.close_prefetch()
+        expected = list(self.f2g.parser.parse_mannings_n_topo_arrays(1000))
+        self.assertEqual(len(prefetched), len(expected))
+        for arrays, expected_arrays in zip(prefetched, expected):
+            for array, expected_array in zip(arrays, expected_arrays):
+                self.assertTrue(np.array_equal(array, expected_array))
+        self.assertListEqual(fids.tolist(), [int(row[0]) for row in self.f2g.parser.parse_tolspatial()])
+        self.assertIsNone(parser.executor)
+
+    def test_build_square_gpb(self):
+        wkt = "POLYGON((-50.5 150.25, 49.5 150.25, 49.5 250.25, -50.5 250.25, -50.5 150.25))"
+        expected = self.f2g.execute("""SELECT AsGPB(ST_GeomFromText(?));""", (wkt,)).fetchone()[0]
+        self.assertEqual(self.f2g.build_square_xy(-0.5, 200.25, 100), expected)
+        self.assertEqual(self.f2g.build_square("POINT(-0.5 200.25)", 100), expected)
+        squares = list(self.f2g.build_squares_xy([-0.5, -0.5], [200.25, 200.25], 100))
+        self.assertListEqual(squares, [expected, expected])
+
+    def test_grid_index(self):
+        index = GridIndex.from_gpkg(self.f2g)
+        self.assertEqual(index.count, 9205)
+        self.assertEqual(index.cell_size, 100)
+        self.assertTrue(index.regular)
+        qry = """SELECT fid, ST_X(ST_Centroid(GeomFromGPB(geom))), ST_Y(ST_Centroid(GeomFromGPB(geom))) FROM grid;"""
+        for fid, x, y in self.f2g.execute(qry).fetchall()[::500]:
+            self.assertEqual(index.fid_at(x, y), fid)
+            self.assertEqual(index.fid_at(x + 49, y - 49), fid)
+        self.assertIsNone(index.fid_at(index.x_origin - 100, index.y_origin))
+        self.assertIs(cached_grid_index(self.f2g), cached_grid_index(self.f2g))
+
+    def test_grid_index_cache_connections(self):
+        con = database_create(":memory:")
+        gutils = Flo2dGeoPackage(con, None)
+        gutils.disable_geom_triggers()
+        gutils.set_parser(CONT_1)
+        gutils.import_mannings_n_topo()
+        index = cached_grid_index(gutils)
+        self.assertIs(grid_index._grid_indexes[id(con)][2], index)
+        self.assertIsNot(index, cached_grid_index(self.f2g))
+        database_disconnect(con)
+        self.assertNotIn(id(con), grid_index._grid_indexes)
+
+    def test_grid_index_cache_rollback(self):
+        self.f2g.con.execute("""SAVEPOINT caller;""")
+        self.f2g.execute("""UPDATE grid SET elevation = -1 WHERE fid = 1;""")
+        index = cached_grid_index(self.f2g)
+        self.f2g.con.execute("""ROLLBACK TO SAVEPOINT caller;""")
+        self.f2g.execute("""UPDATE grid SET elevation = -2 WHERE fid = 2;""")
+        self.f2g.con.execute("""RELEASE SAVEPOINT caller;""")
+        self.assertIsNot(cached_grid_index(self.f2g), index)
+        self.assertEqual(cached_grid_index(self.f2g).elevation[0], self.f2g.grid_value(1, "elevation"))
+
+    def test_grid_neighbors(self):
+        index = cached_grid_index(self.f2g)
+        neighbors = index.neighbors()
+        self.assertEqual(neighbors.shape, (9205, 8))
+        pos = int(index.positions([index.fid_raster[1, 1]])[0])
+        x, y = index.x[pos], index.y[pos]
+        expected = []
+        for dx, dy in [(0, 100), (100, 0), (0, -100), (-100, 0)]:
+            found = np.nonzero(np.isclose(index.x, x + dx) & np.isclose(index.y, y + dy))[0]
+            expected.append(int(index.fid[found[0]]) if found.size else 0)
+        self.assertListEqual(neighbors[pos, :4].tolist(), expected)
+
+    def test_grid_on_points(self):
+        index = cached_grid_index(self.f2g)
+        xs = np.append(index.x[::500] + 49, index.x_origin - 100)
+        ys = np.append(index.y[::500] - 49, index.y_origin)
+        expected = [self.f2g.grid_on_point(x, y) or 0 for x, y in zip(xs, ys)]
+        self.assertListEqual(self.f2g.grid_on_points(xs, ys).tolist(), expected)
+        self.assertListEqual(self.f2g.grid_on_points_rtree(xs, ys).tolist(), expected)
+        fids, elevations = self.f2g.grid_on_points(xs, ys, with_elevation=True)
+        self.assertEqual(elevations[0], self.f2g.grid_value(int(fids[0]), "elevation"))
+        self.assertTrue(np.isnan(elevations[-1]))
+
+    def test_grid_on_points_rtree_keeps_transaction(self):
+        index = cached_grid_index(self.f2g)
+        self.f2g.con.execute("""SAVEPOINT caller;""")
+        self.f2g.grid_on_points_rtree(index.x[:10], index.y[:10])
+        # Releasing fails if the lookup committed the caller's transaction.
+        self.f2g.con.execute("""RELEASE SAVEPOINT caller;""")
+
+    def test_import_session_rollback(self):
+        cells = self.f2g_2.execute("""SELECT COUNT(fid) FROM grid;""").fetchone()[0]
+        with self.assertRaises(ValueError):
+            with ImportSession(self.f2g_2):
+                self.f2g_2.clear_tables("grid")
+                self.assertTrue(self.f2g_2.is_table_empty("grid"))
+                raise ValueError("Import failed")
+        self.assertEqual(self.f2g_2.execute("""SELECT COUNT(fid) FROM grid;""").fetchone()[0], cells)
+        rtree_cells = self.f2g_2.execute("""SELECT COUNT(id) FROM rtree_grid_geom;""").fetchone()[0]
+        self.assertEqual(rtree_cells, cells)
+
+    def test_import_session_early_commit(self):
+        triggers_qry = """SELECT COUNT(name) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'rtree_grid_geom%';"""
+        triggers = self.f2g_2.execute(triggers_qry).fetchone()[0]
+        with self.assertRaises(Flo2dError):
+            with ImportSession(self.f2g_2) as session:
+                # Helper committing the plain connection ends the session transaction.
+                session.con.commit()
+                self.f2g_2.execute("""DELETE FROM rtree_grid_geom;""")
+        self.assertEqual(self.f2g_2.execute(triggers_qry).fetchone()[0], triggers)
+        cells = self.f2g_2.execute("""SELECT COUNT(fid) FROM grid;""").fetchone()[0]
+        rtree_cells = self.f2g_2.execute("""SELECT COUNT(id) FROM rtree_grid_geom;""").fetchone()[0]
+        self.assertEqual(rtree_cells, cells)
+
+    def test_bulk_load(self):
+        triggers_qry = """SELECT COUNT(name) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'rtree_grid_geom%';"""
+        triggers = self.f2g.execute(triggers_qry).fetchone()[0]
+        with self.f2g.bulk_load("grid", "blocked_cells", "levee_data", "chan_elems"):
+            self.assertEqual(self.f2g.execute(triggers_qry).fetchone()[0], 0)
+            self.f2g.execute("""DELETE FROM rtree_grid_geom;""")
+        self.assertEqual(self.f2g.execute(triggers_qry).fetchone()[0], triggers)
+        cells = self.f2g.execute("""SELECT COUNT(fid) FROM grid;""").fetchone()[0]
+        rtree_cells = self.f2g.execute("""SELECT COUNT(id) FROM rtree_grid_geom;""").fetchone()[0]
+        self.assertEqual(rtree_cells, cells)
+
+    def test_conflicts(self):
+        self.f2g.clear_tables("inflow", "inflow_cells", "outflow", "outflow_cells")
+        self.f2g.import_inflow()
+        self.f2g.import_outflow()
+        conflicts = Conflicts(self.f2g)
+        conflicts.add_pair(("inflow_cells", "grid_fid"), ("outflow_cells", "grid_fid"), "inflow-outflow")
+        conflicts.add_pair(("outflow_cells", "grid_fid"), ("outflow_cells", "grid_fid"), "outflow-outflow")
+        results = {data: cells.tolist() for data, cells in conflicts.evaluate()}
+        qry = """SELECT grid_fid FROM inflow_cells INTERSECT SELECT grid_fid FROM outflow_cells ORDER BY grid_fid;"""
+        self.assertListEqual(results["inflow-outflow"], [row[0] for row in self.f2g.execute(qry)])
+        qry = """SELECT grid_fid FROM outflow_cells GROUP BY grid_fid HAVING COUNT(*) > 1 ORDER BY grid_fid;"""
+        self.assertListEqual(results["outflow-outflow"], [row[0] for row in self.f2g.execute(qry)])
+
     def test_import_inflow(self):
         self.f2g.clear_tables("inflow")
         self.f2g.import_inflow()
@@ -9,7 +9,14 @@
 # of the License, or (at your option) any later version
 
 import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+
+import numpy as np
 
 from .utilities import get_qgis_app
 
@@ -18,10 +25,37 @@ THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 VECTOR_PATH = os.path.join(THIS_DIR, "data", "vector")
 EXPORT_DATA_DIR = os.path.join(THIS_DIR, "data")
 
-from qgis.core import QgsVectorLayer
+from osgeo import gdal
+from qgis.core import QgsFeature, QgsGeometry, QgsRectangle, QgsVectorLayer, QgsVectorLayerFeatureSource
+
+from flo2d.flo2d_tools.grid_tools import (build_grid, build_grid_arrays,
+                                          calculate_arfwrf, fill_grid_nodata,
+                                          fill_nodata_cells, fill_nodata_raster,
+                                          parallelRegionGenerator, poly2grid,
+                                          poly2poly_geos)
+from flo2d.flo2d_tools.grid_index import GridIndex
+from flo2d.flo2d_tools.lidar_binning import (LidarBins, lidar_file_format,
+                                              lidar_tasks)
+from flo2d.flo2d_tools.raster_alignment import GridRasterAlignment
+from flo2d.flo2d_tools.raster_sampling import (_reduce_mode_counts,
+                                               resample_raster_to_grid,
+                                               zonal_grid_values)
+from flo2d.geopackage_utils import GeoPackageUtils
+from flo2d.misc.gdal_utils import GDALRasterLayer
+
 
-from flo2d.flo2d_tools.grid_tools import (build_grid, calculate_arfwrf,
-                                          poly2grid)
+def mem_raster(values, x_min, y_max, pixel_size, nodata=None):
+    """
+    Return GDALRasterLayer over in-memory raster with 'values' rows starting at the top edge.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    ds = gdal.GetDriverByName("MEM").Create("", values.shape[1], values.shape[0], 1, gdal.GDT_Float64)
+    ds.SetGeoTransform((x_min, pixel_size, 0.0, y_max, 0.0, -pixel_size))
+    band = ds.GetRasterBand(1)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.WriteArray(values)
+    return GDALRasterLayer(ds)
 
 
 class TestGridTools(unittest.TestCase):
@@ -41,6 +75,18 @@ class TestGridTools(unittest.TestCase):
         polygons = list(build_grid(vlayer, 500))
         self.assertEqual(len(polygons), 494)
 
+    def test_build_grid_arrays(self):
+        boundary = os.path.join(VECTOR_PATH, "boundary.geojson")
+        vlayer = QgsVectorLayer(boundary, "bl", "ogr")
+        xs, ys, cols, rows, rows_count = build_grid_arrays(vlayer, 500)
+        self.assertEqual(len(xs), 494)
+        cells = set(zip(cols.tolist(), rows.tolist()))
+        self.assertEqual(len(cells), 494)
+        self.assertTrue(rows.max() < rows_count)
+        first_poly = next(build_grid(vlayer, 500))
+        self.assertAlmostEqual(first_poly[0] + 250, xs[0])
+        self.assertAlmostEqual(first_poly[1] + 250, ys[0])
+
     def test_poly2grid(self):
         grid = os.path.join(VECTOR_PATH, "grid.geojson")
         roughness = os.path.join(VECTOR_PATH, "roughness.geojson")
@@ -54,6 +100,74 @@ class TestGridTools(unittest.TestCase):
         expected = {0.5, 0.3, 0.1}
         self.assertSetEqual(set(n_values), expected)
 
+    def test_poly2poly_geos_feature_sources(self):
+        grid = os.path.join(VECTOR_PATH, "grid.geojson")
+        roughness = os.path.join(VECTOR_PATH, "roughness.geojson")
+        glayer = QgsVectorLayer(grid, "grid", "ogr")
+        rlayer = QgsVectorLayer(roughness, "roughness", "ogr")
+        from_layers = dict(poly2poly_geos(glayer, rlayer, None, "manning"))
+        sources = QgsVectorLayerFeatureSource(glayer), QgsVectorLayerFeatureSource(rlayer)
+        from_sources = dict(poly2poly_geos(*sources, None, "manning"))
+        self.assertTrue(any(from_layers.values()))
+        self.assertDictEqual(from_layers, from_sources)
+
+    def run_regions(self, regions, task, max_workers=2):
+        with mock.patch("flo2d.flo2d_tools.grid_tools.grid_region_requests", return_value=list(range(regions))):
+            yield from parallelRegionGenerator(None, None, task, showProgress=False, maxWorkers=max_workers)
+
+    def test_parallel_regions_order(self):
+        def task(request):
+            # Later regions finish first.
+            time.sleep((10 - request) * 0.002)
+            return request * 10
+
+        results = list(self.run_regions(10, task, max_workers=4))
+        self.assertListEqual(results, [(r, r * 10) for r in range(10)])
+
+    def test_parallel_regions_backlog(self):
+        started = []
+
+        def task(request):
+            started.append(request)
+            return request
+
+        for request, result in self.run_regions(20, task, max_workers=2):
+            # Slow consumer: no more than 2 x workers regions are submitted ahead of it.
+            time.sleep(0.01)
+            self.assertLessEqual(len(started), request + 4)
+            if request == 0:
+                self.assertEqual(len(started), 4)
+        self.assertEqual(len(started), 20)
+
+    def test_parallel_regions_close(self):
+        started, finished = [], []
+        lock = threading.Lock()
+
+        def task(request):
+            with lock:
+                started.append(request)
+            time.sleep(0.05)
+            with lock:
+                finished.append(request)
+            return request
+
+        regions = self.run_regions(50, task, max_workers=2)
+        self.assertEqual(next(regions), (0, 0))
+        regions.close()
+        # Pending regions are cancelled and running ones have completed when the generator is closed.
+        self.assertLess(len(started), 50)
+        self.assertListEqual(sorted(finished), sorted(started))
+
+    def test_parallel_regions_error(self):
+        def task(request):
+            if request == 3:
+                raise ValueError("Region failed")
+            return request
+
+        regions = self.run_regions(10, task)
+        self.assertListEqual([next(regions)[1] for __ in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, next, regions)
+
     @unittest.skip("Skipping test due to long run.")
     def test_calculate_arfwrf(self):
         grid = os.path.join(VECTOR_PATH, "grid.geojson")
@@ -66,6 +180,211 @@ class TestGridTools(unittest.TestCase):
             self.assertTrue(all(awrf))
         self.assertTupleEqual(row[1:], (153, 4, 0.68, 1.0, 0.0, 0.27, 1.0, 0.56, 0.0, 1.0, 1.0))
 
+    def test_calculate_arfwrf_values(self):
+        blockers = QgsVectorLayer("Polygon?field=calc_arf:integer&field=calc_wrf:integer", "blockers", "memory")
+        feat = QgsFeature(blockers.fields())
+        feat.setGeometry(QgsGeometry.fromRect(QgsRectangle(11, 11, 16, 19)))
+        feat.setAttributes([1, 1])
+        blockers.dataProvider().addFeatures([feat])
+        xs = [5.0 + 10 * (i % 3) for i in range(9)]
+        ys = [5.0 + 10 * (i // 3) for i in range(9)]
+        cell_5 = (5, 1, 0.4, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.32, 0.32)
+        cell_6 = (6, 1, 0.08, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.34, 0.34)
+
+        regular = GridIndex(range(1, 10), xs, ys, [0.0] * 9, [0.04] * 9, 10)
+        rows = [row[1:] for row, was_null in calculate_arfwrf(None, blockers, regular)]
+        self.assertListEqual(rows, [cell_5])
+
+        # Cell 6 moved half a cell to the west is out of the lattice range of the blocked area bounding box.
+        xs[5] = 20.0
+        irregular = GridIndex(range(1, 10), xs, ys, [0.0] * 9, [0.04] * 9, 10)
+        self.assertFalse(irregular.regular)
+        rows = [row[1:] for row, was_null in calculate_arfwrf(None, blockers, irregular)]
+        self.assertListEqual(rows, [cell_5, cell_6])
+
+    def test_grid_index_neighbors(self):
+        # 3x2 grid with 10 m cells, fids 1-3 in the bottom row and 4-6 in the top row.
+        xs, ys = [0.0, 10.0, 20.0, 0.0, 10.0, 20.0], [0.0, 0.0, 0.0, 10.0, 10.0, 10.0]
+        index = GridIndex([1, 2, 3, 4, 5, 6], xs, ys, [0.0] * 6, [0.04] * 6, 10.0)
+        self.assertTrue(index.regular)
+        neighbors = index.neighbors()
+        self.assertListEqual(neighbors[0].tolist(), [4, 2, 0, 0, 5, 0, 0, 0])
+        self.assertListEqual(neighbors[4].tolist(), [0, 6, 2, 4, 0, 3, 1, 0])
+
+        # Cell 3 moved half of the cell off the lattice.
+        xs[2] = 25.0
+        index = GridIndex([1, 2, 3, 4, 5, 6], xs, ys, [0.0] * 6, [0.04] * 6, 10.0)
+        self.assertFalse(index.regular)
+        neighbors = index.neighbors()
+        self.assertListEqual(neighbors[0].tolist(), [4, 2, 0, 0, 5, 0, 0, 0])
+        self.assertListEqual(neighbors[1].tolist(), [5, 0, 0, 1, 6, 0, 0, 4])
+        self.assertListEqual(neighbors[2].tolist(), [0] * 8)
+        self.assertListEqual(neighbors[5].tolist(), [0, 0, 0, 5, 0, 0, 2, 0])
+
+    def test_lidar_bins(self):
+        xs, ys = [50.0, 150.0, 50.0, 150.0], [50.0, 50.0, 150.0, 150.0]
+        index = GridIndex([1, 2, 3, 4], xs, ys, [0.0] * 4, [0.04] * 4, 100.0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lidar = os.path.join(tmpdir, "lidar.txt")
+            with open(lidar, "w") as f:
+                f.write("10.0,10.0,1.0\n90.0,90.0,3.0\n110.0,160.0,5.0\n\n500.0,500.0,7.0\n")
+            self.assertTupleEqual(lidar_file_format(lidar), (b",", 3))
+            bins = LidarBins.from_grid_index(index)
+            invalid_line = bins.add_file(lidar, blocksize=16)
+            self.assertIsNone(invalid_line)
+            self.assertEqual(bins.inside, 3)
+            self.assertEqual(bins.outside, 1)
+            means, counts = bins.cell_values(index)
+            self.assertListEqual(counts.tolist(), [2, 0, 0, 1])
+            self.assertAlmostEqual(means[0], 2.0)
+            self.assertAlmostEqual(means[3], 5.0)
+            mins, __ = bins.cell_values(index, "min")
+            self.assertAlmostEqual(mins[0], 1.0)
+            merged = LidarBins.from_grid_index(index)
+            for path, start, end in lidar_tasks([lidar], task_bytes=20):
+                partial = LidarBins.from_grid_index(index)
+                partial.add_file(path, start=start, end=end)
+                merged.merge_partial(partial.partial())
+            self.assertListEqual(merged.count.tolist(), bins.count.tolist())
+            self.assertListEqual(merged.max.tolist(), bins.max.tolist())
+            self.assertEqual(merged.outside, 1)
+
+    def test_grid_raster_alignment_cache(self):
+        # 3x2 raster with 10 m pixels and 2x2 grid on the first two columns of pixels.
+        raster = mem_raster([[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]], 0.0, 20.0, 10.0)
+        xs, ys = [5.0, 15.0, 5.0, 15.0], [5.0, 5.0, 15.0, 15.0]
+        index = GridIndex([1, 2, 3, 4], xs, ys, [0.0] * 4, [0.04] * 4, 10.0)
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE gpkg_contents (table_name TEXT PRIMARY KEY, data_type TEXT);")
+        alignment = GridRasterAlignment(GeoPackageUtils(con, None))
+        qry = "SELECT grid_hash FROM grid_raster_alignment;"
+
+        rows, cols = alignment.pixels(raster, index)
+        self.assertListEqual(raster.sample_pixels(rows, cols).tolist(), [3.0, 4.0, 0.0, 1.0])
+        self.assertListEqual(con.execute(qry).fetchall(), [(index.fingerprint(),)])
+        cached_rows, cached_cols = alignment.pixels(raster, index)
+        self.assertListEqual(cached_rows.tolist(), rows.tolist())
+        self.assertListEqual(cached_cols.tolist(), cols.tolist())
+
+        # New cell over the third column of pixels invalidates the stored mapping.
+        changed = GridIndex([1, 2, 3, 4, 5], xs + [25.0], ys + [5.0], [0.0] * 5, [0.04] * 5, 10.0)
+        rows, cols = alignment.pixels(raster, changed)
+        self.assertListEqual(raster.sample_pixels(rows, cols).tolist(), [3.0, 4.0, 0.0, 1.0, 5.0])
+        self.assertListEqual(con.execute(qry).fetchall(), [(changed.fingerprint(),)])
+
+        alignment.clear()
+        self.assertListEqual(con.execute(qry).fetchall(), [])
+        con.close()
+
+    def test_reduce_mode_counts(self):
+        cells = np.array([1, 1, 2, 1])
+        values = np.array([3.0, 3.0, 3.0, 4.0])
+        counts = np.array([1.0, 2.0, 1.0, 1.0])
+        cells, values, counts = _reduce_mode_counts(cells, values, counts)
+        self.assertListEqual(cells.tolist(), [1, 1, 2])
+        self.assertListEqual(values.tolist(), [3.0, 4.0, 3.0])
+        self.assertListEqual(counts.tolist(), [3.0, 1.0, 1.0])
+
+    def test_zonal_grid_values(self):
+        # 4x4 raster with 5 m pixels under 3x2 grid with 10 m cells (the last cell has no pixels).
+        values = [
+            [1.0, 2.0, 5.0, 6.0],
+            [3.0, 2.0, 6.0, 5.0],
+            [7.0, 7.0, 9.0, -9999.0],
+            [7.0, 8.0, 4.0, 9.0],
+        ]
+        raster = mem_raster(values, 0.0, 20.0, 5.0, nodata=-9999.0)
+        xs, ys = [5.0, 15.0, 5.0, 15.0, 25.0], [5.0, 5.0, 15.0, 15.0, 5.0]
+        index = GridIndex([1, 2, 3, 4, 5], xs, ys, [0.0] * 5, [0.04] * 5, 10.0)
+        expected = {
+            "mean": [7.25, 22.0 / 3.0, 2.0, 5.5],
+            "min": [7.0, 4.0, 1.0, 5.0],
+            "max": [8.0, 9.0, 3.0, 6.0],
+            "mode": [7.0, 9.0, 2.0, 5.0],
+        }
+        for statistic, cell_values in expected.items():
+            for max_block_bytes in (64 * 1024 * 1024, 32):
+                result = zonal_grid_values(raster, index, statistic, max_block_bytes=max_block_bytes)
+                self.assertTrue(np.allclose(result[:4], cell_values), statistic)
+                self.assertTrue(np.isnan(result[4]), statistic)
+
+    def test_resample_unaligned_nearest(self):
+        # 4x4 raster with 5 m pixels shifted by half of the pixel from the grid lattice.
+        raster = mem_raster(np.arange(16.0).reshape(4, 4).tolist(), 2.5, 22.5, 5.0)
+        xs, ys = [5.0, 15.0, 5.0, 15.0, 25.0], [5.0, 5.0, 15.0, 15.0, 5.0]
+        index = GridIndex([1, 2, 3, 4, 5], xs, ys, [0.0] * 5, [0.04] * 5, 10.0)
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE gpkg_contents (table_name TEXT PRIMARY KEY, data_type TEXT);")
+        gutils = GeoPackageUtils(con, None)
+        with mock.patch("flo2d.flo2d_tools.raster_sampling.cached_grid_index", return_value=index), mock.patch(
+            "flo2d.flo2d_tools.raster_alignment.cached_grid_index", return_value=index
+        ), mock.patch("flo2d.flo2d_tools.raster_sampling.warp_to_grid") as warp:
+            for __ in range(2):
+                rows = resample_raster_to_grid(gutils, raster.ds, resample_alg="near")
+                self.assertListEqual(rows, [(12.0, 1), (14.0, 2), (4.0, 3), (6.0, 4), (None, 5)])
+            warp.assert_not_called()
+        self.assertEqual(con.execute("SELECT COUNT(*) FROM grid_raster_alignment;").fetchone()[0], 1)
+        con.close()
+
+    def test_resample_irregular_average(self):
+        # Cells 2 and 3 share the lattice slot, so pixels can't be binned by their position.
+        raster = mem_raster(np.arange(16.0).reshape(4, 4).tolist(), 0.0, 20.0, 5.0)
+        xs, ys = [5.0, 15.0, 19.0, 5.0], [5.0, 5.0, 5.0, 15.0]
+        index = GridIndex([1, 2, 3, 4], xs, ys, [0.0] * 4, [0.04] * 4, 10.0)
+        self.assertFalse(index.regular)
+        warped = mem_raster([[0.0]], 0.0, 20.0, 10.0).ds
+        module = "flo2d.flo2d_tools.raster_sampling"
+        with mock.patch(module + ".cached_grid_index", return_value=index), mock.patch(
+            module + ".GridRasterAlignment"
+        ) as alignment:
+            alignment.return_value.sample.return_value = (index.fid, np.zeros(4))
+            with mock.patch(module + ".zonal_grid_values") as zonal, mock.patch(
+                module + ".warp_to_grid", return_value=warped
+            ) as warp:
+                resample_raster_to_grid(None, raster.ds, resample_alg="average")
+            zonal.assert_not_called()
+            warp.assert_called_once()
+
+    def test_fill_nodata_raster(self):
+        values = np.array([[1.0, 0.0, 3.0], [0.0, 0.0, 0.0], [5.0, 0.0, 7.0]])
+        valid = values != 0.0
+        fillable = np.ones(values.shape, dtype=bool)
+        filled_values, filled = fill_nodata_raster(values, valid, fillable)
+        self.assertEqual(filled.sum(), 5)
+        self.assertTrue(np.allclose(filled_values.ravel(), [1.0, 2.0, 3.0, 3.0, 4.0, 5.0, 5.0, 6.0, 7.0]))
+        fillable[1, 1] = False
+        filled_values, filled = fill_nodata_raster(values, valid, fillable, max_distance=1)
+        self.assertFalse(filled[1, 1])
+        self.assertEqual(filled.sum(), 4)
+
+    def test_fill_nodata_cells(self):
+        # Regular 3x3 grid gives the same values as the raster filling.
+        values = np.array([1.0, 0.0, 3.0, 0.0, 0.0, 0.0, 5.0, 0.0, 7.0])
+        index = GridIndex(range(1, 10), [5.0, 15.0, 25.0] * 3, [5.0] * 3 + [15.0] * 3 + [25.0] * 3, values, values, 10)
+        filled_values, filled = fill_nodata_cells(index, values, values != 0.0, index.fids_at)
+        self.assertEqual(filled.sum(), 5)
+        self.assertTrue(np.allclose(filled_values, [1.0, 2.0, 3.0, 3.0, 4.0, 5.0, 5.0, 6.0, 7.0]))
+
+        # Cells 2 and 3 of the irregular grid share the lattice slot, cell 5 has no neighbours.
+        elevations = np.array([1.0, -9999, 3.0, 4.0, -9999])
+        index = GridIndex(range(1, 6), [5.0, 15.0, 19.0, 35.0, 75.0], [5.0] * 5, elevations, [0.04] * 5, 10)
+        self.assertFalse(index.regular)
+
+        def cells_on_points(xs, ys):
+            inside = (np.abs(index.x - np.asarray(xs)[:, None]) <= 5) & (np.abs(index.y - np.asarray(ys)[:, None]) <= 5)
+            return np.where(inside.any(axis=1), index.fid[inside.argmax(axis=1)], 0)
+
+        filled_values, filled = fill_nodata_cells(index, elevations, elevations != -9999, cells_on_points)
+        self.assertListEqual(filled.tolist(), [False, True, False, False, False])
+        self.assertAlmostEqual(filled_values[1], 1.0)
+
+        gutils = mock.Mock(grid_on_points=cells_on_points)
+        with mock.patch("flo2d.flo2d_tools.grid_tools.cached_grid_index", return_value=index):
+            filled_fids, empty_fids = fill_grid_nodata(gutils)
+        self.assertListEqual(filled_fids.tolist(), [2])
+        self.assertListEqual(empty_fids.tolist(), [5])
+        self.assertListEqual(list(gutils.execute_many.call_args[0][1]), [(1.0, 2)])
+
 
 # Running tests:
 if __name__ == "__main__":
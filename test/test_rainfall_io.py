@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# FLO-2D Preprocessor tools for QGIS
+# Copyright © 2021 Lutra Consulting for FLO-2D
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+import h5py
+
+from flo2d.flo2d_ie.rainfall_io import HDFProcessor, rainfall_frames
+
+
+class TestRainfallIO(unittest.TestCase):
+    header = ["5", "3", "6/1/2021 00:00 6/1/2021 00:15"]
+    # Rainfall of 4 cells over 3 intervals, as the previous writer took it (per cell series of [value] rows).
+    series = [
+        [[0.1], [0.2], [0.3]],
+        [[0.0], [0.5], [0.0]],
+        [[1.0], [1.5], [2.0]],
+        [[0.4], [0.0], [0.6]],
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.hdf_path = os.path.join(self.tmpdir.name, "RAINCELL.HDF5")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_rainfall_frames(self):
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE raincell_data (time_interval INTEGER, rrgrid INTEGER, iraindum REAL);")
+        rows = [(t, c, self.series[c][t][0]) for t in range(3) for c in range(4)]
+        rows[5] = (1, 1, None)
+        con.executemany("INSERT INTO raincell_data VALUES (?, ?, ?);", rows)
+        qry = "SELECT iraindum FROM raincell_data ORDER BY time_interval, rrgrid;"
+        frames = list(rainfall_frames(con.execute(qry), 4))
+        con.close()
+        self.assertEqual(len(frames), 3)
+        self.assertListEqual(frames[0].tolist(), [0.1, 0.0, 1.0, 0.4])
+        self.assertListEqual(frames[1].tolist(), [0.2, 0.0, 1.5, 0.0])
+
+    def test_export_rainfall_frames(self):
+        expected = np.array(self.series)
+        frames = (expected[:, t, 0] for t in range(expected.shape[1]))
+        processor = HDFProcessor(self.hdf_path, chunk_cells=2)
+        written = processor.export_rainfall_frames(self.header, expected.shape[0], frames)
+        self.assertEqual(written, 3)
+        with h5py.File(self.hdf_path, "r") as hdf_file:
+            grp = hdf_file["raincell"]
+            self.assertEqual(int(grp["RAININTIME"][()]), 5)
+            self.assertEqual(int(grp["IRINTERS"][()]), 3)
+            iraindum = grp["IRAINDUM"]
+            self.assertTupleEqual(iraindum.shape, (4, 3, 1))
+            self.assertTupleEqual(iraindum.chunks, (2, 1, 1))
+            self.assertTrue(np.array_equal(iraindum[()], expected))
+
+    def test_export_rainfall_to_binary_hdf5(self):
+        processor = HDFProcessor(self.hdf_path)
+        written = processor.export_rainfall_to_binary_hdf5(self.header, self.series)
+        self.assertEqual(written, 3)
+        with h5py.File(self.hdf_path, "r") as hdf_file:
+            iraindum = hdf_file["raincell"]["IRAINDUM"][()]
+        self.assertTrue(np.array_equal(iraindum, np.array(self.series)))
+
+    def test_export_empty_rainfall(self):
+        processor = HDFProcessor(self.hdf_path)
+        self.assertEqual(processor.export_rainfall_frames(self.header, 0, iter([])), 0)
+        with h5py.File(self.hdf_path, "r") as hdf_file:
+            self.assertTupleEqual(hdf_file["raincell"]["IRAINDUM"].shape, (0, 0, 1))
+            self.assertEqual(int(hdf_file["raincell"]["IRINTERS"][()]), 3)
+        self.assertEqual(processor.export_rainfall_to_binary_hdf5(self.header, []), 0)
+
+
+# Running tests:
+if __name__ == "__main__":
+    cases = [TestRainfallIO]
+    suite = unittest.TestSuite()
+    for t in cases:
+        tests = unittest.TestLoader().loadTestsFromTestCase(t)
+        suite.addTest(tests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -22,12 +22,47 @@ from collections import defaultdict
 
 from qgis.core import QgsVectorLayer
 
-from flo2d.flo2d_tools.schematic_tools import (get_intervals,
+from flo2d.flo2d_tools.grid_index import GridIndex
+from flo2d.flo2d_tools.schematic_tools import (bresenham_cells,
+                                               cells_directions,
+                                               floodplain_xs_cells,
+                                               get_intervals,
                                                interpolate_along_line,
+                                               levee_cell_crossings,
+                                               levee_opposite_duplicates,
+                                               octagon_sides,
                                                populate_directions,
                                                schematize_lines)
 
 
+def grid_3x3(shifted=None):
+    """
+    Return GridIndex of 3x3 grid with 10 m cells, lower left centroid in (5, 5).
+    Centroids of some cells can be moved with 'shifted' dictionary of {fid: (x, y)}.
+    """
+    xs = [5.0 + 10 * (i % 3) for i in range(9)]
+    ys = [5.0 + 10 * (i // 3) for i in range(9)]
+    for fid, (x, y) in (shifted or {}).items():
+        xs[fid - 1], ys[fid - 1] = x, y
+    return GridIndex(list(range(1, 10)), xs, ys, [0.0] * 9, [0.04] * 9, 10.0)
+
+
+def square_cells_lookup(index):
+    """
+    Return brute force 'cells_on_points' function finding cells as squares around the index centroids.
+    """
+    half = index.cell_size / 2
+
+    def cells_on_points(pxs, pys):
+        found = []
+        for px, py in zip(pxs, pys):
+            inside = (abs(index.x - px) <= half) & (abs(index.y - py) <= half)
+            found.append(int(index.fid[inside][0]) if inside.any() else 0)
+        return found
+
+    return cells_on_points
+
+
 class TestSchematicTools(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
@@ -97,6 +132,66 @@ class TestSchematicTools(unittest.TestCase):
             directions = (True if 0 < d < 9 else False for d in s)
             self.assertTrue(all(directions))
 
+    def test_bresenham_cells(self):
+        cols, rows = bresenham_cells([0, 4, 4], [0, 2, 0])
+        expected = [(0, 0), (1, 0), (2, 1), (3, 1), (4, 2), (4, 1), (4, 0)]
+        self.assertListEqual(list(zip(cols.tolist(), rows.tolist())), expected)
+        step_cols, step_rows, dirs = cells_directions(cols, rows)
+        directions = defaultdict(set)
+        for xy_dir in zip(step_cols.tolist(), step_rows.tolist(), dirs.tolist()):
+            directions[xy_dir[:2]].add(xy_dir[2])
+        coords = defaultdict(set)
+        populate_directions(coords, list(zip(cols.tolist(), rows.tolist())))
+        self.assertDictEqual(directions, coords)
+
+    def test_floodplain_xs_cells(self):
+        index = grid_3x3()
+        # North-east diagonal line, nearly eastward line and southward line leaving the grid.
+        x1, y1 = [1.0, 2.0, 14.0], [1.0, 12.0, 22.0]
+        x2, y2 = [27.0, 21.0, 14.0], [28.0, 14.0, -50.0]
+        sections, fids = floodplain_xs_cells(index, x1, y1, x2, y2)
+        self.assertListEqual(sections.tolist(), [0, 0, 0, 1, 1, 1, 2, 2, 2])
+        self.assertListEqual(fids.tolist(), [1, 5, 9, 4, 5, 6, 8, 5, 2])
+
+    def test_floodplain_xs_cells_irregular(self):
+        # Cells 6 and 9 are shifted off the lattice, cell 9 too far to be reached from cell 5.
+        index = grid_3x3({6: (27.0, 15.0), 9: (31.0, 31.0)})
+        self.assertFalse(index.regular)
+        x1, y1 = [1.0, 2.0], [1.0, 12.0]
+        x2, y2 = [27.0, 21.0], [28.0, 14.0]
+        self.assertRaises(ValueError, floodplain_xs_cells, index, x1, y1, x2, y2)
+        sections, fids = floodplain_xs_cells(index, x1, y1, x2, y2, square_cells_lookup(index))
+        self.assertListEqual(sections.tolist(), [0, 0, 1, 1, 1])
+        self.assertListEqual(fids.tolist(), [1, 5, 4, 5, 6])
+
+    def test_levee_octagon_sides(self):
+        index = grid_3x3()
+        fids, x1, y1, x2, y2 = levee_cell_crossings(index, [0.0, 30.0], [12.0, 12.0])
+        self.assertListEqual(fids.tolist(), [4, 5, 6])
+        self.assertListEqual(x1.tolist(), [0.0, 10.0, 20.0])
+        self.assertListEqual(x2.tolist(), [10.0, 20.0, 30.0])
+        pieces, sides = octagon_sides(index.x[fids - 1], index.y[fids - 1], x1, y1, x2, y2)
+        # West to east line below the centroids crosses SW, S and SE sides.
+        self.assertListEqual(pieces.tolist(), [0, 0, 0, 1, 1, 1, 2, 2, 2])
+        self.assertListEqual(sorted(sides[pieces == 1].tolist()), [3, 4, 5])
+
+    def test_levee_opposite_duplicates(self):
+        xs = [5.0, 15.0, 25.0]
+        ys = [5.0, 5.0, 5.0]
+        index = GridIndex([1, 2, 3], xs, ys, [0.0] * 3, [0.04] * 3, 10.0)
+        # East side of cell 1 against west side of cell 2 (lower one deleted), equal crests of cells 2 and 3.
+        to_delete = levee_opposite_duplicates(index, [1, 2, 2, 3, 3], [2, 4, 2, 4, 1], [10.0, 9.0, 5.0, 5.0, 7.0])
+        self.assertListEqual(to_delete, [(2, 4), (3, 4)])
+
+    def test_levee_opposite_duplicates_irregular(self):
+        # Third cell is shifted off the lattice, so neighbours are looked up under the shifted centroids.
+        index = GridIndex([1, 2, 3], [5.0, 15.0, 27.0], [5.0, 5.0, 5.0], [0.0] * 3, [0.04] * 3, 10.0)
+        self.assertFalse(index.regular)
+        args = [1, 2, 2, 3, 3], [2, 4, 2, 4, 1], [10.0, 9.0, 5.0, 5.0, 7.0]
+        self.assertRaises(ValueError, levee_opposite_duplicates, index, *args)
+        to_delete = levee_opposite_duplicates(index, *args, square_cells_lookup(index))
+        self.assertListEqual(to_delete, [(2, 4), (3, 4)])
+
 
 # Running tests:
 if __name__ == "__main__":